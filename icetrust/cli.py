@@ -21,16 +21,39 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import os, shutil, sys, tempfile
+import importlib, sys
 
 import click
-from icetrust.utils import DEFAULT_HASH_ALGORITHM, IcetrustUtils
-from icetrust.utils_canary import FILENAME_FILE1, FILENAME_FILE2, FILENAME_CHECKSUM, FILENAME_SIGNATURE,\
-    IcetrustCanaryUtils, VerificationModes
+from icetrust.cli_common import check_remote_options, echo_result, get_server_socket, process_remote, process_result
+from icetrust.utils import BACKEND_GNUPG, DECOMPRESS_FORMATS, DEFAULT_HASH_ALGORITHM, DEFAULT_PGP_WORKERS, GpgContext,\
+    IcetrustUtils, PGP_BACKENDS, TeeStream, VerificationCache
+
+# FILENAME value used to read the data from stdin
+STDIN_FILENAME = '-'
+
+# Commands defined in other modules, which are only imported when the command is used
+LAZY_COMMANDS = {
+    'archive': 'icetrust.cli_archive.archive',
+    'canary': 'icetrust.cli_canary.canary',
+    'manifest': 'icetrust.cli_manifest.manifest',
+    'serve': 'icetrust.cli_server.serve',
+}
+
+
+class LazyGroup(click.Group):
+    """Command group that imports commands with heavy dependencies only when they are used"""
+    def list_commands(self, ctx):
+        return sorted(list(super().list_commands(ctx)) + list(LAZY_COMMANDS.keys()))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in LAZY_COMMANDS:
+            module_name, _, command_name = LAZY_COMMANDS[cmd_name].rpartition('.')
+            return getattr(importlib.import_module(module_name), command_name)
+        return super().get_command(ctx, cmd_name)
 
 
 @click.version_option(version=IcetrustUtils.get_version(), prog_name='icetrust')
-@click.group()
+@click.group(cls=LazyGroup)
 def cli():
     """
     icetrust - A tool for verification of software downloads using checksums and/or PGP.
@@ -42,142 +65,57 @@ def cli():
     # TODO: Move private code into a separate module
 
 
-def _process_result(verification_result):
-    """Process verification results and exit"""
-    if verification_result:
-        click.echo('File verified')
-        sys.exit(0)
-    else:
-        click.echo('ERROR: File cannot be verified!')
-        sys.exit(-1)
+def _get_stdin(filename, tee):
+    """Returns stdin if FILENAME is "-", copying it to stdout in tee mode, or None for other files"""
+    if filename != STDIN_FILENAME:
+        if tee:
+            click.echo("ERROR: '--tee' can only be used when FILENAME is '-'!")
+            sys.exit(2)
+        return None
+    stream = sys.stdin.buffer
+    if tee:
+        stream = TeeStream(stream, sys.stdout.buffer)
+    return stream
+
+
+def _get_keyserver(keyfile, keyid, keyservers, gpg_home, trust_keyring, err=False):
+    """Check key parameters and return the keyserver, or a list of keyservers, exits on errors"""
+    # Several keyservers are queried concurrently
+    keyserver = None
+    if len(keyservers) == 1:
+        keyserver = keyservers[0]
+    elif len(keyservers) > 1:
+        keyserver = list(keyservers)
+
+    # Check input parameters, keys are optional if they are already in the GPG home or trust keyring
+    if (keyid is None) != (keyserver is None) or \
+            (keyfile is None and keyid is None and gpg_home is None and trust_keyring is None):
+        click.echo("ERROR: Either '--keyfile' or '--keyid/--keyserver' parameters must be set!", err=err)
+        sys.exit(2)
+    return keyserver
 
 
-@cli.command('canary')
-@click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
-@click.option('--output-json', required=False, type=click.Path(dir_okay=False, exists=False),
-              help='Output results of the command into a JSON file')
-@click.option('--save-file', required=False, type=click.Path(dir_okay=False, exists=False),
-              help='Saves the downloaded file to the provided location')
-@click.argument('configfile', required=True, type=click.File('r'))
-def canary(verbose, configfile, output_json, save_file):
-    """Does a canary check against a project using information in CONFIGFILE"""
-    # Setup objects to be used
-    cmd_output = []
-    msg_callback = IcetrustUtils.process_verbose_flag(verbose)
-
-    # Validate the config file
-    config_data = IcetrustCanaryUtils.validate_config_file(configfile, msg_callback=msg_callback)
-    if config_data is None:
-        _process_result(False)
-
-    # Select the right mode
-    verification_mode =\
-        IcetrustCanaryUtils.get_verification_mode(config_data, msg_callback=msg_callback)
-    if verification_mode is None:
-        click.echo('Unknown verification mode in the config file!')
-        _process_result(False)
-    print('Using verification mode: ' + verification_mode.name)
-
-    # Extract verification data
-    verification_data = IcetrustCanaryUtils.extract_verification_data(config_data, verification_mode,
-                                                                      msg_callback=msg_callback)
-
-    # Check verification_data for warnings
-    if verbose:
-        IcetrustCanaryUtils.check_verification_data(config_data, verification_mode, verification_data,
-                                                    msg_callback=msg_callback)
-
-    # Create temporary directory
-    temp_dir_obj = tempfile.TemporaryDirectory()
-    temp_dir = os.path.join(temp_dir_obj.name, '')
-
-    # Download all of the files required
-    IcetrustCanaryUtils.download_all_files(verification_mode, temp_dir, config_data['filename_url'],
-                                           verification_data, msg_callback=msg_callback)
-
-    # Import keys for those operations that need it
-    if verification_mode in [VerificationModes.PGP, VerificationModes.PGPCHECKSUMFILE]:
-        # Initialize PGP
-        gpg = IcetrustUtils.pgp_init(gpg_home_dir=temp_dir_obj.name)
-
-        # Import keys if needed
-        import_output = []
-        import_result = IcetrustCanaryUtils.import_key_material(gpg, temp_dir, verification_data,
-                                                                cmd_output=import_output,
-                                                                msg_callback=msg_callback)
-        if import_result is False:
-            if output_json is not None:
-                json_data = IcetrustCanaryUtils.generate_json(config_data, verification_mode, import_result,
-                                                              import_output, os.path.join(temp_dir, FILENAME_FILE1),
-                                                              msg_callback)
-                open(output_json, "w").write(json_data)
-
-            _process_result(import_result)
-
-    # Main operation code
-    verification_result = False
-    if verification_mode == VerificationModes.COMPARE_FILES:
-        verification_result = IcetrustUtils.compare_files(os.path.join(temp_dir, FILENAME_FILE1),
-                                                          os.path.join(temp_dir, FILENAME_FILE2),
-                                                          msg_callback=msg_callback, cmd_output=cmd_output)
-    elif verification_mode == VerificationModes.CHECKSUM:
-        algorithm = IcetrustCanaryUtils.get_algorithm(verification_data, msg_callback=msg_callback)
-        verification_result = IcetrustUtils.verify_checksum(os.path.join(temp_dir, FILENAME_FILE1), algorithm,
-                                                            checksum_value=verification_data['checksum_value'],
-                                                            msg_callback=msg_callback, cmd_output=cmd_output)
-    elif verification_mode == VerificationModes.CHECKSUMFILE:
-        algorithm = IcetrustCanaryUtils.get_algorithm(verification_data, msg_callback=msg_callback)
-        verification_result = IcetrustUtils.verify_checksum(os.path.join(temp_dir, FILENAME_FILE1), algorithm,
-                                                            checksumfile=os.path.join(temp_dir, FILENAME_CHECKSUM),
-                                                            msg_callback=msg_callback, cmd_output=cmd_output)
-    elif verification_mode == VerificationModes.PGP:
-        verification_result = IcetrustUtils.pgp_verify(gpg, os.path.join(temp_dir, FILENAME_FILE1),
-                                                       os.path.join(temp_dir, FILENAME_SIGNATURE),
-                                                       msg_callback=msg_callback, cmd_output=cmd_output)
-    elif verification_mode == VerificationModes.PGPCHECKSUMFILE:
-        # Verify the signature of the checksum file first
-        signature_result = IcetrustUtils.pgp_verify(gpg, os.path.join(temp_dir, FILENAME_CHECKSUM),
-                                                    os.path.join(temp_dir, FILENAME_SIGNATURE),
-                                                    msg_callback=msg_callback, cmd_output=cmd_output)
-
-        # Then verify the checksums themselves
-        if signature_result:
-            algorithm = IcetrustCanaryUtils.get_algorithm(verification_data, msg_callback=msg_callback)
-            verification_result = IcetrustUtils.verify_checksum(os.path.join(temp_dir, FILENAME_FILE1), algorithm,
-                                                                checksumfile=os.path.join(temp_dir, FILENAME_CHECKSUM),
-                                                                msg_callback=msg_callback, cmd_output=cmd_output)
-    else:
-        click.echo("ERROR: Verification mode not supported!")
-        sys.exit(-1)
+def _init_gpg_context(verbose, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+                      verification_cache_dir=None, err=False):
+    """Check key parameters, setup the GPG context and import keys, exits on errors, messages go to stderr if err
+    is set"""
+    keyserver = _get_keyserver(keyfile, keyid, keyservers, gpg_home, trust_keyring, err=err)
 
-    # Compare previous version if needed
-    comparison_result = None
-    if 'previous_version' in config_data:
-        previous_file_path = os.path.join(os.getcwd(), config_data['previous_version'])
-        if os.path.exists(previous_file_path):
-            click.echo('\nComparing with previous version...')
-            comparison_result = IcetrustUtils.compare_files(config_data['previous_version'],
-                                                            os.path.join(temp_dir, FILENAME_FILE1),
-                                                            msg_callback=msg_callback)
-            if comparison_result:
-                click.echo('File matches previous version')
-            else:
-                click.echo('ERROR: File doesn\'t match previous version!')
-
-    # Saves the file if needed
-    if save_file is not None:
-        click.echo('\nSaving file...')
-        shutil.copy(os.path.join(temp_dir, FILENAME_FILE1), save_file)
-
-    # Generate JSON file if needed
-    if output_json is not None:
-        json_data = IcetrustCanaryUtils.generate_json(config_data, verification_mode,
-                                                      verification_result, comparison_result,
-                                                      cmd_output, os.path.join(temp_dir, FILENAME_FILE1),
-                                                      msg_callback)
-        open(output_json, "w").write(json_data)
-
-    _process_result(verification_result)
+    # Initialize PGP and import keys
+    try:
+        verification_cache = VerificationCache(verification_cache_dir) if verification_cache_dir is not None else None
+        gpg_context = GpgContext(gpg_home_dir=gpg_home, trust_keyring=trust_keyring, backend=backend,
+                                 verification_cache=verification_cache)
+    except (RuntimeError, ValueError) as error:
+        click.echo('ERROR: ' + str(error), err=err)
+        sys.exit(2)
+    if keyfile is not None or keyid is not None:
+        import_result = gpg_context.import_keys(keyfile=keyfile, keyid=keyid, keyserver=keyserver,
+                                                msg_callback=IcetrustUtils.process_verbose_flag(verbose, err=err))
+        if import_result is False:
+            gpg_context.close()
+            process_result(import_result, err=err)
+    return gpg_context
 
 
 @cli.command('compare_files')
@@ -188,61 +126,158 @@ def compare_files(verbose, file1, file2):
     """Compares FILE1 against FILE2 by calculating checksums"""
     comparison_result = IcetrustUtils.compare_files(file1, file2,
                                                     msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    _process_result(comparison_result)
+    process_result(comparison_result)
 
 
 @cli.command('checksum')
 @click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
-@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False))
+@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False, allow_dash=True))
 @click.argument('checksum_value', required=True)
 @click.option('--algorithm', default=DEFAULT_HASH_ALGORITHM, help='Hash algorithm to be used (sha1, sha256 or sha512)',
               type=click.Choice(['sha1', 'sha256', 'sha512'], case_sensitive=False))
-def checksum(verbose, filename, checksum_value, algorithm):
-    """Verify FILENAME against the CHECKSUM_VALUE"""
+@click.option('--decompress', required=False, type=click.Choice(DECOMPRESS_FORMATS),
+              help='Decompress FILENAME while hashing it (gz, bz2 or xz), for checksums of the uncompressed content')
+@click.option('--tee', is_flag=True,
+              help='When reading from stdin, copy the data to stdout unchanged and output messages to stderr')
+def checksum(verbose, filename, checksum_value, algorithm, decompress, tee):
+    """Verify FILENAME against the CHECKSUM_VALUE, use "-" to read from stdin"""
+    stdin = _get_stdin(filename, tee)
+    if stdin is not None:
+        checksum_valid = IcetrustUtils.verify_checksum_stream(stdin, algorithm, checksum_value=checksum_value,
+                                                              msg_callback=IcetrustUtils.process_verbose_flag(
+                                                                  verbose, err=tee), decompress=decompress)
+        process_result(checksum_valid, err=tee)
+    if get_server_socket():
+        process_remote(verbose, 'checksum', filename=filename, checksum_value=checksum_value, algorithm=algorithm,
+                        decompress=decompress)
     checksum_valid = IcetrustUtils.verify_checksum(filename, algorithm, checksum_value=checksum_value,
-                                                   msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    _process_result(checksum_valid)
+                                                   msg_callback=IcetrustUtils.process_verbose_flag(verbose),
+                                                   decompress=decompress)
+    process_result(checksum_valid)
 
 
 @cli.command('checksumfile')
 @click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
-@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False))
+@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False, allow_dash=True))
 @click.argument('checksumfile', required=True, type=click.Path(exists=True, dir_okay=False))
 @click.option('--algorithm', default=DEFAULT_HASH_ALGORITHM, help='Hash algorithm to be used (sha1, sha256 or sha512)',
               type=click.Choice(['sha1', 'sha256', 'sha512'], case_sensitive=False))
-def checksumfile(verbose, filename, checksumfile, algorithm):
-    """Verify FILENAME against a checksum value in the CHECKSUMFILE"""
+@click.option('--decompress', required=False, type=click.Choice(DECOMPRESS_FORMATS),
+              help='Decompress FILENAME while hashing it (gz, bz2 or xz), for checksums of the uncompressed content')
+@click.option('--tee', is_flag=True,
+              help='When reading from stdin, copy the data to stdout unchanged and output messages to stderr')
+def checksumfile(verbose, filename, checksumfile, algorithm, decompress, tee):
+    """Verify FILENAME against a checksum value in the CHECKSUMFILE, use "-" to read from stdin"""
+    stdin = _get_stdin(filename, tee)
+    if stdin is not None:
+        checksum_valid = IcetrustUtils.verify_checksum_stream(stdin, algorithm, checksumfile=checksumfile,
+                                                              msg_callback=IcetrustUtils.process_verbose_flag(
+                                                                  verbose, err=tee), decompress=decompress)
+        process_result(checksum_valid, err=tee)
+    if get_server_socket():
+        process_remote(verbose, 'checksumfile', filename=filename, checksumfile=checksumfile, algorithm=algorithm,
+                        decompress=decompress)
     checksum_valid = IcetrustUtils.verify_checksum(filename, algorithm, checksumfile=checksumfile,
-                                                   msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    _process_result(checksum_valid)
+                                                   msg_callback=IcetrustUtils.process_verbose_flag(verbose),
+                                                   decompress=decompress)
+    process_result(checksum_valid)
 
 
 @cli.command('pgp')
 @click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
-@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False))
+@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False, allow_dash=True))
 @click.argument('signaturefile', required=True, type=click.Path(exists=True, dir_okay=False))
 @click.option('--keyfile', required=False, type=click.Path(exists=True, dir_okay=False),
               help='File containing PGP keys')
 @click.option('--keyid', required=False, help='PGP key ID')
-@click.option('--keyserver', required=False, help='Domain name of the PGP keyserver')
-def pgp(verbose, filename, signaturefile, keyfile, keyid, keyserver):
-    """Verify FILENAME via a PGP signature in SIGNATUREFILE using provided keys"""
+@click.option('--keyserver', 'keyservers', multiple=True,
+              help='Domain name of the PGP keyserver, can be used multiple times to query several keyservers at once')
+@click.option('--gpg-home', required=False, type=click.Path(exists=True, file_okay=False),
+              help='Persistent GPG home directory, keys imported into it are kept between runs')
+@click.option('--trust-keyring', required=False, type=click.Path(exists=True, dir_okay=False),
+              help='Keyring file with trusted keys, used read-only')
+@click.option('--backend', default=BACKEND_GNUPG, type=click.Choice(PGP_BACKENDS),
+              help='OpenPGP backend, "pgpy" verifies in-process without running gpg')
+@click.option('--verification-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache successful verifications between runs')
+@click.option('--tee', is_flag=True,
+              help='When reading from stdin, copy the data to stdout unchanged and output messages to stderr')
+def pgp(verbose, filename, signaturefile, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+        verification_cache_dir, tee):
+    """Verify FILENAME via a PGP signature in SIGNATUREFILE using provided keys, use "-" to read from stdin"""
+    stdin = _get_stdin(filename, tee)
+    if stdin is not None:
+        # Keys are imported before any data is read, the verification cache isn't used for streams
+        with _init_gpg_context(verbose, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+                               err=tee) as gpg_context:
+            with open(signaturefile, 'rb') as signature:
+                verification_result = gpg_context.verify_stream(stdin, signature,
+                                                                msg_callback=IcetrustUtils.process_verbose_flag(
+                                                                    verbose, err=tee))
+        process_result(verification_result, err=tee)
+    if get_server_socket():
+        check_remote_options(verification_cache_dir=(verification_cache_dir, None))
+        process_remote(verbose, 'pgp', filename=filename, signaturefile=signaturefile, keyfile=keyfile, keyid=keyid,
+                        keyserver=_get_keyserver(keyfile, keyid, keyservers, gpg_home, trust_keyring),
+                        gpg_home=gpg_home, trust_keyring=trust_keyring, backend=backend)
+
+    with _init_gpg_context(verbose, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+                           verification_cache_dir) as gpg_context:
+        # Verify file
+        verification_result = gpg_context.verify(filename, signaturefile,
+                                                 msg_callback=IcetrustUtils.process_verbose_flag(verbose))
+    process_result(verification_result)
+
+
+@cli.command('pgpbatch')
+@click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
+@click.option('--pair', 'pairs', multiple=True, nargs=2, type=click.Path(exists=True, dir_okay=False),
+              help='File and its signature file, can be used multiple times')
+@click.option('--dir', 'directories', multiple=True, type=click.Path(exists=True, file_okay=False),
+              help='Directory with files and their .sig/.asc signature files, can be used multiple times')
+@click.option('--keyfile', required=False, type=click.Path(exists=True, dir_okay=False),
+              help='File containing PGP keys')
+@click.option('--keyid', required=False, help='PGP key ID')
+@click.option('--keyserver', 'keyservers', multiple=True,
+              help='Domain name of the PGP keyserver, can be used multiple times to query several keyservers at once')
+@click.option('--gpg-home', required=False, type=click.Path(exists=True, file_okay=False),
+              help='Persistent GPG home directory, keys imported into it are kept between runs')
+@click.option('--trust-keyring', required=False, type=click.Path(exists=True, dir_okay=False),
+              help='Keyring file with trusted keys, used read-only')
+@click.option('--backend', default=BACKEND_GNUPG, type=click.Choice(PGP_BACKENDS),
+              help='OpenPGP backend, "pgpy" verifies in-process without running gpg')
+@click.option('--verification-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache successful verifications between runs')
+@click.option('--jobs', default=DEFAULT_PGP_WORKERS, type=click.IntRange(min=1),
+              help='Maximum number of concurrent gpg processes')
+def pgpbatch(verbose, pairs, directories, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+             verification_cache_dir, jobs):
+    """Verify many files via PGP signatures in a single run using provided keys"""
     # Check input parameters
-    if keyfile is None and (keyid is None or keyserver is None):
-        click.echo("ERROR: Either '--keyfile' or '--keyid/--keyserver' parameters must be set!")
+    if not pairs and not directories:
+        click.echo("ERROR: Either '--pair' or '--dir' parameters must be set!")
         sys.exit(2)
 
-    # Initialize PGP and import keys
-    gpg = IcetrustUtils.pgp_init(verbose)
-    import_result = IcetrustUtils.pgp_import_keys(gpg, keyfile=keyfile, keyid=keyid, keyserver=keyserver,
-                                                  msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    if import_result is False:
-        _process_result(import_result)
-
-    # Verify file
-    verification_result = IcetrustUtils.pgp_verify(gpg, filename, signaturefile,
-                                                   msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    _process_result(verification_result)
+    # Collect files and signatures to verify
+    all_pairs = list(pairs)
+    for directory in directories:
+        all_pairs.extend(IcetrustUtils.pgp_find_signatures(directory))
+    if not all_pairs:
+        click.echo('ERROR: No files with signatures found!')
+        sys.exit(-1)
+
+    # Verify files, results are output as soon as each file is verified
+    all_verified = True
+    with _init_gpg_context(verbose, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+                           verification_cache_dir) as gpg_context:
+        for filename, signaturefile, verification_result, output in \
+                gpg_context.verify_batch(all_pairs, max_workers=jobs,
+                                         msg_callback=IcetrustUtils.process_verbose_flag(verbose)):
+            click.echo(filename + ': ', nl=False)
+            echo_result(verification_result)
+            all_verified = all_verified and verification_result
+
+    sys.exit(0 if all_verified else -1)
 
 
 @cli.command('pgpchecksumfile')
@@ -255,31 +290,38 @@ def pgp(verbose, filename, signaturefile, keyfile, keyid, keyserver):
 @click.option('--keyfile', required=False, type=click.Path(exists=True, dir_okay=False),
               help='File containing PGP keys')
 @click.option('--keyid', required=False, help='PGP key ID')
-@click.option('--keyserver', required=False, help='Domain name of the PGP keyserver')
-def pgpchecksumfile(verbose, filename, checksumfile, signaturefile, algorithm, keyfile, keyid, keyserver):
+@click.option('--keyserver', 'keyservers', multiple=True,
+              help='Domain name of the PGP keyserver, can be used multiple times to query several keyservers at once')
+@click.option('--gpg-home', required=False, type=click.Path(exists=True, file_okay=False),
+              help='Persistent GPG home directory, keys imported into it are kept between runs')
+@click.option('--trust-keyring', required=False, type=click.Path(exists=True, dir_okay=False),
+              help='Keyring file with trusted keys, used read-only')
+@click.option('--backend', default=BACKEND_GNUPG, type=click.Choice(PGP_BACKENDS),
+              help='OpenPGP backend, "pgpy" verifies in-process without running gpg')
+@click.option('--verification-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache successful verifications between runs')
+def pgpchecksumfile(verbose, filename, checksumfile, signaturefile, algorithm, keyfile, keyid, keyservers, gpg_home,
+                    trust_keyring, backend, verification_cache_dir):
     """Verify FILENAME via a PGP-signed CHECKSUMFILE, with a signature in SIGNATUREFILE using provided keys"""
-    # Check input parameters
-    if keyfile is None and (keyid is None or keyserver is None):
-        click.echo("ERROR: Either '--keyfile' or '--keyid/--keyserver' parameters must be set!")
-        sys.exit(2)
-
-    # Initialize PGP and import keys
-    gpg = IcetrustUtils.pgp_init(verbose)
-    import_result = IcetrustUtils.pgp_import_keys(gpg, keyfile=keyfile, keyid=keyid, keyserver=keyserver,
-                                                  msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    if import_result is False:
-        _process_result(import_result)
-
-    # Verify checksums file
-    verification_result = IcetrustUtils.pgp_verify(gpg, checksumfile, signaturefile,
-                                                   msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    if verification_result.status is False:
-        _process_result(verification_result)
+    if get_server_socket():
+        check_remote_options(verification_cache_dir=(verification_cache_dir, None))
+        process_remote(verbose, 'pgpchecksumfile', filename=filename, checksumfile=checksumfile,
+                        signaturefile=signaturefile, algorithm=algorithm, keyfile=keyfile, keyid=keyid,
+                        keyserver=_get_keyserver(keyfile, keyid, keyservers, gpg_home, trust_keyring),
+                        gpg_home=gpg_home, trust_keyring=trust_keyring, backend=backend)
+
+    with _init_gpg_context(verbose, keyfile, keyid, keyservers, gpg_home, trust_keyring, backend,
+                           verification_cache_dir) as gpg_context:
+        # Verify checksums file
+        verification_result = gpg_context.verify(checksumfile, signaturefile,
+                                                 msg_callback=IcetrustUtils.process_verbose_flag(verbose))
+    if verification_result is False:
+        process_result(verification_result)
 
     # Check hash against the checksums file
     checksum_valid = IcetrustUtils.verify_checksum(filename, algorithm, checksumfile=checksumfile,
                                                    msg_callback=IcetrustUtils.process_verbose_flag(verbose))
-    _process_result(checksum_valid)
+    process_result(checksum_valid)
 
 
 if __name__ == '__main__':
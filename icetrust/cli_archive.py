@@ -0,0 +1,50 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import sys
+
+import click
+from icetrust.cli_common import process_result
+from icetrust.utils import DEFAULT_HASH_ALGORITHM, IcetrustUtils
+from icetrust.utils_archive import IcetrustArchiveUtils
+from icetrust.utils_manifest import MANIFEST_ALGORITHMS
+
+
+@click.command('archive')
+@click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
+@click.argument('filename', required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--manifest', 'manifestfile', required=False, type=click.Path(exists=True, dir_okay=False),
+              help='Checksum file listing the members, required unless FILENAME is a wheel with a RECORD file')
+@click.option('--algorithm', default=DEFAULT_HASH_ALGORITHM,
+              type=click.Choice(list(MANIFEST_ALGORITHMS.keys()), case_sensitive=False),
+              help='Hash algorithm of manifest lines without an algorithm tag (sha1, sha256 or sha512)')
+def archive(verbose, filename, manifestfile, algorithm):
+    """Verifies every member of a wheel, zip or tar archive FILENAME without extracting it"""
+    try:
+        verification_result = IcetrustArchiveUtils.verify_archive(
+            filename, msg_callback=IcetrustUtils.process_verbose_flag(verbose), manifestfile=manifestfile,
+            algorithm=algorithm.lower())
+    except ValueError as err:
+        click.echo('ERROR: ' + str(err))
+        sys.exit(2)
+    process_result(verification_result)
@@ -0,0 +1,177 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from contextlib import ExitStack
+import sys
+
+import click
+from icetrust.cli_common import check_remote_options, echo_result, get_server_socket, request_remote
+from icetrust.utils import DEFAULT_KEY_CACHE_TTL, IcetrustUtils, KeyCache, VerificationCache
+from icetrust.utils_canary import DEFAULT_CONNECT_TIMEOUT, DEFAULT_HOST_CONCURRENCY, DEFAULT_HOST_RATE,\
+    DEFAULT_NDJSON_BATCH_SIZE, DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES, DownloadPolicy, FetchPlan, HostLimiter,\
+    IcetrustCanaryUtils, NdjsonWriter
+
+
+@click.command('canary')
+@click.option('--verbose', is_flag=True, help='Output additional information during the verification process')
+@click.option('--output-json', required=False, type=click.Path(dir_okay=False, exists=False),
+              help='Output the result of the command into a JSON file, as a single object')
+@click.option('--output-ndjson', required=False, type=click.Path(dir_okay=False, exists=False, allow_dash=True),
+              help='Append results as newline-delimited JSON to a file, use "-" for stdout (messages go to stderr)')
+@click.option('--ndjson-batch-size', default=DEFAULT_NDJSON_BATCH_SIZE, type=click.IntRange(min=1),
+              help='Number of NDJSON records to write before flushing the output')
+@click.option('--save-file', required=False, type=click.Path(dir_okay=False, exists=False),
+              help='Saves the downloaded file to the provided location')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='Number of config files to check in parallel, configs are started by priority, then deadline')
+@click.option('--max-host-connections', default=DEFAULT_HOST_CONCURRENCY, type=click.IntRange(min=1),
+              help='Maximum number of concurrent downloads from a single host')
+@click.option('--max-host-rate', default=DEFAULT_HOST_RATE, type=click.FloatRange(min=0),
+              help='Maximum number of requests per second to a single host, use 0 for no limit')
+@click.option('--connect-timeout', default=DEFAULT_CONNECT_TIMEOUT, type=click.FloatRange(min=0.1),
+              help='Timeout in seconds for connecting to the server when downloading')
+@click.option('--read-timeout', default=DEFAULT_READ_TIMEOUT, type=click.FloatRange(min=0.1),
+              help='Timeout in seconds between data received from the server when downloading')
+@click.option('--retries', default=DEFAULT_RETRIES, type=click.IntRange(min=0),
+              help='Number of retries for failed downloads, with exponential backoff')
+@click.option('--hedge', is_flag=True,
+              help='Send a second request for small files if the first one is slower than usual')
+@click.option('--key-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache keys from key servers between runs')
+@click.option('--key-cache-ttl', default=DEFAULT_KEY_CACHE_TTL, type=click.IntRange(min=0),
+              help='Time in seconds after which cached keys are refreshed and re-checked for revocation and expiry')
+@click.option('--verification-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache successful signature verifications between runs')
+@click.option('--validate-only', is_flag=True,
+              help='Only validate the config files against the schema without running the checks')
+@click.argument('configfiles', required=True, nargs=-1, type=click.File('r'))
+def canary(verbose, configfiles, output_json, output_ndjson, ndjson_batch_size, save_file, jobs,
+           max_host_connections, max_host_rate, connect_timeout, read_timeout, retries, hedge, key_cache_dir,
+           key_cache_ttl, verification_cache_dir, validate_only):
+    """Does a canary check against a project using information in one or more CONFIGFILES"""
+    # When NDJSON records are written to stdout, all other output goes to stderr
+    err = output_ndjson == '-'
+
+    # Check input parameters
+    if len(configfiles) > 1 and (output_json is not None or save_file is not None):
+        click.echo("ERROR: '--output-json' and '--save-file' can only be used with a single config file!", err=err)
+        sys.exit(2)
+
+    # Validate the config files
+    msg_callback = IcetrustUtils.process_verbose_flag(verbose, err=err)
+    validated_configs = IcetrustCanaryUtils.validate_config_files(configfiles, msg_callback=msg_callback)
+    if validate_only:
+        for configfile, config_data in zip(configfiles, validated_configs):
+            click.echo(configfile.name + ': ' + ('Config file is valid' if config_data is not None
+                                                 else 'ERROR: Config file is not valid!'), err=err)
+        sys.exit(0 if all(config_data is not None for config_data in validated_configs) else -1)
+
+    # The JSON output always contains a single result object, configs with several files need NDJSON
+    if output_json is not None and any(len(IcetrustCanaryUtils.get_filename_urls(config_data)) > 1
+                                       for config_data in validated_configs if config_data is not None):
+        click.echo("ERROR: '--output-json' can only be used with a single file, use '--output-ndjson' for configs "
+                   "with 'filename_urls'!", err=err)
+        sys.exit(2)
+
+    # The verification server uses its own download settings and caches
+    remote = get_server_socket() is not None
+    if remote:
+        check_remote_options(err=err, max_host_connections=(max_host_connections, DEFAULT_HOST_CONCURRENCY),
+                              max_host_rate=(max_host_rate, DEFAULT_HOST_RATE),
+                              connect_timeout=(connect_timeout, DEFAULT_CONNECT_TIMEOUT),
+                              read_timeout=(read_timeout, DEFAULT_READ_TIMEOUT), retries=(retries, DEFAULT_RETRIES),
+                              hedge=(hedge, False), key_cache_dir=(key_cache_dir, None),
+                              key_cache_ttl=(key_cache_ttl, DEFAULT_KEY_CACHE_TTL),
+                              verification_cache_dir=(verification_cache_dir, None))
+
+    # Setup objects to be used
+    ndjson_writer = None
+    if output_ndjson is not None:
+        ndjson_writer = NdjsonWriter(output_ndjson, batch_size=ndjson_batch_size)
+
+    # Invalid config files are reported as failed
+    all_verified = True
+    configs = []
+    for config_data in validated_configs:
+        if config_data is None:
+            all_verified = False
+            echo_result(False, err=err)
+        else:
+            configs.append(config_data)
+
+    # Run the actual checks in order of priority, sharing downloads and keys between configs, or send them to
+    # the verification server if one is used
+    def run_config(config_data):
+        if remote:
+            return request_remote(verbose, 'canary', err=err, config=config_data,
+                                   save_file=save_file).get('results')
+        return IcetrustCanaryUtils.canary_run(config_data, msg_callback=msg_callback, save_file=save_file,
+                                              fetch_plan=fetch_plan, err=err)
+
+    configs = IcetrustCanaryUtils.sort_by_priority(configs)
+    try:
+        with ExitStack() as stack:
+            fetch_plan = None
+            if not remote:
+                host_limiter = HostLimiter(max_host_connections, max_host_rate)
+                download_policy = DownloadPolicy(connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                                 retries=retries, hedge=hedge)
+                key_cache = KeyCache(key_cache_dir, ttl=key_cache_ttl) if key_cache_dir is not None else None
+                verification_cache = VerificationCache(verification_cache_dir) \
+                    if verification_cache_dir is not None else None
+                fetch_plan = stack.enter_context(FetchPlan(configs, host_limiter=host_limiter,
+                                                           download_policy=download_policy, key_cache=key_cache,
+                                                           verification_cache=verification_cache))
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=jobs))
+            futures = {executor.submit(run_config, config_data): config_data for config_data in configs}
+            for future in as_completed(futures):
+                # A config that fails with an error doesn't stop the checks of the other configs
+                try:
+                    output_objs = future.result()
+                except Exception as error:
+                    click.echo('ERROR: ' + futures[future]['name'] + ': ' + (str(error) or type(error).__name__),
+                               err=err)
+                    output_objs = [IcetrustCanaryUtils.generate_error_output(futures[future], error,
+                                                                             filename_url=filename_url)
+                                   for filename_url in IcetrustCanaryUtils.get_filename_urls(futures[future])]
+                if output_objs is None:
+                    all_verified = False
+                    echo_result(False, err=err)
+                    continue
+
+                # Generate output if needed
+                if output_json is not None:
+                    json_data = IcetrustCanaryUtils.format_json(output_objs[0], msg_callback=msg_callback)
+                    open(output_json, "w").write(json_data)
+                for output_obj in output_objs:
+                    if ndjson_writer is not None:
+                        ndjson_writer.write(output_obj)
+
+                    all_verified = all_verified and output_obj['verified']
+                    echo_result(output_obj['verified'], err=err)
+    finally:
+        if ndjson_writer is not None:
+            ndjson_writer.close()
+
+    sys.exit(0 if all_verified else -1)
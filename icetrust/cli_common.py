@@ -0,0 +1,85 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os, sys
+
+import click
+from icetrust.utils import SERVER_SOCKET_ENV
+
+def echo_result(verification_result, err=False):
+    """Output verification results, to stderr if err is set"""
+    if verification_result:
+        click.echo('File verified', err=err)
+    else:
+        click.echo('ERROR: File cannot be verified!', err=err)
+
+
+def process_result(verification_result, err=False):
+    """Process verification results and exit"""
+    echo_result(verification_result, err=err)
+    if verification_result:
+        sys.exit(0)
+    else:
+        sys.exit(-1)
+
+
+def get_server_socket():
+    """Returns the socket of the verification server to send commands to, or None to run them locally"""
+    return os.environ.get(SERVER_SOCKET_ENV) or None
+
+
+def check_remote_options(err=False, **options):
+    """
+    Exits with an error if options are set that can't be used with the verification server, the server uses its
+    own settings for them
+
+    :param err: output the error to stderr
+    :param options: option values and their defaults as (value, default) tuples, keyed by the parameter name
+    """
+    for name, (value, default) in sorted(options.items()):
+        if value != default:
+            click.echo("ERROR: '--" + name.replace('_', '-') + "' can't be used with the verification server!",
+                       err=err)
+            sys.exit(2)
+
+
+def request_remote(verbose, command, err=False, **arguments):
+    """Sends a command to the verification server and returns the response, exits on errors"""
+    # Imported here so that commands run locally don't pay for loading the server module
+    from icetrust.utils_server import IcetrustClient
+    with IcetrustClient(get_server_socket()) as client:
+        try:
+            response = client.request(command, verbose=verbose, **arguments)
+        except (OSError, ValueError) as error:
+            click.echo('ERROR: Cannot connect to the verification server: ' + str(error), err=err)
+            sys.exit(2)
+    for message in response.get('messages', []):
+        click.echo(message, err=err)
+    if response.get('error'):
+        click.echo('ERROR: ' + response['error'], err=err)
+    return response
+
+
+def process_remote(verbose, command, **arguments):
+    """Sends a command to the verification server, then processes the results and exits"""
+    process_result(request_remote(verbose, command, **arguments)['verified'])
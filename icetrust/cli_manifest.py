@@ -0,0 +1,105 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import os, sys
+
+import click
+from icetrust.utils import DEFAULT_HASH_ALGORITHM, IcetrustUtils
+from icetrust.utils_manifest import IcetrustManifestUtils, MANIFEST_ALGORITHMS, MANIFEST_FORMAT_GNU, \
+    MANIFEST_FORMATS
+
+# Extension of the detached signatures of manifest files
+SIGNATURE_EXTENSION = '.asc'
+
+
+@click.command('manifest')
+@click.option('--verbose', is_flag=True, help='Output additional information while generating the manifest')
+@click.argument('directory', required=True, type=click.Path(exists=True, file_okay=False))
+@click.option('--algorithm', 'algorithms', multiple=True, default=[DEFAULT_HASH_ALGORITHM],
+              type=click.Choice(list(MANIFEST_ALGORITHMS.keys()), case_sensitive=False),
+              help='Hash algorithm to be used (sha1, sha256 or sha512), can be repeated to write several manifests')
+@click.option('--format', 'manifest_format', default=MANIFEST_FORMAT_GNU,
+              type=click.Choice(MANIFEST_FORMATS, case_sensitive=False),
+              help='Format of the manifest, "gnu" as written by sha256sum or "bsd" as written by "shasum --tag"')
+@click.option('--output-dir', required=False, type=click.Path(exists=True, file_okay=False),
+              help='Directory to write the manifests to, defaults to DIRECTORY, paths are written relative to it')
+@click.option('--jobs', default=os.cpu_count() or 1, type=click.IntRange(min=1),
+              help='Number of processes used to hash files')
+@click.option('--state-file', required=False, type=click.Path(dir_okay=False),
+              help='File used to remember sizes and modification times, unchanged files are not hashed again')
+@click.option('--sign', is_flag=True, help='Create detached PGP signatures of the manifests (.asc files)')
+@click.option('--gpg-home', required=False, type=click.Path(exists=True, file_okay=False),
+              help='GPG home directory containing the secret key used with --sign')
+@click.option('--local-user', required=False, help='ID or fingerprint of the key used with --sign')
+def manifest(verbose, directory, algorithms, manifest_format, output_dir, jobs, state_file, sign, gpg_home,
+             local_user):
+    """Writes checksum files such as SHA256SUMS for all files in DIRECTORY"""
+    msg_callback = IcetrustUtils.process_verbose_flag(verbose)
+    if sign and gpg_home is None:
+        click.echo("ERROR: '--sign' requires '--gpg-home'!")
+        sys.exit(2)
+    if output_dir is None:
+        output_dir = directory
+
+    # Remove duplicates while keeping the order, the manifests and their signatures aren't part of the manifest
+    algorithms = list(dict.fromkeys(algorithm.lower() for algorithm in algorithms))
+    manifest_files = [os.path.join(output_dir, MANIFEST_ALGORITHMS[algorithm][0])
+                      for algorithm in MANIFEST_ALGORITHMS]
+    exclude = manifest_files + [manifest_file + SIGNATURE_EXTENSION for manifest_file in manifest_files]
+    if state_file is not None:
+        exclude.append(state_file)
+
+    # Hash the files, skipping files that are unchanged since the last run
+    state = IcetrustManifestUtils.load_state(state_file) if state_file is not None else None
+    try:
+        relpaths = IcetrustManifestUtils.find_files(directory, exclude=exclude)
+        hashes, state, hashed_count = IcetrustManifestUtils.hash_files(directory, relpaths, algorithms,
+                                                                       max_workers=jobs, state=state)
+        if msg_callback:
+            msg_callback.echo('Files: ' + str(len(relpaths)) + ', hashed: ' + str(hashed_count) +
+                              ', unchanged: ' + str(len(relpaths) - hashed_count))
+        manifest_files = IcetrustManifestUtils.write_manifests(output_dir, hashes, algorithms,
+                                                               manifest_format=manifest_format.lower(),
+                                                               directory=directory)
+        if state_file is not None:
+            IcetrustManifestUtils.save_state(state_file, state)
+    except OSError as err:
+        click.echo('ERROR: ' + str(err))
+        sys.exit(-1)
+    for manifest_file in manifest_files:
+        click.echo('Manifest written: ' + manifest_file)
+
+    # Sign the manifests, python-gnupg is only imported when needed
+    if sign:
+        try:
+            gpg = IcetrustUtils.pgp_init(gpg_home_dir=gpg_home)
+        except (RuntimeError, ValueError) as error:
+            click.echo('ERROR: ' + str(error))
+            sys.exit(2)
+        for manifest_file in manifest_files:
+            signaturefile = manifest_file + SIGNATURE_EXTENSION
+            if not IcetrustUtils.pgp_sign(gpg, manifest_file, signaturefile, keyid=local_user,
+                                          msg_callback=msg_callback):
+                click.echo('ERROR: Manifest cannot be signed: ' + manifest_file)
+                sys.exit(-1)
+            click.echo('Signature written: ' + signaturefile)
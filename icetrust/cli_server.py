@@ -0,0 +1,61 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import signal, sys
+
+import click
+from icetrust.utils import DEFAULT_KEY_CACHE_TTL, KeyCache, SERVER_SOCKET_ENV, VerificationCache
+from icetrust.utils_server import DEFAULT_SERVER_WORKERS, IcetrustServer
+
+
+@click.command('serve')
+@click.option('--socket', 'socket_path', required=True, envvar=SERVER_SOCKET_ENV, type=click.Path(dir_okay=False),
+              help='Unix socket to listen on, defaults to the ' + SERVER_SOCKET_ENV + ' environment variable')
+@click.option('--jobs', default=DEFAULT_SERVER_WORKERS, type=click.IntRange(min=1),
+              help='Number of requests to handle concurrently')
+@click.option('--key-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache keys from key servers between runs')
+@click.option('--key-cache-ttl', default=DEFAULT_KEY_CACHE_TTL, type=click.IntRange(min=0),
+              help='Time in seconds after which keys from key servers are refreshed and re-checked for revocation')
+@click.option('--verification-cache-dir', required=False, type=click.Path(file_okay=False, exists=False),
+              help='Directory used to cache successful signature verifications between runs')
+def serve(socket_path, jobs, key_cache_dir, key_cache_ttl, verification_cache_dir):
+    """Runs a verification server on a Unix socket, other commands use it if ICETRUST_SOCKET is set"""
+    key_cache = KeyCache(key_cache_dir, ttl=key_cache_ttl) if key_cache_dir is not None else None
+    verification_cache = VerificationCache(verification_cache_dir) if verification_cache_dir is not None else None
+
+    with IcetrustServer(socket_path, max_workers=jobs, key_cache=key_cache, key_cache_ttl=key_cache_ttl,
+                        verification_cache=verification_cache) as server:
+        try:
+            server.bind()
+        except (OSError, RuntimeError) as err:
+            click.echo('ERROR: ' + str(err))
+            sys.exit(2)
+        click.echo('Listening on: ' + socket_path)
+
+        # Shut down cleanly when terminated, so the socket is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
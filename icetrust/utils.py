@@ -21,14 +21,65 @@
 # specific language governing permissions and limitations
 # under the License.
 #
+from collections import OrderedDict
 from pathlib import Path
-import tempfile
+from urllib.parse import urlparse
+import hashlib, io, json, os, subprocess, tempfile, threading, time
 
-import click, filehash, gnupg
+from filehash.filehash import Adler32, CRC32
+import click, filehash
 
 # Default hash algorithm to use for checksums
 DEFAULT_HASH_ALGORITHM = 'sha256'
 
+# Available OpenPGP backends: gpg via python-gnupg, or in-process verification via pgpy
+BACKEND_GNUPG = 'gnupg'
+BACKEND_PGPY = 'pgpy'
+PGP_BACKENDS = [BACKEND_GNUPG, BACKEND_PGPY]
+
+# Default number of concurrent gpg processes used for batch verification
+DEFAULT_PGP_WORKERS = 4
+
+# Extensions of detached signature files, in order of preference
+SIGNATURE_EXTENSIONS = ['.sig', '.asc']
+
+# Environment variable with the socket of a running server, commands are sent to the server when it is set
+SERVER_SOCKET_ENV = 'ICETRUST_SOCKET'
+
+# Default time in seconds after which keys in the key cache are refreshed from the key server
+DEFAULT_KEY_CACHE_TTL = 86400
+
+# Path and default ports used for key lookups on HKP key servers
+HKP_LOOKUP_PATH = '/pks/lookup'
+HKP_PORT = 11371
+
+# Default timeout in seconds for key server requests
+DEFAULT_KEYSERVER_TIMEOUT = 10.0
+
+# Prefix of status lines written by gpg to the status file descriptor
+GPG_STATUS_PREFIX = '[GNUPG:] '
+
+# Size of chunks used when reading streams
+STREAM_CHUNK_SIZE = 65536
+
+# Checksum algorithms supported by filehash that are not available in hashlib
+ZLIB_HASHERS = {'adler32': Adler32, 'crc32': CRC32}
+
+# Compression formats that can be decompressed while hashing, for checksums of the uncompressed content
+DECOMPRESS_GZ = 'gz'
+DECOMPRESS_BZ2 = 'bz2'
+DECOMPRESS_XZ = 'xz'
+DECOMPRESS_FORMATS = [DECOMPRESS_GZ, DECOMPRESS_BZ2, DECOMPRESS_XZ]
+
+# Default maximum number of entries kept in the verification cache, the least recently used ones are evicted
+DEFAULT_VERIFICATION_CACHE_SIZE = 10000
+
+# Fraction of the verification cache removed at once when it is full, so the directory isn't scanned on every put
+VERIFICATION_CACHE_EVICT_FRACTION = 0.1
+
+# Default maximum number of entries in the in-memory cache of file hashes
+DEFAULT_HASH_CACHE_SIZE = 100000
+
 
 # Helper objects
 class MsgCallback(object):
@@ -41,6 +92,572 @@ class MsgCallback(object):
         self.messages.append(message)
 
 
+class ErrCallback(object):
+    """Used for message callback methods when stdout carries data, outputs messages to stderr"""
+    def echo(self, message):
+        """Echos the message to stderr"""
+        click.echo(message, err=True)
+
+
+class TeeStream(object):
+    """Binary stream that copies all data read from it to an output stream, used to pass data through unchanged"""
+    def __init__(self, stream, output):
+        """
+        :param stream: binary stream to read from
+        :param output: binary stream the data is copied to
+        """
+        self.stream = stream
+        self.output = output
+
+    def read(self, size=-1):
+        """Reads from the stream and writes the data to the output"""
+        data = self.stream.read(size)
+        if data and self.output is not None:
+            try:
+                self.output.write(data)
+                self.output.flush()
+            except BrokenPipeError:
+                # The reader went away, the rest of the data is still read and verified
+                self.output = None
+        return data
+
+
+class GpgImportResult(object):
+    """Results of a key import parsed from gpg status output, same attributes as ImportResult from python-gnupg"""
+    def __init__(self):
+        self.count = 0
+        self.imported = 0
+        self.unchanged = 0
+        self.fingerprints = []
+        self.returncode = None
+        self.stderr = ''
+
+    def __bool__(self):
+        return len(self.fingerprints) > 0
+
+
+class GpgVerifyResult(object):
+    """Results of a verification parsed from gpg status output, same attributes as Verify from python-gnupg"""
+    def __init__(self):
+        self.valid = False
+        self.status = None
+        self.fingerprint = None
+        self.pubkey_fingerprint = None
+        self.key_id = None
+        self.username = None
+        self.returncode = None
+        self.stderr = ''
+
+    def __bool__(self):
+        return self.valid
+
+
+class KeyCache(object):
+    """
+    Local cache of keys retrieved from key servers, keyed by the key ID or fingerprint used to request them.
+    Entries are stored as JSON files containing the exported keys and are refreshed once older than the TTL.
+    """
+    def __init__(self, cache_dir, ttl=DEFAULT_KEY_CACHE_TTL):
+        """
+        :param cache_dir: directory to store the cached keys in, created if it doesn't exist
+        :param ttl: time in seconds after which cached keys are refreshed from the key server
+        """
+        self.cache_dir = str(cache_dir)
+        self.ttl = ttl
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _get_path(self, keyid):
+        """Returns the path of the cache entry for the key ID, named by its hash since key IDs are free-form"""
+        normalized_id = keyid.upper().replace(' ', '')
+        if normalized_id.startswith('0X'):
+            normalized_id = normalized_id[2:]
+        entry_name = hashlib.sha256(normalized_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, entry_name + '.json')
+
+    def get(self, keyid):
+        """
+        Gets cached keys if they are present, within the TTL and not expired
+
+        :param keyid: key ID or fingerprint
+        :return: exported key data, or None if the keys need to be fetched from the key server
+        """
+        try:
+            with open(self._get_path(keyid), 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        now = time.time()
+        if now - entry.get('fetched_at', 0) >= self.ttl:
+            return None
+        if entry.get('expires') is not None and entry['expires'] <= now:
+            return None
+        return entry.get('keydata')
+
+    def put(self, keyid, keydata, fingerprints, expires=None):
+        """
+        Stores keys in the cache, replacing the existing entry atomically
+
+        :param keyid: key ID or fingerprint
+        :param keydata: exported key data
+        :param fingerprints: fingerprints of the keys
+        :param expires: earliest expiration time of the keys, None if the keys don't expire
+        """
+        path = self._get_path(keyid)
+        entry = {
+            'keyid': keyid,
+            'fingerprints': list(fingerprints),
+            'fetched_at': time.time(),
+            'expires': expires,
+            'keydata': keydata,
+        }
+        _write_cache_entry(self.cache_dir, path, entry)
+
+
+class VerificationCache(object):
+    """
+    Local cache of successful signature verifications, keyed by the digests of the file and the signature and by
+    the state of the keyring. Any change to the keyring, including revocation or expiration of a key, results in
+    a different key so old verdicts aren't reused. Entries are evicted once they are past the expiration time of
+    the signing key or the cache is full, least recently used first and a tenth of the cache at a time.
+    """
+    def __init__(self, cache_dir, max_entries=DEFAULT_VERIFICATION_CACHE_SIZE):
+        """
+        :param cache_dir: directory to store the cached verifications in, created if it doesn't exist
+        :param max_entries: maximum number of entries to keep
+        """
+        self.cache_dir = str(cache_dir)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entry_count = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _get_path(self, cache_key):
+        """Returns the path of the cache entry"""
+        return os.path.join(self.cache_dir, cache_key + '.json')
+
+    @staticmethod
+    def get_key(filename, signaturefile, keyring_state):
+        """
+        Calculates the cache key of a verification
+
+        :param filename: file to be verified
+        :param signaturefile: file containing the PGP signature
+        :param keyring_state: keyring state as returned by IcetrustUtils.pgp_get_keyring_state()
+        :return: cache key, or None if either of the files can't be read
+        """
+        hasher = filehash.FileHash(DEFAULT_HASH_ALGORITHM)
+        try:
+            file_hash = hasher.hash_file(filename=filename)
+            signature_hash = hasher.hash_file(filename=signaturefile)
+        except OSError:
+            return None
+        return hashlib.sha256(':'.join([file_hash, signature_hash, keyring_state[0]]).encode('utf-8')).hexdigest()
+
+    def get(self, cache_key, keyring_state):
+        """
+        Gets a cached verification if it is present and the signing key is still in the keyring and not expired
+
+        :param cache_key: cache key returned by get_key()
+        :param keyring_state: keyring state as returned by IcetrustUtils.pgp_get_keyring_state()
+        :return: fingerprint of the primary signing key, or None if the signature needs to be verified
+        """
+        path = self._get_path(cache_key)
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        # The signing key and its primary key must still be in the keyring and not expired
+        fingerprints = entry.get('fingerprints') or []
+        now = time.time()
+        for fingerprint in fingerprints:
+            if fingerprint not in keyring_state[1]:
+                return None
+            expires = keyring_state[1][fingerprint]
+            if expires is not None and expires <= now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                else:
+                    with self.lock:
+                        if self.entry_count is not None:
+                            self.entry_count -= 1
+                return None
+        if not fingerprints:
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return fingerprints[0]
+
+    def put(self, cache_key, fingerprints):
+        """
+        Stores a successful verification in the cache. The number of entries is counted once and then tracked, when
+        it is over the limit the least recently used entries are evicted in a batch.
+
+        :param cache_key: cache key returned by get_key()
+        :param fingerprints: fingerprints of the primary key and of the signing subkey if different
+        """
+        entry = {
+            'fingerprints': list(fingerprints),
+            'verified_at': time.time(),
+        }
+        path = self._get_path(cache_key)
+        is_new = not os.path.exists(path)
+        _write_cache_entry(self.cache_dir, path, entry)
+
+        with self.lock:
+            if self.entry_count is None:
+                self.entry_count = len(self._list_entries())
+            elif is_new:
+                self.entry_count += 1
+            if self.entry_count > self.max_entries:
+                self._evict(self.max_entries - int(self.max_entries * VERIFICATION_CACHE_EVICT_FRACTION))
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is within its size limit"""
+        with self.lock:
+            self._evict(self.max_entries)
+
+    def _list_entries(self):
+        """Returns the paths of all entries in the cache"""
+        return [os.path.join(self.cache_dir, entry_name) for entry_name in os.listdir(self.cache_dir)
+                if entry_name.endswith('.json')]
+
+    def _evict(self, max_entries):
+        """Removes the least recently used entries until at most max_entries are left, must be called with the lock"""
+        entries = []
+        for path in self._list_entries():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+
+        self.entry_count = len(entries)
+        if len(entries) <= max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - max_entries]:
+            try:
+                os.remove(path)
+                self.entry_count -= 1
+            except OSError:
+                pass
+
+
+class HashCache(object):
+    """
+    In-memory cache of file hashes, an entry is only used while the size, modification time, change time, inode and
+    device of the file are unchanged. The change time can't be set back like the modification time, so a file
+    rewritten with the same size and its old modification time is still hashed again.
+    """
+    def __init__(self, max_entries=DEFAULT_HASH_CACHE_SIZE):
+        """
+        :param max_entries: maximum number of entries to keep, the least recently used ones are evicted
+        """
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get_hash(self, filename, algorithm, hash_file=None):
+        """
+        Returns the hash of a file, calculating it if the file isn't in the cache or has changed
+
+        :param filename: file to hash
+        :param algorithm: algorithm to use for hashing
+        :param hash_file: function called with the path and algorithm to calculate the hash, filehash is used if
+                          not passed
+        :return: hash of the file
+        :raises OSError: if the file can't be read
+        """
+        path = os.path.realpath(filename)
+        file_stat = os.stat(path)
+        signature = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ctime_ns, file_stat.st_ino,
+                     file_stat.st_dev)
+        cache_key = (path, algorithm)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(cache_key)
+                return entry[1]
+
+        if hash_file is not None:
+            calculated_hash = hash_file(path, algorithm)
+        else:
+            calculated_hash = filehash.FileHash(algorithm).hash_file(filename=path)
+        with self.lock:
+            self.entries[cache_key] = (signature, calculated_hash)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return calculated_hash
+
+
+def _write_cache_entry(cache_dir, path, entry):
+    """Writes a JSON cache entry atomically, so that concurrent readers never see a partial entry"""
+    temp_fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(temp_fd, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _read_stream(data):
+    """Yields the data in chunks, data can be bytes or a binary file-like object such as a pipe or socket file"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = memoryview(data)
+        for offset in range(0, len(data), STREAM_CHUNK_SIZE):
+            yield data[offset:offset + STREAM_CHUNK_SIZE]
+    else:
+        while True:
+            chunk = data.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _open_decompressed(data, decompress):
+    """
+    Opens a stream that decompresses data in chunks as it is read, the compression modules are only imported
+    when needed
+
+    :param data: filename or binary file-like object with compressed data
+    :param decompress: compression format, one of DECOMPRESS_FORMATS
+    :return: tuple of the decompressed stream and the exceptions raised for invalid compressed data
+    """
+    if decompress == DECOMPRESS_GZ:
+        import gzip, zlib
+        return gzip.open(data, 'rb'), (EOFError, OSError, zlib.error)
+    if decompress == DECOMPRESS_BZ2:
+        import bz2
+        return bz2.open(data, 'rb'), (EOFError, OSError)
+    if decompress == DECOMPRESS_XZ:
+        import lzma
+        return lzma.open(data, 'rb'), (EOFError, lzma.LZMAError)
+    raise ValueError('Unsupported decompress value')
+
+
+def _hash_decompressed(data, algorithm, decompress, msg_callback=None):
+    """
+    Hashes the decompressed content of a file or stream, no intermediate files are written and memory use
+    doesn't depend on the size of the content
+
+    :param data: filename or binary file-like object with compressed data
+    :param algorithm: algorithm to use for hashing
+    :param decompress: compression format, one of DECOMPRESS_FORMATS
+    :param msg_callback: message callback object, can be used to collect additional data via .echo()
+    :return: hash of the decompressed content, or None if the data can't be decompressed
+    :raises FileNotFoundError: if the file doesn't exist
+    """
+    if not hasattr(data, 'read'):
+        # Open the file first, so that a missing file isn't reported as invalid compressed data
+        with open(data, 'rb') as file:
+            return _hash_decompressed(file, algorithm, decompress, msg_callback=msg_callback)
+
+    stream, errors = _open_decompressed(data, decompress)
+    hasher = ZLIB_HASHERS[algorithm]() if algorithm in ZLIB_HASHERS else hashlib.new(algorithm)
+    try:
+        with stream:
+            for chunk in _read_stream(stream):
+                hasher.update(chunk)
+    except errors as err:
+        if msg_callback:
+            msg_callback.echo('File cannot be decompressed: ' + (str(err) or type(err).__name__))
+        return None
+    return hasher.hexdigest()
+
+
+def _pgp_verify_gnupg_stream(gpg, signature_data, data):
+    """
+    Verifies data against a detached signature with gpg without writing either of them to disk. The signature
+    is passed on an inherited pipe and the data is streamed to stdin, so only POSIX platforms are supported.
+    """
+    signature_read_fd, signature_write_fd = os.pipe()
+    try:
+        args = gpg.make_args(['--enable-special-filenames', '--verify', '--',
+                               '-&' + str(signature_read_fd), '-'], False)
+        process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   pass_fds=(signature_read_fd,))
+    except BaseException:
+        os.close(signature_write_fd)
+        raise
+    finally:
+        os.close(signature_read_fd)
+
+    def write_signature():
+        try:
+            with os.fdopen(signature_write_fd, 'wb') as signature_pipe:
+                signature_pipe.write(signature_data)
+        except OSError:
+            # gpg stopped reading, the error is reported in its status output
+            pass
+
+    stderr_chunks = []
+    threads = [threading.Thread(target=write_signature, daemon=True),
+               threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for chunk in _read_stream(data):
+            process.stdin.write(chunk)
+        process.stdin.close()
+    except BrokenPipeError:
+        # gpg exits early on errors such as a missing key, the error is reported in its status output
+        pass
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+        for thread in threads:
+            thread.join()
+        process.stderr.close()
+
+    return IcetrustUtils.pgp_parse_verify_status(returncode,
+                                                 b''.join(stderr_chunks).decode(gpg.encoding, errors='replace'))
+
+
+class GpgContext(object):
+    """
+    Reusable verification context that owns a gpg instance and its home directory for its whole lifetime.
+    The home directory can be persistent and a read-only trust keyring can be added, keys imported through
+    the context are only imported once per key source.
+    """
+    def __init__(self, gpg_home_dir=None, trust_keyring=None, verbose=False, key_cache=None, backend=BACKEND_GNUPG,
+                 verification_cache=None, session=None):
+        """
+        :param gpg_home_dir: directory to use for GPG home, if not passed a temporary directory is used
+        :param trust_keyring: keyring file with trusted keys, used read-only in addition to the home keyring
+        :param verbose: whether GPG should output additional data, used for debugging
+        :param key_cache: KeyCache used for keys from key servers
+        :param backend: OpenPGP backend to use, one of PGP_BACKENDS
+        :param verification_cache: VerificationCache used to skip verifications that were already done
+        :param session: requests.Session used to reuse connections to key servers
+        """
+        self.gpg = IcetrustUtils.pgp_init(gpg_home_dir=gpg_home_dir, verbose=verbose, trust_keyring=trust_keyring,
+                                          backend=backend)
+        self.key_cache = key_cache
+        self.lock = threading.Lock()
+        self.imports = dict()
+        self.key_index = None
+        self.verification_cache = verification_cache
+        self.keyring_state = None
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Removes the home directory if it is temporary"""
+        temp_dir_obj = getattr(self.gpg, 'temp_dir_obj', None)
+        if temp_dir_obj is not None:
+            temp_dir_obj.cleanup()
+
+    def import_keys(self, msg_callback=None, cmd_output=None, keyfile=None, keyid=None, keyserver=None):
+        """
+        Imports keys into the context, skipping key sources that were already imported successfully
+
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :param keyfile: file containing PGP keys to be imported
+        :param keyid: ID of the key to be imported from a key server
+        :param keyserver: domain name of the key server to be used, or a list of key servers to query concurrently
+        :return: True if import was successful, False otherwise
+        """
+        if keyfile:
+            key_source = os.path.abspath(keyfile)
+        else:
+            key_source = (keyid, tuple(keyserver) if isinstance(keyserver, (list, tuple)) else keyserver)
+        with self.lock:
+            if key_source in self.imports:
+                if msg_callback:
+                    msg_callback.echo('Reusing imported keys: ' + str(key_source))
+                return True
+
+            # The keyring is indexed once, then the index is kept up to date by imports through the context
+            if self.key_index is None:
+                self.key_index = IcetrustUtils.pgp_get_fingerprints(self.gpg, subkeys=True)
+            import_result = IcetrustUtils.pgp_import_keys(self.gpg, msg_callback=msg_callback,
+                                                          cmd_output=cmd_output, keyfile=keyfile, keyid=keyid,
+                                                          keyserver=keyserver, key_cache=self.key_cache,
+                                                          key_index=self.key_index, session=self.session)
+            if import_result:
+                self.imports[key_source] = True
+            self.keyring_state = None
+            return import_result
+
+    def get_keyring_state(self):
+        """
+        Summarizes the keyring for the verification cache, the summary is reused until keys are imported
+
+        :return: keyring state as returned by IcetrustUtils.pgp_get_keyring_state()
+        """
+        with self.lock:
+            if self.keyring_state is None:
+                self.keyring_state = IcetrustUtils.pgp_get_keyring_state(self.gpg)
+            return self.keyring_state
+
+    def verify(self, filename, signaturefile, msg_callback=None, cmd_output=None):
+        """
+        Verifies a file against its PGP signature using the keys in the context
+
+        :param filename: file to be verified
+        :param signaturefile: file containing the PGP signature
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :return: True if verification was successful, False otherwise
+        """
+        keyring_state = self.get_keyring_state() if self.verification_cache is not None else None
+        return IcetrustUtils.pgp_verify(self.gpg, filename, signaturefile, msg_callback=msg_callback,
+                                        cmd_output=cmd_output, verification_cache=self.verification_cache,
+                                        keyring_state=keyring_state)
+
+    def verify_stream(self, data, signature, msg_callback=None, cmd_output=None):
+        """
+        Verifies data held in memory or read from a stream against its PGP signature using the keys in the context
+
+        :param data: data to be verified, as bytes or a binary file-like object such as a pipe or socket file
+        :param signature: detached PGP signature, as bytes or a binary file-like object
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :return: True if verification was successful, False otherwise
+        """
+        return IcetrustUtils.pgp_verify_stream(self.gpg, data, signature, msg_callback=msg_callback,
+                                               cmd_output=cmd_output)
+
+    def verify_batch(self, pairs, max_workers=DEFAULT_PGP_WORKERS, msg_callback=None):
+        """
+        Verifies files against their PGP signatures in parallel using the keys in the context
+
+        :param pairs: list of (file, signature file) tuples
+        :param max_workers: maximum number of concurrent gpg processes
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: generator of (file, signature file, result, output) tuples, in order of completion
+        """
+        keyring_state = self.get_keyring_state() if self.verification_cache is not None else None
+        return IcetrustUtils.pgp_verify_batch(self.gpg, pairs, max_workers=max_workers, msg_callback=msg_callback,
+                                              verification_cache=self.verification_cache,
+                                              keyring_state=keyring_state)
+
+
 class IcetrustUtils(object):
     """Various utility functions, split off from the main class for ease of unit testing"""
     @staticmethod
@@ -84,17 +701,229 @@ class IcetrustUtils(object):
             return False
 
     @staticmethod
-    def pgp_import_keys(gpg, msg_callback=None, cmd_output=None, keyfile=None, keyid=None, keyserver=None):
+    def pgp_check_keys(gpg, fingerprints, msg_callback=None, cmd_output=None):
+        """
+        Checks that none of the keys are revoked or expired
+
+        :param gpg: initialized gpg instance
+        :param fingerprints: fingerprints of the keys to check
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :return: tuple of True if all keys are usable, False otherwise and the earliest expiration time
+        """
+        now = time.time()
+        earliest_expiry = None
+        for key in gpg.list_keys(keys=list(fingerprints)):
+            problem = None
+            if key['trust'] == 'r':
+                problem = 'revoked'
+            elif key['trust'] == 'e' or (key['expires'] and int(key['expires']) <= now):
+                problem = 'expired'
+
+            if problem:
+                message = 'Key ' + key['fingerprint'] + ' is ' + problem
+                if msg_callback:
+                    msg_callback.echo(message)
+                if cmd_output is not None:
+                    cmd_output.append(message)
+                return False, None
+
+            if key['expires']:
+                expires = int(key['expires'])
+                earliest_expiry = expires if earliest_expiry is None else min(earliest_expiry, expires)
+
+        return True, earliest_expiry
+
+    @staticmethod
+    def pgp_fetch_keys(keyserver, keyid, timeout=DEFAULT_KEYSERVER_TIMEOUT, cancel_event=None, session=None):
+        """
+        Retrieves keys from a key server using HKP without importing them
+
+        :param keyserver: key server name, or hkp://, hkps://, https:// or http:// URL
+        :param keyid: key ID or fingerprint to retrieve
+        :param timeout: timeout in seconds for connecting and reading
+        :param cancel_event: threading.Event that stops the download when set, optional
+        :param session: requests.Session used to reuse connections, optional
+        :return: key data, or None if the download was cancelled
+        :raises requests.RequestException: if the key server can't be reached or doesn't have the key
+        :raises ValueError: if the key server isn't supported
+        """
+        import requests
+
+        search = keyid.replace(' ', '')
+        if all(char in '0123456789abcdefABCDEF' for char in search):
+            search = '0x' + search
+        with (session or requests).get(IcetrustUtils.pgp_get_keyserver_url(keyserver),
+                                       params={'op': 'get', 'options': 'mr', 'search': search}, timeout=timeout,
+                                       stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            for chunk in response.iter_content(chunk_size=65536):
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    @staticmethod
+    def pgp_filter_keys(gpg, keydata, keyid):
+        """
+        Extracts the requested key from key data, so that other keys returned by a key server along with it are
+        never imported. The key data is imported into a temporary keyring and only the requested key is exported.
+
+        :param gpg: initialized gpg instance, used to select the backend (pgpy for PgpyGPG instances, gpg for
+                    others such as AsyncGpg), its keyring isn't changed
+        :param keydata: key data in armored or binary format
+        :param keyid: key ID or fingerprint of the primary key or of one of its subkeys
+        :return: armored key data of the requested key, or None if the key data doesn't contain it
+        """
+        from icetrust.utils_pgpy import PgpyGPG
+
+        filter_gpg = IcetrustUtils.pgp_init(backend=BACKEND_PGPY if isinstance(gpg, PgpyGPG) else BACKEND_GNUPG)
+        try:
+            filter_gpg.import_keys(keydata)
+            fingerprints = []
+            for key in filter_gpg.list_keys():
+                key_fingerprints = {key['fingerprint']} | {subkey[2] for subkey in key.get('subkeys', [])}
+                if IcetrustUtils.pgp_has_key(key_fingerprints, keyid):
+                    fingerprints.append(key['fingerprint'])
+            if not fingerprints:
+                return None
+            return filter_gpg.export_keys(fingerprints).encode('ascii')
+        finally:
+            if hasattr(filter_gpg, 'temp_dir_obj'):
+                filter_gpg.temp_dir_obj.cleanup()
+
+    @staticmethod
+    def pgp_find_signatures(directory):
+        """
+        Finds files in a directory that have a detached signature next to them, i.e. "file" and "file.sig"
+
+        :param directory: directory to search, subdirectories are not searched
+        :return: sorted list of (file, signature file) tuples
+        """
+        filenames = set(os.listdir(directory))
+        pairs = []
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1] in SIGNATURE_EXTENSIONS or \
+                    not os.path.isfile(os.path.join(directory, filename)):
+                continue
+            for extension in SIGNATURE_EXTENSIONS:
+                if filename + extension in filenames:
+                    pairs.append((os.path.join(directory, filename), os.path.join(directory, filename + extension)))
+                    break
+        return pairs
+
+    @staticmethod
+    def pgp_get_fingerprints(gpg, keys=None, subkeys=False):
+        """
+        Indexes the keyring by fingerprint
+
+        :param gpg: initialized gpg instance
+        :param keys: fingerprints of the keys to index, if not passed all keys in the keyring are indexed
+        :param subkeys: also index the fingerprints of subkeys, so they can be found by key ID
+        :return: set of fingerprints of the primary keys, and of subkeys if requested
+        """
+        fingerprints = set()
+        for key in gpg.list_keys(keys=keys):
+            fingerprints.add(key['fingerprint'])
+            if subkeys:
+                fingerprints.update(subkey[2] for subkey in key.get('subkeys', []) if len(subkey) > 2 and subkey[2])
+        return fingerprints
+
+    @staticmethod
+    def pgp_get_keyring_state(gpg):
+        """
+        Summarizes the keyring for use with the verification cache, the summary changes whenever a key or subkey is
+        added, removed, revoked or has its expiration time changed
+
+        :param gpg: initialized gpg instance
+        :return: tuple of the digest of the keyring and a dict of key and subkey fingerprints to expiration times
+        """
+        lines = []
+        expiry_times = dict()
+        for key in gpg.list_keys():
+            key_infos = [key] + list(key.get('subkey_info', dict()).values())
+            for key_info in key_infos:
+                fingerprint = key_info.get('fingerprint')
+                if not fingerprint:
+                    continue
+                # Revoked, expired and otherwise unusable keys are never trusted by cached verdicts
+                if key_info.get('trust') in ['r', 'e', 'i', 'd']:
+                    continue
+                expires = int(key_info['expires']) if key_info.get('expires') else None
+                expiry_times[fingerprint] = expires
+                lines.append(':'.join([fingerprint, key_info.get('trust', ''), str(expires)]))
+            lines.append(':'.join([key['fingerprint'], key.get('trust', '')]))
+        keyring_digest = hashlib.sha256('\n'.join(sorted(lines)).encode('utf-8')).hexdigest()
+        return keyring_digest, expiry_times
+
+    @staticmethod
+    def pgp_get_keyserver_url(keyserver):
+        """
+        Converts a key server name or URL into the URL used for HKP lookups
+
+        :param keyserver: key server name (HKPS is used), or hkp://, hkps://, https:// or http:// URL
+        :return: lookup URL
+        :raises ValueError: if the key server scheme isn't supported
+        """
+        if '://' not in keyserver:
+            keyserver = 'hkps://' + keyserver
+        parsed_url = urlparse(keyserver)
+        if parsed_url.scheme == 'hkp':
+            netloc = parsed_url.netloc if parsed_url.port else parsed_url.netloc + ':' + str(HKP_PORT)
+            return 'http://' + netloc + HKP_LOOKUP_PATH
+        elif parsed_url.scheme in ['hkps', 'https']:
+            return 'https://' + parsed_url.netloc + HKP_LOOKUP_PATH
+        elif parsed_url.scheme == 'http':
+            return 'http://' + parsed_url.netloc + HKP_LOOKUP_PATH
+        else:
+            raise ValueError('Unsupported key server: ' + keyserver)
+
+    @staticmethod
+    def pgp_has_key(key_index, keyid):
+        """
+        Checks if a key ID or fingerprint is in the keyring index
+
+        :param key_index: set of fingerprints of keys and subkeys, as returned by pgp_get_fingerprints() with subkeys
+        :param keyid: key ID or fingerprint, other identifiers such as email addresses are never found
+        :return: True if the key is in the index
+        """
+        normalized_id = keyid.upper().replace(' ', '')
+        if normalized_id.startswith('0X'):
+            normalized_id = normalized_id[2:]
+        if len(normalized_id) < 8 or any(char not in '0123456789ABCDEF' for char in normalized_id):
+            return False
+
+        # Key IDs are the last 8 or 16 characters of the fingerprint
+        return any(fingerprint.endswith(normalized_id) for fingerprint in key_index)
+
+    @staticmethod
+    def pgp_import_keys(gpg, msg_callback=None, cmd_output=None, keyfile=None, keyid=None, keyserver=None,
+                        key_cache=None, key_index=None, session=None):
         """
         Imports GPG keys into the gpg instance
 
+        Key files are always imported so gpg merges updated keys, such as new revocations, expiry dates or
+        subkeys, into a persistent keyring. The file is read by gpg itself so large keyrings are not loaded into
+        memory.
+
+        Keys requested from a key server are fetched and refreshed on every call, unless a key cache is passed
+        and has an entry within its TTL. In that case the key server isn't queried, and the cached keys are only
+        imported if they are missing from the keyring. Keys that are fetched are checked for revocation and
+        expiry before being stored in the cache.
+
         :param gpg: initialized gpg instance
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
         :param cmd_output: Additional data to be used for JSON output
         :param keyfile: file containing PGP keys to be imported
         :param keyid: ID of the key to be imported from a key server
-        :param keyserver: domain name of the key server to be used
-        :return: True if import was successful, False otherwise
+        :param keyserver: domain name of the key server to be used, or a list of key servers that are queried
+                          concurrently with the first valid response being used
+        :param key_cache: KeyCache used for keys from the key server, if not passed keys are always fetched
+        :param key_index: set of fingerprints of keys and subkeys in the keyring, updated with imported keys, if
+                          not passed the keyring is indexed when needed
+        :param session: requests.Session used to reuse connections when querying several key servers, optional
+        :return: True if import was successful or all keys were already present, False otherwise
         """
         # Check input parameters
         if keyfile is None and keyid is None and keyserver is None:
@@ -102,19 +931,75 @@ class IcetrustUtils(object):
         elif keyfile is None and (keyid is None or keyserver is None):
             raise ValueError("Both 'keyid' and 'keyserver' parameters must be set!")
 
-        # Import keys from file or server
+        # Import keys from file, cache or server, the keyring only needs to be indexed for cached keys
+        cached_keydata = key_cache.get(keyid) if key_cache is not None and keyfile is None else None
+        if key_index is None and cached_keydata is not None:
+            key_index = IcetrustUtils.pgp_get_fingerprints(gpg, subkeys=True)
         if keyfile:
             try:
-                keydata = Path(keyfile).read_text()
+                with open(keyfile, 'rb'):
+                    pass
             except FileNotFoundError as err:
                 if msg_callback:
                     msg_callback.echo(str(err))
                 return False
 
-            import_result = gpg.import_keys(keydata)
+            import_result = IcetrustUtils.pgp_import_keys_file(gpg, keyfile)
+        elif cached_keydata is not None and IcetrustUtils.pgp_has_key(key_index, keyid):
+            if msg_callback:
+                msg_callback.echo('Keys already in keyring: ' + keyid)
+            return True
+        elif cached_keydata is not None:
+            if msg_callback:
+                msg_callback.echo('Using cached keys: ' + keyid)
+            import_result = gpg.import_keys(cached_keydata)
         else:
-            import_result = gpg.recv_keys(keyserver, keyid)
+            if isinstance(keyserver, (list, tuple)) and len(keyserver) > 1:
+                keydata, keyserver_stats = IcetrustUtils.pgp_race_keyservers(gpg, keyserver, keyid,
+                                                                                   session=session)
+                keyserver_message = 'Key server latencies: ' + ', '.join(
+                    stats['keyserver'] + ' ' + stats['result'] +
+                    ('' if stats['latency'] is None else ' ' + format(stats['latency'], '.3f') + 's')
+                    for stats in keyserver_stats)
+                if msg_callback:
+                    msg_callback.echo(keyserver_message)
+                if cmd_output is not None:
+                    cmd_output.append(keyserver_message)
+                if keydata is None:
+                    return False
+                import_result = gpg.import_keys(keydata)
+            else:
+                import requests
 
+                # Key servers can return other keys or garbage, only the requested key is imported
+                if isinstance(keyserver, (list, tuple)):
+                    keyserver = keyserver[0]
+                try:
+                    keydata = IcetrustUtils.pgp_filter_keys(
+                        gpg, IcetrustUtils.pgp_fetch_keys(keyserver, keyid, session=session), keyid)
+                    error_message = 'Key server receive failed: key ' + keyid + ' not found in response'
+                except (requests.RequestException, ValueError) as err:
+                    keydata = None
+                    error_message = 'Key server receive failed: ' + str(err)
+                if keydata is None:
+                    if msg_callback:
+                        msg_callback.echo(error_message)
+                    if cmd_output is not None:
+                        cmd_output.append(error_message)
+                    return False
+                import_result = gpg.import_keys(keydata)
+
+            # Only cache keys that are still usable, so revocation and expiry are re-checked on every refresh
+            if key_cache is not None and import_result.fingerprints:
+                usable, expires = IcetrustUtils.pgp_check_keys(gpg, import_result.fingerprints,
+                                                                msg_callback=msg_callback, cmd_output=cmd_output)
+                if not usable:
+                    return False
+                key_cache.put(keyid, gpg.export_keys(import_result.fingerprints), import_result.fingerprints,
+                              expires=expires)
+
+        if key_index is not None and import_result.fingerprints:
+            key_index.update(IcetrustUtils.pgp_get_fingerprints(gpg, keys=import_result.fingerprints, subkeys=True))
         if msg_callback:
             msg_callback.echo('--- Results of key import ---\n')
             msg_callback.echo(import_result.stderr)
@@ -122,30 +1007,239 @@ class IcetrustUtils(object):
         if cmd_output is not None:
             cmd_output.append(import_result.stderr)
 
-        # Return results
-        if import_result.imported == 0:
+        # Return results, keys already present in a persistent GPG home are reported as unchanged, and keys with
+        # new signatures or subkeys are reported as neither imported nor unchanged but do have a fingerprint
+        if import_result.imported == 0 and import_result.unchanged == 0 and not import_result.fingerprints:
             return False
         else:
             return True
 
     @staticmethod
-    def pgp_init(gpg_home_dir=None, verbose=False):
+    def pgp_import_keys_file(gpg, keyfile):
+        """
+        Imports keys from a file, gpg reads the file itself so large keyrings are not loaded into memory
+
+        :param gpg: initialized gpg instance
+        :param keyfile: file containing PGP keys in armored or binary format
+        :return: import result
+        """
+        import gnupg
+
+        if isinstance(gpg, gnupg.GPG):
+            return gpg.import_keys(b'', extra_args=['--', os.path.abspath(str(keyfile))])
+        else:
+            return gpg.import_keys_file(str(keyfile))
+
+    @staticmethod
+    def pgp_init(gpg_home_dir=None, verbose=False, trust_keyring=None, backend=BACKEND_GNUPG):
         """
         Initializes the GPG object
 
         :param gpg_home_dir: directory to use for GPG home, if not passed, temporary directory will be used
         :param verbose: whether GPG should output additional data, used for debugging
-        :return: initialized gpg instance
+        :param trust_keyring: keyring file with trusted keys, used in addition to the keyring in GPG home
+        :param backend: OpenPGP backend to use, "gnupg" runs gpg and "pgpy" verifies in-process
+        :return: initialized gpg instance, or PgpyGPG instance with the same interface for the "pgpy" backend
         """
+        if backend not in PGP_BACKENDS:
+            raise ValueError('Unsupported backend value')
+
+        # The pgpy backend keeps keys in memory, so it doesn't need a temporary directory
+        if backend == BACKEND_PGPY:
+            from icetrust.utils_pgpy import PgpyGPG
+            return PgpyGPG(gnupghome=gpg_home_dir, keyring=trust_keyring)
+
+        # python-gnupg is only imported when needed, to keep startup of commands that don't use it fast
+        import gnupg
+
+        # Additional keyrings are only read from, imported keys still go into the keyring in GPG home
+        options = None
+        if trust_keyring is not None:
+            if not os.path.isfile(str(trust_keyring)):
+                raise ValueError('Trust keyring not found: ' + str(trust_keyring))
+            options = ['--keyring', os.path.abspath(str(trust_keyring))]
+
         # Setup GPG
+        temp_dir = None
         if gpg_home_dir is None:
             temp_dir = tempfile.TemporaryDirectory()
-            return gnupg.GPG(gnupghome=str(temp_dir.name), verbose=verbose)
-        else:
-            return gnupg.GPG(gnupghome=str(gpg_home_dir), verbose=verbose)
+            gpg_home_dir = temp_dir.name
+        gpg = gnupg.GPG(gnupghome=str(gpg_home_dir), verbose=verbose, options=options)
+
+        # The keyring and trust database in GPG home are created by the first gpg process that needs them, which
+        # isn't safe when several verifications start at once, so they are created before the instance is used
+        if not os.path.exists(os.path.join(str(gpg_home_dir), 'trustdb.gpg')):
+            gpg.list_keys()
+
+        # Keep the temporary directory for as long as the gpg instance is in use
+        if temp_dir is not None:
+            gpg.temp_dir_obj = temp_dir
+        return gpg
+
+    @staticmethod
+    def pgp_parse_import_status(returncode, stderr):
+        """
+        Parses the status output of a gpg key import
+
+        :param returncode: return code of gpg
+        :param stderr: stderr output of gpg, with status lines written to the same descriptor
+        :return: GpgImportResult
+        """
+        result = GpgImportResult()
+        result.returncode = returncode
+        result.stderr = stderr
+        for line in stderr.splitlines():
+            if not line.startswith(GPG_STATUS_PREFIX):
+                continue
+            fields = line[len(GPG_STATUS_PREFIX):].split()
+            if fields[0] == 'IMPORT_OK' and len(fields) > 2 and fields[2] not in result.fingerprints:
+                result.fingerprints.append(fields[2])
+            elif fields[0] == 'IMPORT_RES' and len(fields) > 5:
+                result.count = int(fields[1])
+                result.imported = int(fields[3])
+                result.unchanged = int(fields[5])
+        return result
 
     @staticmethod
-    def pgp_verify(gpg, filename, signaturefile, msg_callback=None, cmd_output=None):
+    def pgp_parse_verify_status(returncode, stderr):
+        """
+        Parses the status output of a gpg signature verification
+
+        :param returncode: return code of gpg
+        :param stderr: stderr output of gpg, with status lines written to the same descriptor
+        :return: GpgVerifyResult
+        """
+        result = GpgVerifyResult()
+        result.returncode = returncode
+        result.stderr = stderr
+        good_signature = False
+        for line in stderr.splitlines():
+            if not line.startswith(GPG_STATUS_PREFIX):
+                continue
+            keyword, _, value = line[len(GPG_STATUS_PREFIX):].partition(' ')
+            fields = value.split()
+            if keyword == 'GOODSIG':
+                good_signature = True
+                result.key_id, _, result.username = value.partition(' ')
+            elif keyword == 'VALIDSIG' and fields:
+                result.fingerprint = fields[0]
+                result.pubkey_fingerprint = fields[-1]
+            elif keyword == 'BADSIG':
+                result.status = 'signature bad'
+            elif keyword in ['REVKEYSIG', 'KEYREVOKED']:
+                result.status = 'signing key was revoked'
+            elif keyword in ['EXPKEYSIG', 'KEYEXPIRED']:
+                result.status = 'signing key has expired'
+            elif keyword == 'EXPSIG':
+                result.status = 'signature expired'
+            elif keyword == 'NO_PUBKEY':
+                result.status = 'no public key'
+            elif keyword == 'ERRSIG' and result.status is None:
+                result.status = 'signature error'
+            elif keyword == 'NODATA' and result.status is None:
+                result.status = 'no signature found'
+
+        # Problems reported at any point override a good signature
+        if good_signature and result.fingerprint is not None and result.status is None and returncode == 0:
+            result.status = 'signature valid'
+            result.valid = True
+        return result
+
+    @staticmethod
+    def pgp_race_keyservers(gpg, keyservers, keyid, timeout=DEFAULT_KEYSERVER_TIMEOUT, session=None):
+        """
+        Queries several key servers concurrently, the first response containing the requested key wins and the
+        remaining requests are cancelled
+
+        :param gpg: initialized gpg instance, used to select the backend that checks the keys without importing them
+        :param keyservers: list of key server names or URLs
+        :param keyid: key ID or fingerprint to retrieve
+        :param timeout: timeout in seconds for each key server
+        :param session: requests.Session used to reuse connections, optional
+        :return: tuple of the key data of only the requested key (None if no key server had it) and a list of
+                 dicts with the "keyserver", "result" ("ok", "error", "invalid" or "cancelled") and "latency" of
+                 each key server
+        """
+        from concurrent.futures import as_completed, ThreadPoolExecutor
+        import requests
+
+        cancel_event = threading.Event()
+
+        def query(keyserver):
+            start_time = time.monotonic()
+            try:
+                keydata = IcetrustUtils.pgp_fetch_keys(keyserver, keyid, timeout=timeout, cancel_event=cancel_event,
+                                                       session=session)
+            except (requests.RequestException, ValueError):
+                return None, 'error', time.monotonic() - start_time
+            if keydata is None:
+                return None, 'cancelled', None
+
+            # Key servers can return other keys or garbage, only the requested key is kept
+            keydata = IcetrustUtils.pgp_filter_keys(gpg, keydata, keyid)
+            if keydata is None:
+                return None, 'invalid', time.monotonic() - start_time
+            return keydata, 'ok', time.monotonic() - start_time
+
+        stats = {keyserver: {'keyserver': keyserver, 'result': 'cancelled', 'latency': None}
+                 for keyserver in keyservers}
+        winner_keydata = None
+        executor = ThreadPoolExecutor(max_workers=len(stats))
+        futures = dict()
+        try:
+            for keyserver in stats:
+                futures[executor.submit(query, keyserver)] = keyserver
+            for future in as_completed(futures):
+                keydata, result, latency = future.result()
+                stats[futures[future]].update({'result': result, 'latency': latency})
+                if keydata is not None:
+                    winner_keydata = keydata
+                    break
+        finally:
+            # Slower key servers are not waited for
+            cancel_event.set()
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        return winner_keydata, list(stats.values())
+
+    @staticmethod
+    def pgp_sign(gpg, filename, signaturefile, keyid=None, msg_callback=None):
+        """
+        Creates an ASCII-armored detached PGP signature of a file, only supported by the "gnupg" backend
+
+        :param gpg: initialized gpg instance, with the secret key in its home directory
+        :param filename: file to be signed
+        :param signaturefile: file to write the signature to
+        :param keyid: ID or fingerprint of the key to sign with, if not passed the default key is used
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: True if the signature was created, False otherwise
+        """
+        # gpg falls back to the default key if the requested key isn't found, so the key and its subkeys are
+        # looked up first
+        fingerprints = None
+        if keyid is not None:
+            fingerprints = []
+            for key in gpg.list_keys(secret=True, keys=keyid):
+                fingerprints.append(key['fingerprint'])
+                fingerprints.extend(subkey[2] for subkey in key.get('subkeys', []))
+            if not fingerprints:
+                if msg_callback:
+                    msg_callback.echo('Secret key not found: ' + keyid)
+                return False
+
+        with open(filename, 'rb') as file:
+            sign_result = gpg.sign_file(file, keyid=keyid, clearsign=False, detach=True, output=str(signaturefile))
+        if msg_callback:
+            msg_callback.echo(sign_result.stderr)
+        if not sign_result.fingerprint or (fingerprints is not None and sign_result.fingerprint not in fingerprints):
+            return False
+        return os.path.isfile(str(signaturefile))
+
+    @staticmethod
+    def pgp_verify(gpg, filename, signaturefile, msg_callback=None, cmd_output=None, verification_cache=None,
+                   keyring_state=None):
         """
         Verifies a file against its PGP signature
 
@@ -154,24 +1248,100 @@ class IcetrustUtils(object):
         :param signaturefile: file containing the PGP signature
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
         :param cmd_output: Additional data to be used for JSON output
+        :param verification_cache: VerificationCache used to skip verifications that were already done, optional
+        :param keyring_state: keyring state as returned by pgp_get_keyring_state(), calculated if not passed
         :return: True if verification was successful, False otherwise
         """
-        # Open signature file
+        # Open signature file and attempt to verify, unless the same verification was already done
         try:
-            signature = open(signaturefile, "rb")
+            verification_result, cached_fingerprint = IcetrustUtils.pgp_verify_cached(
+                gpg, filename, signaturefile, verification_cache=verification_cache, keyring_state=keyring_state)
         except FileNotFoundError as err:
             if msg_callback:
                 msg_callback.echo(str(err))
             return False
+        if cached_fingerprint is not None:
+            if msg_callback:
+                msg_callback.echo('Using cached verification result, signed by: ' + cached_fingerprint)
+            return True
+        if msg_callback:
+            msg_callback.echo('\n--- Results of verification ---')
+            msg_callback.echo(verification_result.stderr)
+
+        # Return results, signatures by revoked keys have a valid status but aren't valid
+        if verification_result.status == 'signature valid' and verification_result.valid:
+            return True
+        else:
+            if cmd_output is not None:
+                cmd_output.append(verification_result.stderr)
+            return False
+
+    @staticmethod
+    def pgp_verify_cached(gpg, filename, signaturefile, verification_cache=None, keyring_state=None):
+        """
+        Verifies a file against its PGP signature using the verification cache: previous verifications of the same
+        file, signature and keys are returned from the cache, and successful verifications are added to it
+
+        :param gpg: initialized gpg instance
+        :param filename: file to be verified
+        :param signaturefile: file containing the PGP signature
+        :param verification_cache: VerificationCache to use, optional
+        :param keyring_state: keyring state as returned by pgp_get_keyring_state(), calculated if not passed
+        :return: tuple of the gpg verify result and the cached signer fingerprint, the result is None and the
+                 fingerprint is set if the verification was found in the cache
+        :raises OSError: if the signature file can't be read
+        """
+        # Check for a previous verification of the same file, signature and keys
+        cache_key = None
+        if verification_cache is not None:
+            if keyring_state is None:
+                keyring_state = IcetrustUtils.pgp_get_keyring_state(gpg)
+            cache_key = VerificationCache.get_key(filename, signaturefile, keyring_state)
+            if cache_key is not None:
+                fingerprint = verification_cache.get(cache_key, keyring_state)
+                if fingerprint is not None:
+                    return None, fingerprint
+
+        with open(signaturefile, "rb") as signature:
+            verification_result = gpg.verify_file(signature, filename, close_file=False)
+
+        # Signatures by revoked keys have a valid status but aren't valid, so they aren't cached
+        if cache_key is not None and verification_result.status == 'signature valid' and verification_result.valid:
+            fingerprints = [verification_result.pubkey_fingerprint]
+            if verification_result.fingerprint not in fingerprints:
+                fingerprints.append(verification_result.fingerprint)
+            verification_cache.put(cache_key, [fingerprint for fingerprint in fingerprints if fingerprint])
+        return verification_result, None
+
+    @staticmethod
+    def pgp_verify_stream(gpg, data, signature, msg_callback=None, cmd_output=None):
+        """
+        Verifies data held in memory or read from a stream against its PGP signature, without writing either of
+        them to disk. Streams are read in chunks and passed to gpg as they are read.
+
+        :param gpg: initialized gpg instance
+        :param data: data to be verified, as bytes or a binary file-like object such as a pipe or socket file
+        :param signature: detached PGP signature, as bytes or a binary file-like object
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :return: True if verification was successful, False otherwise
+        """
+        # Signatures are small so they are read into memory
+        signature_data = signature if isinstance(signature, (bytes, bytearray)) else signature.read()
 
         # Attempt to verify
-        verification_result = gpg.verify_file(signature, filename)
+        import gnupg
+
+        if isinstance(gpg, gnupg.GPG):
+            verification_result = _pgp_verify_gnupg_stream(gpg, signature_data, data)
+        else:
+            verification_result = gpg.verify_stream(signature_data, data)
         if msg_callback:
             msg_callback.echo('\n--- Results of verification ---')
             msg_callback.echo(verification_result.stderr)
 
-        # Return results
-        if verification_result.status == 'signature valid':
+        # Return results, signatures by revoked keys have a valid status but aren't valid
+        if verification_result.status == 'signature valid' and verification_result.valid:
             return True
         else:
             if cmd_output is not None:
@@ -179,21 +1349,68 @@ class IcetrustUtils(object):
             return False
 
     @staticmethod
-    def process_verbose_flag(verbose):
+    def pgp_verify_batch(gpg, pairs, max_workers=DEFAULT_PGP_WORKERS, msg_callback=None, verification_cache=None,
+                         keyring_state=None):
+        """
+        Verifies files against their PGP signatures using a bounded pool of concurrent gpg processes that share
+        the same keyring. Results are returned as soon as each verification completes.
+
+        :param gpg: initialized gpg instance
+        :param pairs: list of (file, signature file) tuples
+        :param max_workers: maximum number of concurrent gpg processes
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param verification_cache: VerificationCache used to skip verifications that were already done, optional
+        :param keyring_state: keyring state as returned by pgp_get_keyring_state(), calculated if not passed
+        :return: generator of (file, signature file, result, output) tuples, in order of completion
+        """
+        from concurrent.futures import as_completed, ThreadPoolExecutor
+
+        # The keyring doesn't change during the batch, so it is only summarized once
+        if verification_cache is not None and keyring_state is None:
+            keyring_state = IcetrustUtils.pgp_get_keyring_state(gpg)
+
+        def verify_pair(filename, signaturefile):
+            pair_callback = MsgCallback() if msg_callback else None
+            cmd_output = []
+            result = IcetrustUtils.pgp_verify(gpg, filename, signaturefile, msg_callback=pair_callback,
+                                              cmd_output=cmd_output, verification_cache=verification_cache,
+                                              keyring_state=keyring_state)
+            return result, cmd_output, pair_callback
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(verify_pair, filename, signaturefile): (filename, signaturefile)
+                       for filename, signaturefile in pairs}
+            try:
+                for future in as_completed(futures):
+                    filename, signaturefile = futures[future]
+                    result, cmd_output, pair_callback = future.result()
+
+                    # Messages are collected per file so that output of concurrent verifications isn't mixed
+                    if pair_callback:
+                        for message in pair_callback.messages:
+                            msg_callback.echo(message)
+                    yield filename, signaturefile, result, cmd_output
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    @staticmethod
+    def process_verbose_flag(verbose, err=False):
         """
         Return message callback object to be used for output, usually click
 
         :param verbose: if True, return an object to be used for output
+        :param err: if True, messages are output to stderr
         :return: message callback object
         """
         if verbose:
-            return click
+            return ErrCallback() if err else click
         else:
             return False
 
     @staticmethod
     def verify_checksum(filename, algorithm, msg_callback=None, cmd_output=None,
-                        checksum_value=None, checksumfile=None):
+                        checksum_value=None, checksumfile=None, calculated_hash=None, decompress=None):
         """
         Calculates a filename hash and compares against the provided checksum or checksums file
 
@@ -203,23 +1420,34 @@ class IcetrustUtils(object):
         :param cmd_output: Additional data to be used for JSON output
         :param checksum_value: Checksum value
         :param checksumfile: Filename of the file containing checksums, follows the format from shasum
+        :param calculated_hash: hash of the file if it was already calculated with the same algorithm
+        :param decompress: compression format of the file, one of DECOMPRESS_FORMATS, if set the checksum is
+                           compared to the hash of the decompressed content
         :return: True if matches, False if doesn't match
         """
-        # Check algorithm for valid values
+        # Check algorithm and decompress for valid values
         if algorithm not in filehash.SUPPORTED_ALGORITHMS:
             raise ValueError('Unsupported algorithm value')
+        if decompress is not None and decompress not in DECOMPRESS_FORMATS:
+            raise ValueError('Unsupported decompress value')
 
         # Make sure either checksum or checksumfile arguments are set
         if checksum_value is None and checksumfile is None:
             raise ValueError('Either checksum_value or checksumfile arguments must be set')
 
-        # Calculate the hash
-        try:
-            calculated_hash = filehash.FileHash(algorithm).hash_file(filename=filename)
-        except FileNotFoundError as err:
-            if msg_callback:
-                msg_callback.echo(str(err))
-            return False
+        # Calculate the hash, decompressing the file on the fly if needed
+        if calculated_hash is None:
+            try:
+                if decompress is not None:
+                    calculated_hash = _hash_decompressed(filename, algorithm, decompress, msg_callback=msg_callback)
+                    if calculated_hash is None:
+                        return False
+                else:
+                    calculated_hash = filehash.FileHash(algorithm).hash_file(filename=filename)
+            except FileNotFoundError as err:
+                if msg_callback:
+                    msg_callback.echo(str(err))
+                return False
 
         # Output additional information if needed
         if msg_callback:
@@ -253,3 +1481,43 @@ class IcetrustUtils(object):
                     cmd_output.append('File checksum: ' + calculated_hash)
                     cmd_output.append('No match found in checksum file')
                 return False
+
+    @staticmethod
+    def verify_checksum_stream(data, algorithm, msg_callback=None, cmd_output=None, checksum_value=None,
+                               checksumfile=None, decompress=None):
+        """
+        Calculates the hash of data held in memory or read from a stream and compares against the provided
+        checksum or checksums file
+
+        :param data: data to be hashed, as bytes or a binary file-like object such as a pipe or socket file
+        :param algorithm: Algorithm to use for hashing
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :param checksum_value: Checksum value
+        :param checksumfile: Filename of the file containing checksums, follows the format from shasum
+        :param decompress: compression format of the data, one of DECOMPRESS_FORMATS, if set the checksum is
+                           compared to the hash of the decompressed content
+        :return: True if matches, False if doesn't match
+        """
+        # Check algorithm and decompress for valid values
+        if algorithm not in filehash.SUPPORTED_ALGORITHMS:
+            raise ValueError('Unsupported algorithm value')
+        if decompress is not None and decompress not in DECOMPRESS_FORMATS:
+            raise ValueError('Unsupported decompress value')
+
+        # Calculate the hash while reading, so that streams are never held in memory
+        if decompress is not None:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                data = io.BytesIO(data)
+            calculated_hash = _hash_decompressed(data, algorithm, decompress, msg_callback=msg_callback)
+            if calculated_hash is None:
+                return False
+        else:
+            hasher = ZLIB_HASHERS[algorithm]() if algorithm in ZLIB_HASHERS else hashlib.new(algorithm)
+            for chunk in _read_stream(data):
+                hasher.update(chunk)
+            calculated_hash = hasher.hexdigest()
+
+        return IcetrustUtils.verify_checksum(None, algorithm, msg_callback=msg_callback, cmd_output=cmd_output,
+                                             checksum_value=checksum_value, checksumfile=checksumfile,
+                                             calculated_hash=calculated_hash)
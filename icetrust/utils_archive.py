@@ -0,0 +1,278 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import base64, binascii, csv, hashlib, io, re, tarfile, zipfile
+
+from icetrust.utils import _read_stream, DEFAULT_HASH_ALGORITHM
+from icetrust.utils_manifest import MANIFEST_ALGORITHMS
+
+# Archive types, zip also covers wheels
+ARCHIVE_TYPE_TAR = 'tar'
+ARCHIVE_TYPE_ZIP = 'zip'
+ARCHIVE_TYPES = [ARCHIVE_TYPE_TAR, ARCHIVE_TYPE_ZIP]
+
+# Embedded manifest of wheels, and files that RECORD lists without a hash or doesn't list at all
+WHEEL_RECORD_PATTERN = re.compile(r'^[^/]+\.dist-info/RECORD$')
+WHEEL_UNHASHED_NAMES = ['RECORD', 'RECORD.jws', 'RECORD.p7s']
+
+# Hash algorithms accepted in wheel RECORD files, weaker ones such as md5 and sha1 are rejected
+WHEEL_RECORD_ALGORITHMS = ['sha256', 'sha384', 'sha512', 'blake2b', 'blake2s', 'sha3_256', 'sha3_384', 'sha3_512']
+
+# Lines of member manifests, in the format written by sha256sum or by "shasum --tag"
+GNU_LINE_PATTERN = re.compile(r'^([0-9a-fA-F]+) [ *](.+)$')
+BSD_LINE_PATTERN = re.compile(r'^([A-Z0-9]+) \((.+)\) = ([0-9a-fA-F]+)$')
+
+
+class ManifestEntry(object):
+    """Expected hash and optionally size of an archive member"""
+    __slots__ = ('algorithm', 'digest', 'size')
+
+    def __init__(self, algorithm, digest, size=None):
+        """
+        :param algorithm: hash algorithm, or None for members listed without a hash
+        :param digest: expected hash in hex, or None for members listed without a hash
+        :param size: expected size in bytes, or None if not known
+        """
+        self.algorithm = algorithm
+        self.digest = digest
+        self.size = size
+
+
+class IcetrustArchiveUtils(object):
+    """Various utility functions for verifying the members of archives without extracting them"""
+    @staticmethod
+    def get_archive_type(filename):
+        """
+        Detects the type of an archive from its content
+
+        :param filename: archive file
+        :return: one of ARCHIVE_TYPES, or None if the file isn't a supported archive
+        """
+        if zipfile.is_zipfile(filename):
+            return ARCHIVE_TYPE_ZIP
+        if tarfile.is_tarfile(filename):
+            return ARCHIVE_TYPE_TAR
+        return None
+
+    @staticmethod
+    def normalize_name(name):
+        """
+        Normalizes a member name so that "./dir/file" in a tar matches "dir/file" in a manifest
+
+        :param name: member name
+        :return: normalized name
+        """
+        while name.startswith('./'):
+            name = name[2:]
+        return name
+
+    @staticmethod
+    def parse_member_manifest(content, algorithm=DEFAULT_HASH_ALGORITHM):
+        """
+        Parses a member manifest in the format written by sha256sum or "shasum --tag", such as the files
+        written by the "manifest" command
+
+        :param content: text content of the manifest
+        :param algorithm: hash algorithm of lines without an algorithm tag
+        :return: dict of normalized member names to ManifestEntry objects
+        :raises ValueError: if a line can't be parsed
+        """
+        tags = {tag: name for name, (_, tag) in MANIFEST_ALGORITHMS.items()}
+        entries = dict()
+        for line_number, line in enumerate(content.splitlines(), start=1):
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            # Names containing backslashes or newlines are escaped and the line starts with a backslash
+            escaped = line.startswith('\\')
+            if escaped:
+                line = line[1:]
+            bsd_match = BSD_LINE_PATTERN.match(line)
+            gnu_match = GNU_LINE_PATTERN.match(line)
+            if bsd_match and bsd_match.group(1) in tags:
+                line_algorithm, name, digest = tags[bsd_match.group(1)], bsd_match.group(2), bsd_match.group(3)
+            elif gnu_match:
+                line_algorithm, name, digest = algorithm, gnu_match.group(2), gnu_match.group(1)
+            else:
+                raise ValueError('Invalid manifest line ' + str(line_number) + ': ' + line)
+            if escaped:
+                name = re.sub(r'\\(.)', lambda match: '\n' if match.group(1) == 'n' else match.group(1), name)
+            entries[IcetrustArchiveUtils.normalize_name(name)] = ManifestEntry(line_algorithm, digest.lower())
+        return entries
+
+    @staticmethod
+    def parse_record(content):
+        """
+        Parses a wheel RECORD file, with lines of "name,algorithm=urlsafe-base64-digest,size"
+
+        :param content: text content of the RECORD file
+        :return: dict of member names to ManifestEntry objects
+        :raises ValueError: if a line can't be parsed or uses an unsupported hash algorithm
+        """
+        entries = dict()
+        for row in csv.reader(io.StringIO(content)):
+            if not row:
+                continue
+            if len(row) != 3:
+                raise ValueError('Invalid RECORD line: ' + ','.join(row))
+            name, record_hash, size = row
+            if not record_hash:
+                entries[name] = ManifestEntry(None, None, int(size) if size else None)
+                continue
+            algorithm, _, encoded_digest = record_hash.partition('=')
+            if algorithm not in WHEEL_RECORD_ALGORITHMS:
+                raise ValueError('Unsupported RECORD hash algorithm: ' + algorithm)
+            try:
+                digest = base64.urlsafe_b64decode(encoded_digest + '=' * (-len(encoded_digest) % 4))
+            except (binascii.Error, ValueError):
+                raise ValueError('Invalid RECORD hash: ' + record_hash)
+            entries[name] = ManifestEntry(algorithm, binascii.hexlify(digest).decode('ascii'),
+                                          int(size) if size else None)
+        return entries
+
+    @staticmethod
+    def verify_archive(filename, msg_callback=None, cmd_output=None, manifestfile=None,
+                       algorithm=DEFAULT_HASH_ALGORITHM):
+        """
+        Verifies every member of a wheel, zip or tar archive against a member manifest in one sequential read,
+        without extracting it. Members are hashed in chunks, so memory use doesn't depend on the archive size.
+        Verification fails if a member doesn't match, is missing, isn't listed or appears more than once, or if a
+        tar archive contains links or special files.
+
+        :param filename: archive to be verified
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :param manifestfile: file listing the members and their checksums, if not passed the RECORD file of a
+                             wheel is used
+        :param algorithm: hash algorithm of manifest lines without an algorithm tag
+        :return: True if all members are verified, False otherwise
+        :raises ValueError: if the file isn't a supported archive or the manifest can't be parsed
+        """
+        archive_type = IcetrustArchiveUtils.get_archive_type(filename)
+        if archive_type is None:
+            raise ValueError('Unsupported archive type: ' + str(filename))
+        if manifestfile is None and archive_type != ARCHIVE_TYPE_ZIP:
+            raise ValueError('A member manifest is required for tar archives')
+
+        manifest = None
+        if manifestfile is not None:
+            with open(manifestfile, 'r', encoding='utf-8') as file:
+                manifest = IcetrustArchiveUtils.parse_member_manifest(file.read(), algorithm=algorithm)
+        verifier = _MemberVerifier(manifest, msg_callback, cmd_output)
+        try:
+            if archive_type == ARCHIVE_TYPE_ZIP:
+                verifier.verify_zip(filename)
+            else:
+                verifier.verify_tar(filename)
+        except (EOFError, NotImplementedError, OSError, RuntimeError, tarfile.TarError, zipfile.BadZipFile) as err:
+            verifier.fail(None, 'archive cannot be read: ' + str(err))
+        return verifier.finish()
+
+
+class _MemberVerifier(object):
+    """Checks the members of one archive against a manifest as they are read"""
+    def __init__(self, manifest, msg_callback, cmd_output):
+        self.manifest = manifest
+        self.msg_callback = msg_callback
+        self.cmd_output = cmd_output
+        self.wheel = False
+        self.seen = set()
+        self.failed = False
+        self.verified_count = 0
+
+    def fail(self, name, reason):
+        """Records a failure of a member, or of the whole archive if name is None"""
+        message = ('Member failed: ' + name + ' (' + reason + ')') if name is not None else \
+            ('ERROR: ' + reason[0].upper() + reason[1:])
+        self.failed = True
+        if self.msg_callback:
+            self.msg_callback.echo(message)
+        if self.cmd_output is not None:
+            self.cmd_output.append(message)
+
+    def check_member(self, name, fileobj):
+        """Hashes a member while it is read and compares it to the manifest, fileobj is None for links"""
+        name = IcetrustArchiveUtils.normalize_name(name)
+        if name in self.seen:
+            self.fail(name, 'duplicate member')
+            return
+        self.seen.add(name)
+        # Links and special files have no content of their own to verify, and manifests can't list them
+        if fileobj is None:
+            self.fail(name, 'not a regular file')
+            return
+        # Wheel signatures aren't listed in RECORD, and RECORD itself is listed without a hash
+        unhashed = self.wheel and name.rpartition('/')[2] in WHEEL_UNHASHED_NAMES
+        entry = self.manifest.get(name)
+        if entry is None or entry.digest is None:
+            if not unhashed:
+                self.fail(name, 'not listed in manifest' if entry is None else 'listed without a hash')
+            return
+
+        hasher = hashlib.new(entry.algorithm)
+        size = 0
+        for chunk in _read_stream(fileobj):
+            hasher.update(chunk)
+            size += len(chunk)
+        if entry.size is not None and size != entry.size:
+            self.fail(name, 'size mismatch')
+        elif hasher.hexdigest() != entry.digest:
+            self.fail(name, 'checksum mismatch')
+        else:
+            self.verified_count += 1
+            if self.msg_callback:
+                self.msg_callback.echo('Member verified: ' + name)
+
+    def verify_zip(self, filename):
+        """Verifies the members of a zip archive or wheel, in the order they are stored"""
+        with zipfile.ZipFile(filename) as archive:
+            infolist = sorted(archive.infolist(), key=lambda info: info.header_offset)
+            if self.manifest is None:
+                records = [info for info in infolist if WHEEL_RECORD_PATTERN.match(info.filename)]
+                if len(records) != 1:
+                    raise ValueError('A member manifest is required for zip archives without a wheel RECORD file')
+                self.manifest = IcetrustArchiveUtils.parse_record(archive.read(records[0]).decode('utf-8'))
+                self.wheel = True
+                if self.msg_callback:
+                    self.msg_callback.echo('Using wheel RECORD file: ' + records[0].filename)
+            for info in infolist:
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    self.check_member(info.filename, member)
+
+    def verify_tar(self, filename):
+        """Verifies the members of a tar archive, compressed or not, in a single pass over the stream"""
+        with tarfile.open(filename, mode='r|*') as archive:
+            for member in archive:
+                if member.isdir():
+                    continue
+                self.check_member(member.name, archive.extractfile(member) if member.isfile() else None)
+
+    def finish(self):
+        """Checks for members missing from the archive and returns the result"""
+        for name in sorted(set(self.manifest or dict()) - self.seen):
+            self.fail(name, 'missing from archive')
+        if self.msg_callback:
+            self.msg_callback.echo('Members verified: ' + str(self.verified_count))
+        return not self.failed
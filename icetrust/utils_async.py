@@ -0,0 +1,322 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from functools import partial
+import asyncio, os, tempfile, threading, weakref
+
+from icetrust.utils import DEFAULT_KEYSERVER_TIMEOUT, DEFAULT_PGP_WORKERS, GpgVerifyResult, IcetrustUtils
+
+# Default timeout in seconds for a single gpg operation, other than key server requests
+DEFAULT_GPG_TIMEOUT = 60.0
+
+
+class AsyncGpg(object):
+    """
+    Runs gpg as asyncio subprocesses, so that many operations can be multiplexed from one event loop without
+    a thread per operation. Each operation has a timeout after which the gpg process is killed, cancelling an
+    operation also kills its process, and the number of concurrent gpg processes is limited.
+    """
+    def __init__(self, gnupghome=None, keyring=None, gpgbinary='gpg', max_processes=DEFAULT_PGP_WORKERS,
+                 timeout=DEFAULT_GPG_TIMEOUT, keyserver_timeout=DEFAULT_KEYSERVER_TIMEOUT):
+        """
+        :param gnupghome: directory to use for GPG home, if not passed a temporary directory is used
+        :param keyring: keyring file with trusted keys, used read-only in addition to the home keyring
+        :param gpgbinary: name or path of the gpg binary
+        :param max_processes: maximum number of concurrent gpg processes
+        :param timeout: default timeout in seconds for each operation
+        :param keyserver_timeout: default timeout in seconds for key server requests
+        """
+        if keyring is not None and not os.path.isfile(keyring):
+            raise ValueError('Trust keyring not found: ' + str(keyring))
+
+        self.temp_dir_obj = None
+        if gnupghome is None:
+            self.temp_dir_obj = tempfile.TemporaryDirectory()
+            gnupghome = self.temp_dir_obj.name
+        self.gnupghome = str(gnupghome)
+        self.keyring = os.path.abspath(keyring) if keyring is not None else None
+        self.gpgbinary = gpgbinary
+        self.max_processes = max_processes
+        self.timeout = timeout
+        self.keyserver_timeout = keyserver_timeout
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.init_locks = weakref.WeakKeyDictionary()
+        self.initialized = os.path.exists(os.path.join(self.gnupghome, 'trustdb.gpg'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Removes the home directory if it is temporary"""
+        if self.temp_dir_obj is not None:
+            self.temp_dir_obj.cleanup()
+            self.temp_dir_obj = None
+
+    def _get_semaphore(self):
+        """Returns the semaphore limiting gpg processes, semaphores can't be shared between event loops"""
+        loop = asyncio.get_event_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_processes)
+        return self.semaphores[loop]
+
+    def _get_init_lock(self):
+        """Returns the lock held while the home directory is initialized, locks can't be shared between event loops"""
+        loop = asyncio.get_event_loop()
+        if loop not in self.init_locks:
+            self.init_locks[loop] = asyncio.Lock()
+        return self.init_locks[loop]
+
+    async def _exec(self, args, input_data, timeout):
+        """Runs gpg and waits for it to finish, killing it if it times out or the calling task is cancelled"""
+        process = await asyncio.create_subprocess_exec(self.gpgbinary, *args,
+                                                       stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.PIPE)
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(input_data), timeout)
+        except BaseException:
+            # Covers timeouts and cancellation, the process must not outlive the operation
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return process.returncode, stderr
+
+    async def _run(self, args, input_data=None, timeout=None):
+        """
+        Runs gpg and waits for it to finish, killing it if it times out or the calling task is cancelled
+
+        :param args: gpg arguments, added after the common options
+        :param input_data: data to write to stdin, optional
+        :param timeout: timeout in seconds, if not passed the default timeout is used
+        :return: tuple of the return code and stderr output, including status lines
+        :raises asyncio.TimeoutError: if gpg didn't finish in time
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        gpg_args = ['--status-fd', '2', '--no-tty', '--batch', '--homedir', self.gnupghome]
+        if self.keyring is not None:
+            gpg_args.extend(['--keyring', self.keyring])
+
+        async with self._get_semaphore():
+            # The keyring and trust database are created by the first gpg process that needs them, which isn't
+            # safe when several processes start at once, so they are created by the first operation on its own
+            if not self.initialized:
+                async with self._get_init_lock():
+                    if not self.initialized:
+                        await self._exec(gpg_args[2:] + ['--list-keys'], None, timeout)
+                        self.initialized = True
+
+            returncode, stderr = await self._exec(gpg_args + args, input_data, timeout)
+        return returncode, stderr.decode('utf-8', errors='replace')
+
+    async def import_keys(self, key_data, timeout=None):
+        """
+        Imports keys from memory
+
+        :param key_data: keys in armored or binary format
+        :param timeout: timeout in seconds, if not passed the default timeout is used
+        :return: GpgImportResult
+        :raises asyncio.TimeoutError: if gpg didn't finish in time
+        """
+        if isinstance(key_data, str):
+            key_data = key_data.encode('utf-8')
+        returncode, stderr = await self._run(['--import'], input_data=key_data, timeout=timeout)
+        return IcetrustUtils.pgp_parse_import_status(returncode, stderr)
+
+    async def import_keys_file(self, keyfile, timeout=None):
+        """
+        Imports keys from a file, gpg reads the file itself
+
+        :param keyfile: file containing keys in armored or binary format
+        :param timeout: timeout in seconds, if not passed the default timeout is used
+        :return: GpgImportResult
+        :raises asyncio.TimeoutError: if gpg didn't finish in time
+        """
+        returncode, stderr = await self._run(['--import', '--', os.path.abspath(str(keyfile))], timeout=timeout)
+        return IcetrustUtils.pgp_parse_import_status(returncode, stderr)
+
+    async def recv_keys(self, keyserver, *keyids, timeout=None):
+        """
+        Retrieves keys from a key server and imports them, other keys in the responses are ignored
+
+        :param keyserver: key server name, or hkp://, hkps://, https:// or http:// URL
+        :param keyids: key IDs or fingerprints to retrieve
+        :param timeout: timeout in seconds, if not passed the default key server timeout is used
+        :return: GpgImportResult
+        :raises asyncio.TimeoutError: if the key server or gpg didn't finish in time
+        """
+        import requests
+
+        timeout = timeout if timeout is not None else self.keyserver_timeout
+
+        def fetch(keyid, cancel_event):
+            # Key servers can return other keys or garbage, only the requested key is kept
+            keydata = IcetrustUtils.pgp_fetch_keys(keyserver, keyid, timeout=timeout, cancel_event=cancel_event)
+            return IcetrustUtils.pgp_filter_keys(self, keydata, keyid) if keydata is not None else None
+
+        keydata = []
+        errors = ''
+        for keyid in keyids:
+            cancel_event = threading.Event()
+            try:
+                key = await asyncio.wait_for(asyncio.get_event_loop().run_in_executor(
+                    None, partial(fetch, keyid, cancel_event)), timeout)
+            except (requests.RequestException, ValueError) as err:
+                errors += 'keyserver receive failed: ' + str(err) + '\n'
+                continue
+            finally:
+                # Downloads that timed out or were cancelled are stopped
+                cancel_event.set()
+            if key is None:
+                errors += 'keyserver receive failed: key ' + keyid + ' not found in response\n'
+                continue
+            keydata.append(key)
+
+        if not keydata:
+            return IcetrustUtils.pgp_parse_import_status(2, errors)
+        result = await self.import_keys(b''.join(keydata), timeout=timeout)
+        result.stderr = errors + result.stderr
+        return result
+
+    async def verify_file(self, signaturefile, filename, timeout=None):
+        """
+        Verifies a file against a detached signature
+
+        :param signaturefile: file containing the PGP signature
+        :param filename: file to be verified
+        :param timeout: timeout in seconds, if not passed the default timeout is used
+        :return: GpgVerifyResult
+        :raises asyncio.TimeoutError: if gpg didn't finish in time
+        """
+        returncode, stderr = await self._run(['--verify', '--', os.path.abspath(str(signaturefile)),
+                                              os.path.abspath(str(filename))], timeout=timeout)
+        return IcetrustUtils.pgp_parse_verify_status(returncode, stderr)
+
+    async def verify_batch(self, pairs, timeout=None):
+        """
+        Verifies files against their detached signatures concurrently, limited by the maximum number of gpg
+        processes. Verifications that time out are reported as failed with the "timeout" status.
+
+        :param pairs: list of (file, signature file) tuples
+        :param timeout: timeout in seconds for each verification, if not passed the default timeout is used
+        :return: list of (file, signature file, GpgVerifyResult) tuples, in the same order as the pairs
+        """
+        async def verify_pair(filename, signaturefile):
+            try:
+                result = await self.verify_file(signaturefile, filename, timeout=timeout)
+            except asyncio.TimeoutError:
+                result = GpgVerifyResult()
+                result.status = 'timeout'
+                result.stderr = 'gpg timed out\n'
+            return filename, signaturefile, result
+
+        return list(await asyncio.gather(*[verify_pair(filename, signaturefile)
+                                           for filename, signaturefile in pairs]))
+
+
+class IcetrustAsyncUtils(object):
+    """
+    Asyncio counterparts of the verification functions, so that many verifications can run on one event loop.
+    gpg runs as an asyncio subprocess through AsyncGpg, file hashing is offloaded to an executor. Messages and
+    results are the same as the blocking functions.
+    """
+    @staticmethod
+    async def canary_run(config_data, msg_callback=None, save_file=None, fetch_plan=None, max_workers=None,
+                         executor=None):
+        """
+        Runs a canary check using the provided config, see IcetrustCanaryUtils.canary_run(). Downloads use
+        requests, which has no asyncio support, so the check runs in the executor and the event loop is not
+        blocked while it downloads.
+
+        :param config_data: parsed and validated JSON config
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param save_file: location where the downloaded file should be saved, if needed
+        :param fetch_plan: FetchPlan shared with other configs in the same run, if not passed a new one is used
+        :param max_workers: maximum number of files to check in parallel, if not passed the default is used
+        :param executor: concurrent.futures executor to run the check in, if not passed the default one is used
+        :return: list of output objects following the output schema, one per file, or None if the config
+                 cannot be processed
+        """
+        from icetrust.utils_canary import IcetrustCanaryUtils
+
+        options = dict(msg_callback=msg_callback, save_file=save_file, fetch_plan=fetch_plan)
+        if max_workers is not None:
+            options['max_workers'] = max_workers
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, partial(IcetrustCanaryUtils.canary_run, config_data, **options))
+
+    @staticmethod
+    async def pgp_verify(gpg, filename, signaturefile, msg_callback=None, cmd_output=None, timeout=None):
+        """
+        Verifies a file against its PGP signature, see IcetrustUtils.pgp_verify()
+
+        :param gpg: AsyncGpg instance with the keys imported
+        :param filename: file to be verified
+        :param signaturefile: file containing the PGP signature
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :param timeout: timeout in seconds, if not passed the default timeout of the AsyncGpg instance is used
+        :return: True if verification was successful, False otherwise, including when gpg timed out
+        """
+        try:
+            verification_result = await gpg.verify_file(signaturefile, filename, timeout=timeout)
+        except asyncio.TimeoutError:
+            verification_result = GpgVerifyResult()
+            verification_result.status = 'timeout'
+            verification_result.stderr = 'gpg timed out\n'
+        if msg_callback:
+            msg_callback.echo('\n--- Results of verification ---')
+            msg_callback.echo(verification_result.stderr)
+
+        # Return results, signatures by revoked keys have a valid status but aren't valid
+        if verification_result.status == 'signature valid' and verification_result.valid:
+            return True
+        else:
+            if cmd_output is not None:
+                cmd_output.append(verification_result.stderr)
+            return False
+
+    @staticmethod
+    async def verify_checksum(filename, algorithm, msg_callback=None, cmd_output=None, checksum_value=None,
+                              checksumfile=None, decompress=None, executor=None):
+        """
+        Calculates a filename hash and compares against the provided checksum or checksums file, see
+        IcetrustUtils.verify_checksum(). Reading and hashing the file runs in the executor.
+
+        :param filename: Filename used to calculate the hash
+        :param algorithm: Algorithm to use for hashing
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param cmd_output: Additional data to be used for JSON output
+        :param checksum_value: Checksum value
+        :param checksumfile: Filename of the file containing checksums, follows the format from shasum
+        :param decompress: compression format of the file, one of DECOMPRESS_FORMATS, to check the uncompressed content
+        :param executor: concurrent.futures executor to hash the file in, if not passed the default one is used
+        :return: True if matches, False if doesn't match
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, partial(IcetrustUtils.verify_checksum, filename, algorithm, msg_callback=msg_callback,
+                              cmd_output=cmd_output, checksum_value=checksum_value, checksumfile=checksumfile,
+                              decompress=decompress))
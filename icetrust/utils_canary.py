@@ -21,21 +21,45 @@
 # specific language governing permissions and limitations
 # under the License.
 #
+from collections import Counter
+from concurrent.futures import as_completed, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
 from enum import Enum
+from functools import lru_cache
 from urllib.parse import urlparse
-import json, os, pkg_resources, shutil
+import json, os, shutil, stat, sys, tempfile, threading, time
 
-from download import download
 from filehash import filehash
-import click, jsonschema, tzlocal
+import click
 
 from icetrust.utils import DEFAULT_HASH_ALGORITHM, IcetrustUtils
 
 
+def _get_data_path(filename):
+    """Returns the path of a file in the package data directory"""
+    try:
+        from importlib.resources import files
+    except ImportError:
+        # importlib.resources.files() requires Python 3.9, package data is installed next to the module
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', filename)
+    return str(files('icetrust') / 'data' / filename)
+
+
 # Location of the schema files
-CANARY_INPUT_SCHEMA  = pkg_resources.resource_filename('icetrust', os.path.join('data', 'canary_input.schema.json'))
-CANARY_OUTPUT_SCHEMA = pkg_resources.resource_filename('icetrust', os.path.join('data', 'canary_output.schema.json'))
+CANARY_INPUT_SCHEMA = _get_data_path('canary_input.schema.json')
+CANARY_OUTPUT_SCHEMA = _get_data_path('canary_output.schema.json')
+
+
+@lru_cache(maxsize=None)
+def _get_config_validator():
+    """Loads the input schema and compiles a validator for it once, validators can be shared between threads"""
+    import jsonschema
+
+    with open(CANARY_INPUT_SCHEMA, 'r') as schema_file:
+        schema_data = json.load(schema_file)
+    return jsonschema.Draft7Validator(schema_data, format_checker=jsonschema.draft7_format_checker)
+
 
 # Names of files to be downloaded
 FILENAME_FILE1 = "file1.dat"
@@ -44,6 +68,31 @@ FILENAME_KEYS = "pgp_keys.txt"
 FILENAME_CHECKSUM = "checksum.dat"
 FILENAME_SIGNATURE = "signature.dat"
 
+# Maximum number of files from a single config to check in parallel
+DEFAULT_ARTIFACT_WORKERS = 4
+
+# Default limits for downloads from a single host: concurrent downloads and requests per second
+DEFAULT_HOST_CONCURRENCY = 4
+DEFAULT_HOST_RATE = 5.0
+
+# Default download settings: timeouts in seconds, number of retries and the initial backoff delay in seconds
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+
+# Default hedging settings: latency percentile after which a second request is sent, the delay used until
+# enough latencies were recorded and the number of latencies needed
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 5
+
+# Size of chunks used when downloading
+DOWNLOAD_CHUNK_SIZE = 65536
+
+# Number of NDJSON records to buffer before flushing the output stream
+DEFAULT_NDJSON_BATCH_SIZE = 10
+
 
 # List of available verification modes, based on the command line options in the main CLI class
 class VerificationModes(Enum):
@@ -54,8 +103,593 @@ class VerificationModes(Enum):
     PGPCHECKSUMFILE = 'pgpchecksumfile'
 
 
+class NdjsonWriter(object):
+    """Writes canary results as newline-delimited JSON, one compact record per line"""
+    def __init__(self, output, batch_size=DEFAULT_NDJSON_BATCH_SIZE):
+        """
+        :param output: filename to append records to, or '-' to write to stdout
+        :param batch_size: number of records to buffer before flushing the output stream
+        """
+        if output == '-':
+            self.stream = sys.stdout
+            self.owns_stream = False
+        else:
+            self.stream = open(output, 'a')
+            self.owns_stream = True
+        self.batch_size = max(1, batch_size)
+        self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, output_obj):
+        """Writes a single record, flushing once a full batch has been written"""
+        self.stream.write(json.dumps(output_obj, separators=(',', ':')) + '\n')
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Flushes any buffered records"""
+        self.stream.flush()
+        self.pending = 0
+
+    def close(self):
+        """Flushes any buffered records and closes the output file"""
+        self.flush()
+        if self.owns_stream:
+            self.stream.close()
+
+
+class DownloadError(RuntimeError):
+    """Raised when a download fails, carries the statistics of the failed download"""
+    def __init__(self, message, download_stats):
+        """
+        :param message: error message
+        :param download_stats: download statistics with the number of attempts and requests and the last error
+        """
+        super().__init__(message)
+        self.download_stats = download_stats
+
+
+class DownloadPolicy(object):
+    """Timeouts, retries and hedging used for downloads, also keeps track of download latencies"""
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, hedge=False,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE):
+        """
+        :param connect_timeout: timeout for establishing a connection, in seconds
+        :param read_timeout: timeout between bytes received from the server, in seconds
+        :param retries: number of retries after a failed attempt
+        :param backoff: delay before the first retry in seconds, doubled for every retry after that
+        :param hedge: whether a second request should be sent for small files if the first one is slow
+        :param hedge_percentile: percentile of previous download latencies after which the second request is sent
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+
+        # requests is only imported when downloading, to keep startup of other commands fast
+        import requests
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def _fetch(self, url, path, cancel_event=None):
+        """
+        Downloads the URL to the path, stopping early if the cancel event is set
+
+        :return: True if the download finished, False if it was cancelled
+        """
+        with self.session.get(url, stream=True, timeout=(self.connect_timeout, self.read_timeout)) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as output_file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    output_file.write(chunk)
+
+        if cancel_event is not None and cancel_event.is_set():
+            os.remove(path)
+            return False
+        return True
+
+    def _fetch_hedged(self, url, path):
+        """
+        Downloads the URL to the path, sending a second request if the first one is slower than usual
+
+        :return: number of requests sent
+        """
+        import requests
+
+        cancel_event = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = {executor.submit(self._fetch, url, path + '.0', cancel_event): path + '.0'}
+            done, _ = wait(futures, timeout=self.get_hedge_delay())
+            if not done:
+                futures[executor.submit(self._fetch, url, path + '.1', cancel_event)] = path + '.1'
+
+            # First successful request wins, the rest are cancelled
+            error = None
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (requests.RequestException, OSError) as err:
+                    error = err
+                    continue
+                cancel_event.set()
+                os.replace(futures[future], path)
+                return len(futures)
+            raise error
+        finally:
+            cancel_event.set()
+            executor.shutdown(wait=False)
+
+    def _download_attempt(self, url, path, hedge):
+        """Makes a single download attempt, hedged if requested, returns the number of requests sent"""
+        if hedge and self.hedge:
+            return self._fetch_hedged(url, path)
+        self._fetch(url, path)
+        return 1
+
+    def download(self, url, path, host_limiter=None, hedge=False, msg_callback=None):
+        """
+        Downloads the URL to the path, retrying failed attempts with exponential backoff
+
+        :param url: URL to download
+        :param path: path to download to
+        :param host_limiter: HostLimiter used to limit downloads per host, optional
+        :param hedge: whether the file is small enough for hedged requests, only used if hedging is enabled
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: download statistics: URL, number of requests, whether the request was hedged and latency
+        :raises DownloadError: if the download failed, with the statistics of all attempts
+        """
+        import requests
+
+        requests_sent = 0
+        for attempt in range(self.retries + 1):
+            start_time = time.monotonic()
+            try:
+                if host_limiter is not None:
+                    with host_limiter.limit(url):
+                        start_time = time.monotonic()
+                        attempt_requests = self._download_attempt(url, path, hedge)
+                else:
+                    attempt_requests = self._download_attempt(url, path, hedge)
+            except (requests.RequestException, OSError) as err:
+                requests_sent += 1
+                status_code = err.response.status_code \
+                    if isinstance(err, requests.HTTPError) and err.response is not None else None
+                retryable = status_code is None or status_code == 429 or status_code >= 500
+                if not retryable or attempt == self.retries:
+                    download_stats = dict()
+                    download_stats['url'] = url
+                    download_stats['attempts'] = attempt + 1
+                    download_stats['requests'] = requests_sent
+                    download_stats['hedged'] = False
+                    download_stats['latency'] = round(time.monotonic() - start_time, 6)
+                    download_stats['error'] = str(err)
+                    raise DownloadError('Error while fetching file ' + url + ': ' + str(err), download_stats)
+
+                delay = self.backoff * (2 ** attempt)
+                if msg_callback:
+                    msg_callback.echo('Download failed, retrying in ' + str(delay) + 's: ' + str(err))
+                time.sleep(delay)
+                continue
+
+            latency = time.monotonic() - start_time
+            requests_sent += attempt_requests
+            with self.lock:
+                self.latencies.append(latency)
+            if msg_callback:
+                msg_callback.echo('Downloaded ' + url + ' in ' + format(latency, '.3f') + 's')
+
+            download_stats = dict()
+            download_stats['url'] = url
+            download_stats['attempts'] = attempt + 1
+            download_stats['requests'] = requests_sent
+            download_stats['hedged'] = attempt_requests > 1
+            download_stats['latency'] = round(latency, 6)
+            return download_stats
+
+    def get_hedge_delay(self):
+        """
+        Gets the delay after which a hedged request is sent
+
+        :return: delay in seconds, based on the latency percentile of previous downloads
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))
+        return latencies[index]
+
+
+class HostLimiter(object):
+    """Limits the number of concurrent downloads and the request rate for each host"""
+    def __init__(self, max_concurrent=DEFAULT_HOST_CONCURRENCY, max_rate=DEFAULT_HOST_RATE):
+        """
+        :param max_concurrent: maximum number of concurrent downloads from a single host
+        :param max_rate: maximum number of requests per second to a single host, 0 or None for no limit
+        """
+        self.max_concurrent = max_concurrent
+        self.max_rate = max_rate
+        self.lock = threading.Lock()
+        self.semaphores = dict()
+        self.next_slots = dict()
+
+    def _get_semaphore(self, host):
+        """Returns the semaphore used to limit concurrent downloads from the host"""
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_concurrent)
+            return self.semaphores[host]
+
+    def _wait_for_slot(self, host):
+        """Waits until the next request to the host is allowed by the rate limit"""
+        if not self.max_rate:
+            return
+
+        # Reserve the next slot, then wait for it outside of the lock
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slots.get(host, now))
+            self.next_slots[host] = slot + 1.0 / self.max_rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    @contextmanager
+    def limit(self, url):
+        """
+        Context manager that holds a download slot for the host of the URL
+
+        :param url: URL being downloaded
+        """
+        host = urlparse(url).netloc
+        with self._get_semaphore(host):
+            self._wait_for_slot(host)
+            yield
+
+
+class FetchPlan(object):
+    """
+    Per-run plan of downloads and key imports shared between configs, so that each unique URL is only
+    downloaded once and each unique set of keys is only imported once
+    """
+    def __init__(self, configs, host_limiter=None, download_policy=None, key_cache=None, verification_cache=None):
+        """
+        :param configs: list of parsed and validated JSON configs that will be processed in this run
+        :param host_limiter: HostLimiter applied to all downloads, if not passed the default limits are used
+        :param download_policy: DownloadPolicy used for all downloads, if not passed the defaults are used
+        :param key_cache: KeyCache used for keys from key servers, if not passed keys are always fetched
+        :param verification_cache: VerificationCache used for signatures, if not passed signatures are always verified
+        """
+        self.temp_dir_obj = tempfile.TemporaryDirectory()
+        self.host_limiter = host_limiter if host_limiter is not None else HostLimiter()
+        self.download_policy = download_policy if download_policy is not None else DownloadPolicy()
+        self.key_cache = key_cache
+        self.verification_cache = verification_cache
+        self.keyring_states = dict()
+        self.download_stats = dict()
+        self.lock = threading.Lock()
+        self.item_locks = dict()
+        self.download_count = 0
+        self.downloads = dict()
+        self.keys = dict()
+
+        # Count how many times each URL will be needed, so downloads can be evicted after their last use
+        self.url_refs = Counter()
+        for config_data in configs:
+            self.url_refs.update(IcetrustCanaryUtils.get_download_urls(config_data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_item_lock(self, item):
+        """Returns the lock used to serialize work on a single URL or key source"""
+        with self.lock:
+            if item not in self.item_locks:
+                self.item_locks[item] = threading.Lock()
+            return self.item_locks[item]
+
+    def close(self):
+        """Removes all shared downloads and keyrings"""
+        self.temp_dir_obj.cleanup()
+
+    def fetch(self, url, dir, filename, msg_callback=None, hedge=False):
+        """
+        Places a copy of the URL in the provided directory, downloading it only if it wasn't downloaded before
+
+        :param url: URL to download
+        :param dir: directory to place the file in
+        :param filename: filename to use
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param hedge: whether the file is small enough for hedged requests
+        :return: download statistics, from the original download if the file was already downloaded
+        """
+        with self._get_item_lock(('url', url)):
+            cached_path = self.downloads.get(url)
+            if cached_path is None:
+                with self.lock:
+                    self.download_count += 1
+                    cached_path = os.path.join(self.temp_dir_obj.name,
+                                               'download' + str(self.download_count) + '.dat')
+                self.download_stats[url] = \
+                    IcetrustCanaryUtils.download_file(url, self.temp_dir_obj.name, os.path.basename(cached_path),
+                                                      msg_callback=msg_callback, host_limiter=self.host_limiter,
+                                                      download_policy=self.download_policy, hedge=hedge)
+
+                # Shared downloads are read-only, all configs get a link to the same file
+                os.chmod(cached_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                self.downloads[url] = cached_path
+            elif msg_callback:
+                msg_callback.echo('Reusing download: ' + url)
+
+            target_path = os.path.join(dir, filename)
+            try:
+                os.link(cached_path, target_path)
+            except OSError:
+                shutil.copyfile(cached_path, target_path)
+
+            # Evict the shared copy once every config that needs it has its own link
+            self.url_refs[url] -= 1
+            if self.url_refs[url] == 0:
+                os.remove(cached_path)
+                self.downloads[url] = None
+
+            return self.download_stats.get(url)
+
+    def import_key_material(self, dir, verification_data, cmd_output=None, msg_callback=None):
+        """
+        Imports keys into a keyring shared by all configs using the same key source
+
+        :param dir: directory where the key file was downloaded to
+        :param verification_data: parsed JSON containing verification data
+        :param cmd_output: command output
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: tuple of the initialized gpg instance and the import result
+        """
+        key_source = IcetrustCanaryUtils.get_key_source(verification_data)
+        with self._get_item_lock(('key', key_source)):
+            if key_source not in self.keys:
+                gpg = IcetrustUtils.pgp_init(gpg_home_dir=tempfile.mkdtemp(dir=self.temp_dir_obj.name))
+                import_output = []
+                import_result = IcetrustCanaryUtils.import_key_material(gpg, dir, verification_data,
+                                                                        cmd_output=import_output,
+                                                                        msg_callback=msg_callback,
+                                                                        key_cache=self.key_cache, key_index=set())
+                self.keys[key_source] = (gpg, import_result, import_output)
+            elif msg_callback:
+                msg_callback.echo('Reusing imported keys: ' + str(key_source))
+
+        gpg, import_result, import_output = self.keys[key_source]
+        if cmd_output is not None:
+            cmd_output.extend(import_output)
+        return gpg, import_result
+
+    def pgp_verify(self, gpg, filename, signaturefile, cmd_output=None, msg_callback=None):
+        """
+        Verifies a file against its PGP signature, using the verification cache if there is one
+
+        :param gpg: gpg instance returned by import_key_material()
+        :param filename: file to be verified
+        :param signaturefile: file containing the PGP signature
+        :param cmd_output: command output
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: True if verification was successful, False otherwise
+        """
+        keyring_state = None
+        if self.verification_cache is not None:
+            # Shared keyrings don't change once imported, so each one is only summarized once
+            with self._get_item_lock(('keyring', id(gpg))):
+                if id(gpg) not in self.keyring_states:
+                    self.keyring_states[id(gpg)] = IcetrustUtils.pgp_get_keyring_state(gpg)
+                keyring_state = self.keyring_states[id(gpg)]
+        return IcetrustUtils.pgp_verify(gpg, filename, signaturefile, msg_callback=msg_callback,
+                                        cmd_output=cmd_output, verification_cache=self.verification_cache,
+                                        keyring_state=keyring_state)
+
+
 class IcetrustCanaryUtils(object):
     """Various utility functions for the canary CLI"""
+    @staticmethod
+    def canary_run(config_data, msg_callback=None, save_file=None, fetch_plan=None,
+                   max_workers=DEFAULT_ARTIFACT_WORKERS, err=False):
+        """
+        Runs a canary check using the provided config
+
+        Verification data shared by all files in the config (checksum file, signature and keys) is downloaded
+        and verified once, then the files themselves are checked in parallel.
+
+        :param config_data: parsed and validated JSON config
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param save_file: location where the downloaded file should be saved, if needed
+        :param fetch_plan: FetchPlan shared with other configs in the same run, if not passed a new one is used
+        :param max_workers: maximum number of files to check in parallel
+        :param err: whether progress messages are written to stderr, used when stdout carries NDJSON records
+        :return: list of output objects following the output schema, one per file, or None if the config
+                 cannot be processed
+        """
+        if fetch_plan is None:
+            with FetchPlan([config_data]) as fetch_plan:
+                return IcetrustCanaryUtils.canary_run(config_data, msg_callback=msg_callback, save_file=save_file,
+                                                      fetch_plan=fetch_plan, max_workers=max_workers, err=err)
+
+        # Select the right mode
+        verification_mode = IcetrustCanaryUtils.get_verification_mode(config_data, msg_callback=msg_callback)
+        if verification_mode is None:
+            click.echo('Unknown verification mode in the config file!', err=err)
+            return None
+        click.echo('Using verification mode: ' + verification_mode.name, err=err)
+
+        # Check the files being verified
+        filename_urls = IcetrustCanaryUtils.get_filename_urls(config_data)
+        if save_file is not None and len(filename_urls) > 1:
+            click.echo('ERROR: Saving the file is not supported for configs with multiple files!', err=err)
+            return None
+
+        # Extract verification data
+        verification_data = IcetrustCanaryUtils.extract_verification_data(config_data, verification_mode,
+                                                                          msg_callback=msg_callback)
+
+        # Check verification_data for warnings
+        if msg_callback:
+            IcetrustCanaryUtils.check_verification_data(config_data, verification_mode, verification_data,
+                                                        msg_callback=msg_callback)
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            temp_dir = os.path.join(temp_dir_name, '')
+
+            # Download and verify the data shared by all files (including key imports and the signature check for
+            # PGP modes) in the background, while the files themselves are downloaded and hashed
+            def prepare_shared_data():
+                shared_output = []
+                shared_stats = []
+                shared_result, gpg = IcetrustCanaryUtils.prepare_verification_data(verification_mode, temp_dir,
+                                                                                   verification_data, shared_output,
+                                                                                   msg_callback=msg_callback,
+                                                                                   fetch_plan=fetch_plan,
+                                                                                   download_stats=shared_stats)
+                return shared_result, gpg, shared_output, shared_stats
+
+            # Then check each of the files, the results are combined once the shared data is ready
+            def run_check(index_and_url):
+                index, filename_url = index_and_url
+                file_dir = os.path.join(temp_dir, 'file' + str(index), '')
+                os.mkdir(file_dir)
+                download_stats = []
+                try:
+                    return IcetrustCanaryUtils.check_file(config_data, verification_mode, verification_data,
+                                                          filename_url, file_dir, temp_dir, None, [], None,
+                                                          msg_callback=msg_callback, save_file=save_file,
+                                                          fetch_plan=fetch_plan, download_stats=download_stats,
+                                                          shared_future=shared_future, err=err)
+                except DownloadError as error:
+                    # Failed downloads are reported with their statistics, for this file or the shared data
+                    return IcetrustCanaryUtils.generate_error_output(config_data, error, filename_url=filename_url,
+                                                                     download_stats=download_stats +
+                                                                     [error.download_stats])
+
+            with ThreadPoolExecutor(max_workers=1) as shared_executor:
+                shared_future = shared_executor.submit(prepare_shared_data)
+                if len(filename_urls) == 1:
+                    return [run_check((0, filename_urls[0]))]
+                with ThreadPoolExecutor(max_workers=min(max_workers, len(filename_urls))) as executor:
+                    return list(executor.map(run_check, enumerate(filename_urls)))
+
+    @staticmethod
+    def check_file(config_data, verification_mode, verification_data, filename_url, file_dir, shared_dir,
+                   shared_result, cmd_output, gpg, msg_callback=None, save_file=None, fetch_plan=None,
+                   download_stats=None, shared_future=None, err=False):
+        """
+        Downloads and checks a single file against verification data prepared by prepare_verification_data()
+
+        If prepare_verification_data() is still running in the background, the file is downloaded and hashed in
+        the meantime and the shared result, output, gpg instance and download statistics are taken from it
+        once it is done.
+
+        :param config_data: parsed and validated JSON config
+        :param verification_mode: verification mode being used
+        :param verification_data: parsed JSON containing verification data
+        :param filename_url: URL of the file being checked
+        :param file_dir: directory to download the file to
+        :param shared_dir: directory containing the shared verification data
+        :param shared_result: result of prepare_verification_data()
+        :param cmd_output: command output, starting with the output of prepare_verification_data()
+        :param gpg: initialized gpg instance for PGP modes, None otherwise
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param save_file: location where the downloaded file should be saved, if needed
+        :param fetch_plan: FetchPlan used to share downloads between configs, optional
+        :param download_stats: download statistics, starting with those of the shared verification data
+        :param shared_future: future returning a tuple of the result of prepare_verification_data(), the gpg
+                              instance, its output and its download statistics, optional
+        :param err: whether progress messages are written to stderr
+        :return: output object following the output schema
+        """
+        # Download the file itself
+        IcetrustCanaryUtils.download_file_to_check(filename_url, file_dir, msg_callback=msg_callback,
+                                                   fetch_plan=fetch_plan, download_stats=download_stats, err=err)
+        filename = os.path.join(file_dir, FILENAME_FILE1)
+
+        # Hash the file while the shared data is being prepared, then wait for it
+        file_hashes = dict()
+        if shared_future is not None:
+            algorithms = [DEFAULT_HASH_ALGORITHM]
+            if verification_mode in [VerificationModes.CHECKSUMFILE, VerificationModes.PGPCHECKSUMFILE]:
+                algorithms.append(IcetrustCanaryUtils.get_algorithm(verification_data))
+            for algorithm in set(algorithms):
+                try:
+                    file_hashes[algorithm] = filehash.FileHash(algorithm).hash_file(filename=filename)
+                except (FileNotFoundError, ValueError):
+                    pass
+
+            shared_result, gpg, shared_output, shared_stats = shared_future.result()
+            cmd_output = list(shared_output) + cmd_output
+            download_stats = list(shared_stats) + (download_stats or [])
+
+        # Main operation code
+        verification_result = False
+        if shared_result is False:
+            pass
+        elif verification_mode == VerificationModes.COMPARE_FILES:
+            verification_result = IcetrustUtils.compare_files(filename, os.path.join(shared_dir, FILENAME_FILE2),
+                                                              msg_callback=msg_callback, cmd_output=cmd_output)
+        elif verification_mode == VerificationModes.CHECKSUM:
+            algorithm = IcetrustCanaryUtils.get_algorithm(verification_data, msg_callback=msg_callback)
+            verification_result = IcetrustUtils.verify_checksum(filename, algorithm,
+                                                                checksum_value=verification_data['checksum_value'],
+                                                                msg_callback=msg_callback, cmd_output=cmd_output)
+        elif verification_mode in [VerificationModes.CHECKSUMFILE, VerificationModes.PGPCHECKSUMFILE]:
+            # For PGPCHECKSUMFILE the signature of the checksum file was already verified
+            algorithm = IcetrustCanaryUtils.get_algorithm(verification_data, msg_callback=msg_callback)
+            verification_result = IcetrustUtils.verify_checksum(filename, algorithm,
+                                                                checksumfile=os.path.join(shared_dir,
+                                                                                          FILENAME_CHECKSUM),
+                                                                msg_callback=msg_callback, cmd_output=cmd_output,
+                                                                calculated_hash=file_hashes.get(algorithm))
+        elif verification_mode == VerificationModes.PGP:
+            signaturefile = os.path.join(shared_dir, FILENAME_SIGNATURE)
+            if fetch_plan is not None:
+                verification_result = fetch_plan.pgp_verify(gpg, filename, signaturefile, cmd_output=cmd_output,
+                                                            msg_callback=msg_callback)
+            else:
+                verification_result = IcetrustUtils.pgp_verify(gpg, filename, signaturefile,
+                                                               msg_callback=msg_callback, cmd_output=cmd_output)
+
+        # Compare previous version if needed
+        comparison_result = None
+        if 'previous_version' in config_data:
+            previous_file_path = os.path.join(os.getcwd(), config_data['previous_version'])
+            if os.path.exists(previous_file_path):
+                click.echo('\nComparing with previous version...', err=err)
+                comparison_result = IcetrustUtils.compare_files(config_data['previous_version'], filename,
+                                                                msg_callback=msg_callback)
+                if comparison_result:
+                    click.echo('File matches previous version', err=err)
+                else:
+                    click.echo('ERROR: File doesn\'t match previous version!', err=err)
+
+        # Saves the file if needed
+        if save_file is not None:
+            click.echo('\nSaving file...', err=err)
+            shutil.copyfile(filename, save_file)
+
+        return IcetrustCanaryUtils.generate_output(config_data, verification_mode, verification_result,
+                                                   comparison_result, cmd_output, filename, filename_url=filename_url,
+                                                   download_stats=download_stats,
+                                                   file_checksum=file_hashes.get(DEFAULT_HASH_ALGORITHM))
+
     @staticmethod
     def check_verification_data(config_data, verification_mode, verification_data, msg_callback=None):
         """
@@ -66,7 +700,6 @@ class IcetrustCanaryUtils(object):
         :param verification_data: parsed JSON containing verification data
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
         """
-        filename_url = urlparse(config_data['filename_url'])
         file2_url = None
         if verification_mode == VerificationModes.COMPARE_FILES:
             file2_url = urlparse(verification_data['file2_url'])
@@ -78,69 +711,80 @@ class IcetrustCanaryUtils(object):
                 and 'keyfile_url' in verification_data:
             file2_url = urlparse(verification_data['keyfile_url'])
 
-        if file2_url is not None and filename_url.netloc != file2_url.netloc:
-            msg_callback.echo("WARNING: URLs for the file being verified and verification data are on the same server!")
+        for filename_url in IcetrustCanaryUtils.get_filename_urls(config_data):
+            if file2_url is not None and urlparse(filename_url).netloc != file2_url.netloc:
+                msg_callback.echo("WARNING: URLs for the file being verified and verification data are on the same "
+                                  "server!")
 
     @staticmethod
-    def download_all_files(verification_mode, dir, filename_url, verification_data, msg_callback=None):
+    def download_file(url, dir, filename, msg_callback=None, host_limiter=None, download_policy=None, hedge=False):
         """
-        Downloads all files needed for processing
+        Download the given file to the provided directory
 
-        :param verification_mode: verification mode being used
-        :param dir: directory to download to
-        :param filename_url: URL for the main file to be downloaded
-        :param verification_data: parsed JSON containing verification data
+        :param url: URL to download
+        :param directory: directory to download to
+        :param filename: filename to use for download
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
-        :return: one of VERIFICATION_MODES or None if none are found
+        :param host_limiter: HostLimiter used to limit downloads per host, optional
+        :param download_policy: DownloadPolicy with timeouts and retries, if not passed the defaults are used
+        :param hedge: whether the file is small enough for hedged requests
+        :return: download statistics
         """
-        # Main file is always downloaded
-        click.echo('Downloading file: ' + filename_url)
-        IcetrustCanaryUtils.download_file(filename_url, dir, FILENAME_FILE1, msg_callback=msg_callback)
-
-        # Download comparison file
-        if verification_mode == VerificationModes.COMPARE_FILES:
-            # If the URLs of the two files are same, simply make a copy, otherwise download
-            if filename_url == verification_data['file2_url']:
-                if msg_callback:
-                    msg_callback.echo("Both file URLs match, copying original file")
-                shutil.copy(os.path.join(dir, FILENAME_FILE1), os.path.join(dir, FILENAME_FILE2))
-            else:
-                IcetrustCanaryUtils.download_file(verification_data['file2_url'], dir, FILENAME_FILE2,
-                                                  msg_callback=msg_callback)
+        if download_policy is None:
+            download_policy = DownloadPolicy()
+        return download_policy.download(url, os.path.join(dir, filename), host_limiter=host_limiter, hedge=hedge,
+                                        msg_callback=msg_callback)
 
-        # Download checksum files
-        if verification_mode in [VerificationModes.CHECKSUMFILE,
-                                 VerificationModes.PGPCHECKSUMFILE]:
-            IcetrustCanaryUtils.download_file(verification_data['checksumfile_url'], dir, FILENAME_CHECKSUM,
-                                              msg_callback=msg_callback)
-
-        # Download signature files
-        if verification_mode in [VerificationModes.PGP, VerificationModes.PGPCHECKSUMFILE]:
-            IcetrustCanaryUtils.download_file(verification_data['signaturefile_url'], dir, FILENAME_SIGNATURE,
-                                              msg_callback=msg_callback)
+    @staticmethod
+    def download_file_to_check(filename_url, dir, msg_callback=None, fetch_plan=None, download_stats=None,
+                               err=False):
+        """
+        Downloads the file being checked
 
-        # Download key file
-        if verification_mode in [VerificationModes.PGP, VerificationModes.PGPCHECKSUMFILE]:
-            if 'keyfile_url' in verification_data:
-                IcetrustCanaryUtils.download_file(verification_data['keyfile_url'], dir,
-                                                  os.path.join(dir, FILENAME_KEYS), msg_callback=msg_callback)
+        :param filename_url: URL for the file to be downloaded
+        :param dir: directory to download to
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param fetch_plan: FetchPlan used to share downloads between configs, optional
+        :param download_stats: list to add download statistics to, optional
+        :param err: whether progress messages are written to stderr
+        """
+        fetch = fetch_plan.fetch if fetch_plan is not None else IcetrustCanaryUtils.download_file
 
+        click.echo('Downloading file: ' + filename_url, err=err)
+        stats = fetch(filename_url, dir, FILENAME_FILE1, msg_callback=msg_callback)
+        if download_stats is not None:
+            download_stats.append(stats)
 
     @staticmethod
-    def download_file(url, dir, filename, msg_callback=None):
+    def download_verification_files(verification_mode, dir, verification_data, msg_callback=None, fetch_plan=None,
+                                    download_stats=None):
         """
-        Download the given file to the provided directory
+        Downloads the files containing verification data: comparison, checksum, signature and key files
 
-        :param url: URL to download
-        :param directory: directory to download to
-        :param filename: filename to use for download
+        :param verification_mode: verification mode being used
+        :param dir: directory to download to
+        :param verification_data: parsed JSON containing verification data
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
-        :return: one of VERIFICATION_MODES or None if none are found
+        :param fetch_plan: FetchPlan used to share downloads between configs, optional
+        :param download_stats: list to add download statistics to, optional
         """
-        verbose = False
-        if msg_callback:
-            verbose = True
-        download(url, os.path.join(dir, filename), progressbar=verbose, verbose=verbose)
+        fetch = fetch_plan.fetch if fetch_plan is not None else IcetrustCanaryUtils.download_file
+
+        # Comparison file is a full copy of the file being checked, others are small and can be hedged
+        files = []
+        if verification_mode == VerificationModes.COMPARE_FILES:
+            files.append((verification_data['file2_url'], FILENAME_FILE2, False))
+        if verification_mode in [VerificationModes.CHECKSUMFILE, VerificationModes.PGPCHECKSUMFILE]:
+            files.append((verification_data['checksumfile_url'], FILENAME_CHECKSUM, True))
+        if verification_mode in [VerificationModes.PGP, VerificationModes.PGPCHECKSUMFILE]:
+            files.append((verification_data['signaturefile_url'], FILENAME_SIGNATURE, True))
+            if 'keyfile_url' in verification_data:
+                files.append((verification_data['keyfile_url'], FILENAME_KEYS, True))
+
+        for url, filename, hedge in files:
+            stats = fetch(url, dir, filename, msg_callback=msg_callback, hedge=hedge)
+            if download_stats is not None:
+                download_stats.append(stats)
 
     @staticmethod
     def extract_verification_data(config, mode, msg_callback=None):
@@ -163,6 +807,39 @@ class IcetrustCanaryUtils(object):
 
         return verification_data
 
+    @staticmethod
+    def format_json(output_obj, msg_callback=None):
+        """
+        Formats the output object as a pretty-printed JSON document
+
+        :param output_obj: output object, as returned by generate_output()
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: JSON object as string
+        """
+        json_data = json.dumps(output_obj, indent=4)
+
+        if msg_callback:
+            msg_callback.echo("--- JSON output ---")
+            msg_callback.echo(json_data)
+        return json_data
+
+    @staticmethod
+    def generate_error_output(config_data, error, filename_url=None, download_stats=None):
+        """
+        Generates the output object of a check that failed with an error, following the output schema
+
+        :param config_data: parsed and validated JSON config
+        :param error: exception raised by the check
+        :param filename_url: URL of the file that was checked, if not passed "filename_url" from the config is used
+        :param download_stats: list of download statistics, optional
+        :return: output object as a dictionary, with "verified" set to False and the error in "output"
+        """
+        return IcetrustCanaryUtils.generate_output(config_data,
+                                                   IcetrustCanaryUtils.get_verification_mode(config_data), False,
+                                                   None, ['ERROR: ' + (str(error) or type(error).__name__)], None,
+                                                   filename_url=filename_url, download_stats=download_stats,
+                                                   file_checksum='')
+
     @staticmethod
     def generate_json(config_data, verification_mode, verification_result, comparison_result, cmd_output, filename,
                       msg_callback=None):
@@ -178,15 +855,40 @@ class IcetrustCanaryUtils(object):
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
         :return: JSON object as string
         """
+        output_obj = IcetrustCanaryUtils.generate_output(config_data, verification_mode, verification_result,
+                                                         comparison_result, cmd_output, filename)
+        return IcetrustCanaryUtils.format_json(output_obj, msg_callback=msg_callback)
+
+    @staticmethod
+    def generate_output(config_data, verification_mode, verification_result, comparison_result, cmd_output,
+                        filename, filename_url=None, download_stats=None, file_checksum=None):
+        """
+        Generates the output object following the output schema
+
+        :param config_data: parsed JSON config
+        :param verification_mode: verification mode used
+        :param verification_result: verification result
+        :param comparison_result: result of comparison against previous version
+        :param cmd_output: command output
+        :param filename: filename to calculate checksum value on
+        :param filename_url: URL of the file that was checked, if not passed "filename_url" from the config is used
+        :param download_stats: list of download statistics, optional
+        :param file_checksum: SHA-256 checksum of the file if it was already calculated
+        :return: output object as a dictionary
+        """
+        import tzlocal
+
         # Calculate checksum first
-        checksum_value = filehash.FileHash('sha256').hash_file(filename=filename)
+        checksum_value = file_checksum
+        if checksum_value is None:
+            checksum_value = filehash.FileHash('sha256').hash_file(filename=filename)
 
-        # Construct JSON
+        # Construct output object
         output_obj = dict()
         output_obj['name'] = config_data['name']
         output_obj['url'] = config_data['url']
         output_obj['timestamp'] = datetime.now(tzlocal.get_localzone()).isoformat()
-        output_obj['filename_url'] = config_data['filename_url']
+        output_obj['filename_url'] = filename_url if filename_url else config_data['filename_url']
         output_obj['checksum_value'] = checksum_value
         output_obj['verification_mode'] = verification_mode.name.lower()
         output_obj['verified'] = verification_result
@@ -194,13 +896,11 @@ class IcetrustCanaryUtils(object):
         if comparison_result is not None:
             output_obj['previous_version_matched'] = comparison_result
 
-        output_obj['output'] = ', '.join(cmd_output)
-        json_data = json.dumps(output_obj, indent=4)
+        if download_stats is not None:
+            output_obj['downloads'] = download_stats
 
-        if msg_callback:
-            msg_callback.echo("--- JSON output ---")
-            msg_callback.echo(json_data)
-        return json_data
+        output_obj['output'] = ', '.join(cmd_output)
+        return output_obj
 
     @staticmethod
     def get_verification_mode(config, msg_callback=None):
@@ -236,7 +936,60 @@ class IcetrustCanaryUtils(object):
         return algorithm
 
     @staticmethod
-    def import_key_material(gpg, dir, verification_data, cmd_output=None, msg_callback=None):
+    def get_download_urls(config_data):
+        """
+        Gets the list of URLs that will be downloaded by canary_run() for the config
+
+        :param config_data: parsed JSON config
+        :return: list of URLs
+        """
+        verification_mode = IcetrustCanaryUtils.get_verification_mode(config_data)
+        if verification_mode is None:
+            return []
+        verification_data = IcetrustCanaryUtils.extract_verification_data(config_data, verification_mode)
+
+        urls = IcetrustCanaryUtils.get_filename_urls(config_data)
+        if verification_mode == VerificationModes.COMPARE_FILES:
+            urls.append(verification_data['file2_url'])
+        if verification_mode in [VerificationModes.CHECKSUMFILE, VerificationModes.PGPCHECKSUMFILE]:
+            urls.append(verification_data['checksumfile_url'])
+        if verification_mode in [VerificationModes.PGP, VerificationModes.PGPCHECKSUMFILE]:
+            urls.append(verification_data['signaturefile_url'])
+            if 'keyfile_url' in verification_data:
+                urls.append(verification_data['keyfile_url'])
+        return urls
+
+    @staticmethod
+    def get_filename_urls(config_data):
+        """
+        Gets the URLs of the files being verified
+
+        :param config_data: parsed JSON config
+        :return: list of URLs from either "filename_url" or "filename_urls"
+        """
+        if 'filename_urls' in config_data:
+            return list(config_data['filename_urls'])
+        else:
+            return [config_data['filename_url']]
+
+    @staticmethod
+    def get_key_source(verification_data):
+        """
+        Gets the value identifying where the keys come from, used to share imported keys
+
+        :param verification_data: parsed JSON containing verification data
+        :return: key file URL, or tuple of key ID and key server (or tuple of key servers)
+        """
+        if 'keyfile_url' in verification_data:
+            return verification_data['keyfile_url']
+        elif isinstance(verification_data['keyserver'], list):
+            return verification_data['keyid'], tuple(verification_data['keyserver'])
+        else:
+            return verification_data['keyid'], verification_data['keyserver']
+
+    @staticmethod
+    def import_key_material(gpg, dir, verification_data, cmd_output=None, msg_callback=None, key_cache=None,
+                            key_index=None):
         """
         Import keys if needed
 
@@ -246,6 +999,8 @@ class IcetrustCanaryUtils(object):
         :param verification_data: parsed JSON containing verification data
         :param cmd_output: command output
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param key_cache: KeyCache used for keys from the key server
+        :param key_index: set of fingerprints already in the keyring, if not passed the keyring is indexed
         :return: True if succesful, False if not, None if skipped
         """
         keyfile_path = None
@@ -257,9 +1012,84 @@ class IcetrustCanaryUtils(object):
                                                       keyid=None if keyfile_path else verification_data['keyid'],
                                                       keyserver=None if keyfile_path else verification_data['keyserver'],
                                                       cmd_output=cmd_output,
-                                                      msg_callback=msg_callback)
+                                                      msg_callback=msg_callback,
+                                                      key_cache=key_cache, key_index=key_index)
         return import_result
 
+    @staticmethod
+    def prepare_verification_data(verification_mode, dir, verification_data, cmd_output, msg_callback=None,
+                                  fetch_plan=None, download_stats=None):
+        """
+        Downloads and verifies the data shared by all files in a config: imports keys for the PGP modes and
+        verifies the signature of the checksum file for PGPCHECKSUMFILE
+
+        :param verification_mode: verification mode being used
+        :param dir: directory to download to
+        :param verification_data: parsed JSON containing verification data
+        :param cmd_output: command output
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :param fetch_plan: FetchPlan used to share downloads and keys between configs
+        :param download_stats: list to add download statistics to, optional
+        :return: tuple of the result (False if verification failed, None otherwise) and the gpg instance for
+                 PGP modes
+        """
+        IcetrustCanaryUtils.download_verification_files(verification_mode, dir, verification_data,
+                                                        msg_callback=msg_callback, fetch_plan=fetch_plan,
+                                                        download_stats=download_stats)
+
+        # Import keys for those operations that need it
+        gpg = None
+        if verification_mode in [VerificationModes.PGP, VerificationModes.PGPCHECKSUMFILE]:
+            import_output = []
+            gpg, import_result = fetch_plan.import_key_material(dir, verification_data, cmd_output=import_output,
+                                                                msg_callback=msg_callback)
+            if import_result is False:
+                cmd_output.extend(import_output)
+                return False, gpg
+
+        # Verify the signature of the checksum file
+        if verification_mode == VerificationModes.PGPCHECKSUMFILE:
+            signature_result = fetch_plan.pgp_verify(gpg, os.path.join(dir, FILENAME_CHECKSUM),
+                                                     os.path.join(dir, FILENAME_SIGNATURE), cmd_output=cmd_output,
+                                                     msg_callback=msg_callback)
+            if not signature_result:
+                return False, gpg
+
+        return None, gpg
+
+    @staticmethod
+    def sort_by_priority(configs):
+        """
+        Sorts configs so that the ones with higher priority are checked first, then the ones with earlier deadlines
+        (configs without a deadline last), keeping the original order otherwise
+
+        :param configs: list of parsed JSON configs
+        :return: sorted list of configs
+        """
+        return sorted(configs, key=lambda config_data: (-config_data.get('priority', 0),
+                                                        config_data.get('deadline', float('inf'))))
+
+    @staticmethod
+    def validate_config(config_data, msg_callback=None):
+        """
+        Validates a parsed config against the schema
+
+        :param config_data: parsed JSON config
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: returns the config if valid, None if not
+        """
+        import jsonschema
+
+        # Most configs are valid, so errors are only collected for the ones that aren't
+        validator = _get_config_validator()
+        if validator.is_valid(config_data):
+            return config_data
+
+        if msg_callback:
+            msg_callback.echo("Config file is not properly formatted!")
+            msg_callback.echo(jsonschema.exceptions.best_match(validator.iter_errors(config_data)).message)
+        return None
+
     @staticmethod
     def validate_config_file(config_file, msg_callback=None):
         """
@@ -269,15 +1099,23 @@ class IcetrustCanaryUtils(object):
         :param msg_callback: message callback object, can be used to collect additional data via .echo()
         :return: returns parsed JSON if valid, None if not
         """
-        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
-        config_data = json.load(config_file)
         try:
-            jsonschema.validators.validate(instance=config_data, schema=schema_data,
-                                           format_checker=jsonschema.draft7_format_checker)
-        except jsonschema.exceptions.ValidationError as err:
+            config_data = json.load(config_file)
+        except ValueError as err:
             if msg_callback:
-                msg_callback.echo("Config file is not properly formatted!")
-                msg_callback.echo(err.message)
+                msg_callback.echo("Config file is not valid JSON!")
+                msg_callback.echo(str(err))
             return None
+        return IcetrustCanaryUtils.validate_config(config_data, msg_callback=msg_callback)
+
+    @staticmethod
+    def validate_config_files(config_files, msg_callback=None):
+        """
+        Validates many config files against the schema in one go, the schema is only loaded once
 
-        return config_data
+        :param config_files: list of config file streams
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: list of parsed JSON configs, with None for configs that are not valid, in the same order
+        """
+        return [IcetrustCanaryUtils.validate_config_file(config_file, msg_callback=msg_callback)
+                for config_file in config_files]
@@ -0,0 +1,226 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import hashlib, json, os, tempfile
+
+# Manifest formats: "gnu" as written by sha256sum, "bsd" as written by "shasum --tag" and BSD sha256
+MANIFEST_FORMAT_GNU = 'gnu'
+MANIFEST_FORMAT_BSD = 'bsd'
+MANIFEST_FORMATS = [MANIFEST_FORMAT_GNU, MANIFEST_FORMAT_BSD]
+
+# Supported algorithms, with the names of the manifest files and the tags used in the BSD format
+MANIFEST_ALGORITHMS = {
+    'sha1': ('SHA1SUMS', 'SHA1'),
+    'sha256': ('SHA256SUMS', 'SHA256'),
+    'sha512': ('SHA512SUMS', 'SHA512'),
+}
+
+# Size of the buffer used to read files, each file is read once for all algorithms
+MANIFEST_READ_SIZE = 1048576
+
+# Version of the state file format
+MANIFEST_STATE_VERSION = 1
+
+
+def _hash_file(path, algorithms):
+    """Hashes a file with several algorithms in one read, runs in worker processes so it must be module-level"""
+    hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+    buffer = bytearray(MANIFEST_READ_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            for hasher in hashers:
+                hasher.update(view[:size])
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in zip(algorithms, hashers)}
+
+
+class IcetrustManifestUtils(object):
+    """Various utility functions for generating checksum manifests of directories"""
+    @staticmethod
+    def find_files(directory, exclude=None):
+        """
+        Finds all regular files in a directory tree, symbolic links are not followed
+
+        :param directory: directory to search
+        :param exclude: list of paths to leave out, such as the manifest files themselves
+        :return: sorted list of paths relative to the directory, with "/" as the separator
+        """
+        excluded = {os.path.realpath(path) for path in exclude or []}
+        relpaths = []
+        for root, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if os.path.islink(path) or not os.path.isfile(path) or os.path.realpath(path) in excluded:
+                    continue
+                relpaths.append(os.path.relpath(path, directory).replace(os.sep, '/'))
+        return sorted(relpaths)
+
+    @staticmethod
+    def format_line(relpath, digest, algorithm, manifest_format=MANIFEST_FORMAT_GNU):
+        """
+        Formats a manifest line, file names with backslashes or newlines are escaped like coreutils does
+
+        :param relpath: path of the file relative to the manifest
+        :param digest: hash of the file
+        :param algorithm: algorithm used for the hash
+        :param manifest_format: one of MANIFEST_FORMATS
+        :return: line without the trailing newline
+        """
+        prefix = ''
+        if '\\' in relpath or '\n' in relpath:
+            prefix = '\\'
+            relpath = relpath.replace('\\', '\\\\').replace('\n', '\\n')
+        if manifest_format == MANIFEST_FORMAT_BSD:
+            return prefix + MANIFEST_ALGORITHMS[algorithm][1] + ' (' + relpath + ') = ' + digest
+        return prefix + digest + '  ' + relpath
+
+    @staticmethod
+    def hash_files(directory, relpaths, algorithms, max_workers=None, state=None):
+        """
+        Hashes files in parallel worker processes, reusing hashes from the state of a previous run for files
+        whose size and modification time are unchanged
+
+        :param directory: directory the paths are relative to
+        :param relpaths: list of paths relative to the directory
+        :param algorithms: list of algorithms to use
+        :param max_workers: number of worker processes, if not passed the number of CPUs is used
+        :param state: state returned by a previous call for the same directory, optional
+        :return: tuple of a dict of paths to dicts of algorithms to hashes, the new state and the number of files
+                 that were hashed
+        :raises OSError: if a file can't be read
+        """
+        directory_path = os.path.realpath(directory)
+        previous_files = dict()
+        if state is not None and state.get('directory') == directory_path:
+            previous_files = state.get('files', dict())
+        hashes = dict()
+        new_files = dict()
+        to_hash = []
+        for relpath in relpaths:
+            file_stat = os.stat(os.path.join(directory, relpath))
+            entry = previous_files.get(relpath)
+            if entry is not None and entry.get('size') == file_stat.st_size and \
+                    entry.get('mtime_ns') == file_stat.st_mtime_ns and \
+                    all(algorithm in entry.get('hashes', dict()) for algorithm in algorithms):
+                hashes[relpath] = {algorithm: entry['hashes'][algorithm] for algorithm in algorithms}
+            else:
+                entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+                to_hash.append(relpath)
+            new_files[relpath] = entry
+
+        # Small batches of files are sent to each worker to keep the overhead of the process pool low
+        paths = [os.path.join(directory, relpath) for relpath in to_hash]
+        if max_workers == 1 or len(paths) <= 1:
+            results = map(_hash_file, paths, repeat(algorithms))
+            for relpath, file_hashes in zip(to_hash, results):
+                hashes[relpath] = file_hashes
+        elif paths:
+            max_workers = max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = executor.map(_hash_file, paths, repeat(algorithms),
+                                       chunksize=max(1, min(64, len(paths) // (max_workers * 4))))
+                for relpath, file_hashes in zip(to_hash, results):
+                    hashes[relpath] = file_hashes
+
+        for relpath in to_hash:
+            new_files[relpath]['hashes'] = dict(hashes[relpath])
+        return hashes, {'version': MANIFEST_STATE_VERSION, 'directory': directory_path, 'files': new_files}, \
+            len(to_hash)
+
+    @staticmethod
+    def load_state(state_file):
+        """
+        Loads the state of a previous run
+
+        :param state_file: file containing the state
+        :return: state, or None if the file doesn't exist or isn't a valid state file
+        """
+        try:
+            with open(state_file, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get('version') != MANIFEST_STATE_VERSION or \
+                not isinstance(state.get('files'), dict):
+            return None
+        return state
+
+    @staticmethod
+    def save_state(state_file, state):
+        """
+        Saves the state for the next run
+
+        :param state_file: file to save the state to
+        :param state: state returned by hash_files()
+        """
+        IcetrustManifestUtils.write_file(state_file, json.dumps(state, sort_keys=True))
+
+    @staticmethod
+    def write_file(filename, content):
+        """
+        Writes a file atomically, so that readers never see a partial manifest
+
+        :param filename: file to write
+        :param content: text content of the file
+        """
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+        try:
+            with os.fdopen(temp_fd, 'w', encoding='utf-8', newline='\n') as file:
+                file.write(content)
+            os.replace(temp_path, filename)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def write_manifests(output_dir, hashes, algorithms, manifest_format=MANIFEST_FORMAT_GNU, directory=None):
+        """
+        Writes one manifest file per algorithm, such as SHA256SUMS, with paths relative to the output directory so
+        that the manifests can be checked with "sha256sum -c" from there
+
+        :param output_dir: directory to write the manifests to
+        :param hashes: dict of paths to dicts of algorithms to hashes, as returned by hash_files()
+        :param algorithms: list of algorithms to write manifests for
+        :param manifest_format: one of MANIFEST_FORMATS
+        :param directory: directory the paths in hashes are relative to, defaults to the output directory
+        :return: list of manifest files written
+        """
+        manifest_relpaths = {relpath: relpath for relpath in hashes}
+        if directory is not None and os.path.realpath(directory) != os.path.realpath(output_dir):
+            manifest_relpaths = {relpath: os.path.relpath(os.path.join(directory, relpath),
+                                                          output_dir).replace(os.sep, '/') for relpath in hashes}
+        manifest_files = []
+        for algorithm in algorithms:
+            manifest_file = os.path.join(output_dir, MANIFEST_ALGORITHMS[algorithm][0])
+            lines = [IcetrustManifestUtils.format_line(manifest_relpaths[relpath], hashes[relpath][algorithm],
+                                                       algorithm, manifest_format) for relpath in sorted(hashes)]
+            IcetrustManifestUtils.write_file(manifest_file, ''.join(line + '\n' for line in lines))
+            manifest_files.append(manifest_file)
+        return manifest_files
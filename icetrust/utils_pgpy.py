@@ -0,0 +1,480 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from datetime import datetime, timezone
+from pathlib import Path
+import os, tempfile, threading
+
+import requests
+
+from icetrust.utils import DEFAULT_KEYSERVER_TIMEOUT, IcetrustUtils
+
+try:
+    import pgpy
+except ImportError:
+    pgpy = None
+
+
+class PgpyImportResult(object):
+    """Results of a key import, with the same attributes as ImportResult from python-gnupg"""
+    def __init__(self):
+        self.count = 0
+        self.imported = 0
+        self.unchanged = 0
+        self.fingerprints = []
+        self.results = []
+        self.stderr = ''
+
+    def __bool__(self):
+        return len(self.fingerprints) > 0
+
+
+class PgpyVerifyResult(object):
+    """Results of a signature verification, same attributes as Verify from python-gnupg but different messages"""
+    def __init__(self):
+        self.valid = False
+        self.status = None
+        self.fingerprint = None
+        self.pubkey_fingerprint = None
+        self.key_id = None
+        self.username = None
+        self.creation_date = None
+        self.timestamp = None
+        self.signature_id = None
+        self.stderr = ''
+
+    def __bool__(self):
+        return self.valid
+
+
+class PgpyGPG(object):
+    """
+    OpenPGP backend that parses keys and verifies detached signatures in-process using pgpy, without starting
+    gpg. Implements the parts of the gnupg.GPG interface used by icetrust. Keys are kept in memory and, if a
+    home directory is passed, stored there as armored files so they can be reused between runs.
+
+    Files being verified are read into memory, this backend is meant for small files and high verification rates.
+    """
+    def __init__(self, gnupghome=None, keyring=None, keyserver_timeout=DEFAULT_KEYSERVER_TIMEOUT):
+        """
+        :param gnupghome: directory to store imported keys in, if not passed keys are only kept in memory
+        :param keyring: file with additional keys in OpenPGP format (armored or binary), used read-only
+        :param keyserver_timeout: timeout in seconds for key server requests
+        """
+        if pgpy is None:
+            raise RuntimeError("The 'pgpy' backend requires the pgpy package to be installed")
+        if gnupghome is not None and not os.path.isdir(str(gnupghome)):
+            raise ValueError('gnupghome should be a directory (it isn\'t): ' + str(gnupghome))
+
+        self.gnupghome = str(gnupghome) if gnupghome is not None else None
+        self.keyserver_timeout = keyserver_timeout
+        self.lock = threading.Lock()
+        self.keys = dict()
+        self.key_ids = dict()
+
+        # Load keys from the home directory and the additional keyring
+        if self.gnupghome is not None:
+            for filename in sorted(os.listdir(self.gnupghome)):
+                if filename.endswith('.asc'):
+                    self._add_keys(Path(os.path.join(self.gnupghome, filename)).read_text(), store=False)
+        if keyring is not None:
+            try:
+                self._add_keys(Path(str(keyring)).read_bytes(), store=False)
+            except (OSError, ValueError) as err:
+                raise ValueError('Unable to load keyring: ' + str(err))
+
+    @staticmethod
+    def _parse_keys(key_data):
+        """Parses key data and returns the public primary keys it contains"""
+        if isinstance(key_data, str):
+            key_data = key_data.encode('utf-8')
+        if not key_data or not key_data.strip():
+            raise ValueError('No key data')
+
+        # pgpy raises a variety of errors on malformed input
+        try:
+            first_key, all_keys = pgpy.PGPKey.from_blob(key_data)
+        except Exception as err:
+            raise ValueError(str(err) or type(err).__name__)
+
+        keys = []
+        for key in [first_key] + list(all_keys.values()):
+            if not key.is_primary:
+                continue
+            if not key.is_public:
+                key = key.pubkey
+            if all(str(key.fingerprint) != str(existing.fingerprint) for existing in keys):
+                keys.append(key)
+        return keys
+
+    def _add_keys(self, key_data, store=True):
+        """
+        Adds keys to the keyring, replacing keys with the same fingerprint if they changed
+
+        :return: list of (fingerprint, whether the key is new or changed) tuples
+        """
+        results = []
+        for key in PgpyGPG._parse_keys(key_data):
+            fingerprint = str(key.fingerprint)
+            with self.lock:
+                existing_key = self.keys.get(fingerprint)
+                changed = existing_key is None or bytes(existing_key) != bytes(key)
+                if changed:
+                    self.keys[fingerprint] = key
+                    self.key_ids[fingerprint[-16:]] = fingerprint
+                    for subkey_id in key.subkeys:
+                        self.key_ids[subkey_id] = fingerprint
+            if changed and store and self.gnupghome is not None:
+                self._store_key(fingerprint, key)
+            results.append((fingerprint, changed))
+        return results
+
+    def _find_key(self, keyid):
+        """Finds a primary key by fingerprint, key ID or subkey ID"""
+        keyid = keyid.upper().replace(' ', '')
+        if keyid.startswith('0X'):
+            keyid = keyid[2:]
+        with self.lock:
+            if keyid in self.keys:
+                return self.keys[keyid]
+            fingerprint = self.key_ids.get(keyid[-16:])
+            return self.keys.get(fingerprint) if fingerprint else None
+
+    @staticmethod
+    def _format_timestamp(date):
+        """Formats a date as a UNIX timestamp like gpg's key listings, or an empty string if it is None"""
+        return str(int(date.timestamp())) if date is not None else ''
+
+    @staticmethod
+    def _get_username(key):
+        """Returns the first user ID of the key"""
+        return key.userids[0].userid if key.userids else ''
+
+    @staticmethod
+    def _get_binding_signature(key, subkey):
+        """Returns the most recent binding signature of a subkey that verifies against its primary key, or None"""
+        binding_signature = None
+        for signature in subkey.self_signatures:
+            if signature.signer != key.fingerprint.keyid or not PgpyGPG._verify_key_signature(key, subkey, signature):
+                continue
+            if binding_signature is None or signature.created > binding_signature.created:
+                binding_signature = signature
+        return binding_signature
+
+    @staticmethod
+    def _get_expiration(key, subkey=None):
+        """Returns when a primary key or one of its subkeys expires, or None if it doesn't expire"""
+        if subkey is None:
+            return key.expires_at
+        binding_signature = PgpyGPG._get_binding_signature(key, subkey)
+        if binding_signature is None or not binding_signature.key_expiration:
+            return None
+        return subkey.created + binding_signature.key_expiration
+
+    @staticmethod
+    def _get_key_status(key, subkey=None):
+        """
+        Returns 'r' if the key is revoked, 'e' if it is expired and '-' otherwise, like gpg's trust field. For
+        subkeys, revocations and the expiration are taken from signatures of the primary key.
+
+        :param key: primary key
+        :param subkey: subkey of the primary key to check instead of the primary key
+        """
+        if subkey is None:
+            if any(True for _ in key.revocation_signatures):
+                return 'r'
+        else:
+            if any(PgpyGPG._verify_key_signature(key, subkey, signature)
+                   for signature in subkey.revocation_signatures):
+                return 'r'
+        expires_at = PgpyGPG._get_expiration(key, subkey)
+        if expires_at is not None and expires_at <= datetime.now(timezone.utc):
+            return 'e'
+        return '-'
+
+    @staticmethod
+    def _verify_key_signature(key, subject, signature):
+        """Checks a signature made by a primary key over one of its subkeys, returns False if it can't be checked"""
+        # pgpy raises a variety of errors on malformed input
+        try:
+            return bool(key.verify(subject, signature))
+        except Exception:
+            return False
+
+    def _store_key(self, fingerprint, key):
+        """Stores a key in the home directory, replacing the existing file atomically"""
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.gnupghome, suffix='.tmp')
+        with os.fdopen(temp_fd, 'w') as key_file:
+            key_file.write(str(key))
+        os.replace(temp_path, os.path.join(self.gnupghome, fingerprint + '.asc'))
+
+    def export_keys(self, keyids):
+        """
+        Exports keys in armored format
+
+        :param keyids: fingerprint or key ID, or list of them
+        :return: armored keys
+        """
+        if isinstance(keyids, str):
+            keyids = [keyids]
+        exported = []
+        for keyid in keyids:
+            key = self._find_key(keyid)
+            if key is not None:
+                exported.append(str(key))
+        return ''.join(exported)
+
+    def import_keys(self, key_data):
+        """
+        Imports keys in armored or binary format
+
+        :param key_data: key data
+        :return: PgpyImportResult
+        """
+        result = PgpyImportResult()
+        try:
+            added_keys = self._add_keys(key_data)
+        except ValueError as err:
+            result.stderr = 'pgpy: no valid OpenPGP data found: ' + str(err) + '\n'
+            return result
+
+        for fingerprint, changed in added_keys:
+            key_description = 'pgpy: key ' + fingerprint[-16:] + ': "' + \
+                PgpyGPG._get_username(self._find_key(fingerprint)) + '"'
+            result.count += 1
+            result.fingerprints.append(fingerprint)
+            if changed:
+                result.imported += 1
+                result.results.append({'fingerprint': fingerprint, 'ok': '1', 'text': 'Entirely new key'})
+                result.stderr += key_description + ' imported\n'
+            else:
+                result.unchanged += 1
+                result.results.append({'fingerprint': fingerprint, 'ok': '0', 'text': 'Not actually changed'})
+                result.stderr += key_description + ' not changed\n'
+        result.stderr += 'pgpy: Total number processed: ' + str(result.count) + '\n'
+        return result
+
+    def import_keys_file(self, key_path):
+        """
+        Imports keys from a file in armored or binary format
+
+        :param key_path: path of the key file
+        :return: PgpyImportResult
+        """
+        return self.import_keys(Path(key_path).read_bytes())
+
+    def list_keys(self, secret=False, keys=None):
+        """
+        Lists keys in the keyring
+
+        :param secret: not supported, only public keys are kept
+        :param keys: fingerprint or key ID, or list of them, if not passed all keys are listed
+        :return: list of dicts with the same fields as returned by python-gnupg
+        """
+        if secret:
+            return []
+        if keys is None:
+            with self.lock:
+                selected_keys = list(self.keys.values())
+        else:
+            if isinstance(keys, str):
+                keys = [keys]
+            selected_keys = [key for key in (self._find_key(keyid) for keyid in keys) if key is not None]
+
+        key_list = []
+        for key in selected_keys:
+            fingerprint = str(key.fingerprint)
+            key_list.append({
+                'type': 'pub',
+                'trust': PgpyGPG._get_key_status(key),
+                'keyid': fingerprint[-16:],
+                'fingerprint': fingerprint,
+                'date': str(int(key.created.timestamp())),
+                'expires': PgpyGPG._format_timestamp(key.expires_at),
+                'uids': [uid.userid for uid in key.userids],
+                'subkeys': [[subkey_id, '', str(subkey.fingerprint)] for subkey_id, subkey in key.subkeys.items()],
+                'subkey_info': {subkey_id: {
+                    'trust': PgpyGPG._get_key_status(key, subkey),
+                    'fingerprint': str(subkey.fingerprint),
+                    'expires': PgpyGPG._format_timestamp(PgpyGPG._get_expiration(key, subkey)),
+                } for subkey_id, subkey in key.subkeys.items()},
+            })
+        return key_list
+
+    def recv_keys(self, keyserver, *keyids):
+        """
+        Retrieves keys from a key server using HKP and imports them, other keys in the responses are ignored
+
+        :param keyserver: key server name, or hkp://, hkps:// or https:// URL
+        :param keyids: key IDs or fingerprints to retrieve
+        :return: PgpyImportResult
+        """
+        result = PgpyImportResult()
+        for keyid in keyids:
+            try:
+                keydata = IcetrustUtils.pgp_fetch_keys(keyserver, keyid, timeout=self.keyserver_timeout)
+            except ValueError as err:
+                result.stderr += 'pgpy: ' + str(err) + '\n'
+                return result
+            except requests.RequestException as err:
+                result.stderr += 'pgpy: keyserver receive failed: ' + str(err) + '\n'
+                continue
+            keydata = IcetrustUtils.pgp_filter_keys(self, keydata, keyid)
+            if keydata is None:
+                result.stderr += 'pgpy: keyserver receive failed: key ' + keyid + ' not found in response\n'
+                continue
+
+            key_result = self.import_keys(keydata)
+            result.count += key_result.count
+            result.imported += key_result.imported
+            result.unchanged += key_result.unchanged
+            result.fingerprints.extend(key_result.fingerprints)
+            result.results.extend(key_result.results)
+            result.stderr += key_result.stderr
+        return result
+
+    def scan_keys(self, filename):
+        """
+        Lists keys in a file without importing them
+
+        :param filename: path of the key file
+        :return: list of dicts with the "fingerprint" and "keyid" fields
+        """
+        try:
+            keys = PgpyGPG._parse_keys(Path(filename).read_bytes())
+        except ValueError:
+            return []
+        return [{'fingerprint': str(key.fingerprint), 'keyid': str(key.fingerprint)[-16:]} for key in keys]
+
+    def verify_file(self, fileobj_or_path, data_filename=None, close_file=True, extra_args=None):
+        """
+        Verifies a file against a detached signature
+
+        :param fileobj_or_path: signature file object or path
+        :param data_filename: file to be verified
+        :param close_file: whether to close the signature file object
+        :param extra_args: ignored, kept for compatibility with python-gnupg
+        :return: PgpyVerifyResult
+        """
+        # Read the signature
+        try:
+            if hasattr(fileobj_or_path, 'read'):
+                signature_data = fileobj_or_path.read()
+            else:
+                signature_data = Path(fileobj_or_path).read_bytes()
+        finally:
+            if close_file and hasattr(fileobj_or_path, 'close'):
+                fileobj_or_path.close()
+
+        return self._verify(signature_data, lambda: Path(data_filename).read_bytes())
+
+    def verify_stream(self, signature_data, data):
+        """
+        Verifies data held in memory or read from a stream against a detached signature
+
+        :param signature_data: detached signature
+        :param data: data to be verified, as bytes or a binary file-like object, pgpy needs all of it in memory
+        :return: PgpyVerifyResult
+        """
+        return self._verify(signature_data, lambda: data if isinstance(data, (bytes, bytearray)) else data.read())
+
+    def _verify(self, signature_data, read_data):
+        """
+        Verifies data against a detached signature, the data is only read once the signing key has been checked
+
+        :param signature_data: detached signature
+        :param read_data: function returning the data to be verified
+        :return: PgpyVerifyResult
+        """
+        result = PgpyVerifyResult()
+
+        # pgpy raises a variety of errors on malformed input
+        try:
+            signature = pgpy.PGPSignature.from_blob(signature_data)
+        except Exception:
+            result.stderr = 'pgpy: no valid OpenPGP data found.\n'
+            return result
+
+        result.key_id = signature.signer
+        result.creation_date = signature.created.strftime('%Y-%m-%d')
+        result.timestamp = str(int(signature.created.timestamp()))
+        result.stderr = 'pgpy: Signature made ' + str(signature.created) + ' using key ' + signature.signer + '\n'
+
+        # Find the key that made the signature and check that it can be used
+        key = self._find_key(signature.signer)
+        if key is None:
+            result.status = 'no public key'
+            result.stderr += "pgpy: Can't check signature: No public key\n"
+            return result
+
+        result.pubkey_fingerprint = str(key.fingerprint)
+        result.username = PgpyGPG._get_username(key)
+        # Neither the primary key nor the subkey that made the signature may be revoked or expired
+        signing_key = key.subkeys.get(signature.signer, key)
+        key_statuses = [(key, PgpyGPG._get_key_status(key))]
+        if signing_key is not key:
+            key_statuses.append((signing_key, PgpyGPG._get_key_status(key, signing_key)))
+        for checked_key, key_status in key_statuses:
+            if key_status == 'r':
+                result.status = 'signing key was revoked'
+                result.stderr += 'pgpy: key ' + str(checked_key.fingerprint) + ' has been revoked\n'
+                return result
+            elif key_status == 'e':
+                result.status = 'signing key has expired'
+                result.stderr += 'pgpy: key ' + str(checked_key.fingerprint) + ' has expired\n'
+                return result
+
+        # Subkeys can only sign if the primary key bound them with the signing flag
+        if signing_key is not key:
+            binding_signature = PgpyGPG._get_binding_signature(key, signing_key)
+            if binding_signature is None:
+                result.status = 'no public key'
+                result.stderr += 'pgpy: subkey ' + str(signing_key.fingerprint) + ' has no valid binding signature\n'
+                return result
+            if pgpy.constants.KeyFlags.Sign not in binding_signature.key_flags:
+                result.status = 'signature error'
+                result.stderr += 'pgpy: subkey ' + str(signing_key.fingerprint) + ' is not usable for signing\n'
+                return result
+
+        # Verify the signature
+        try:
+            data = read_data()
+            verified = bool(key.verify(data, signature))
+        except (OSError, TypeError) as err:
+            result.status = 'signature error'
+            result.stderr += 'pgpy: ' + str(err) + '\n'
+            return result
+        except Exception as err:
+            result.status = 'signature error'
+            result.stderr += 'pgpy: unable to verify signature: ' + (str(err) or type(err).__name__) + '\n'
+            return result
+
+        if verified:
+            result.valid = True
+            result.status = 'signature valid'
+            result.fingerprint = str(signing_key.fingerprint)
+            result.stderr += 'pgpy: Good signature from "' + result.username + '"\n'
+        else:
+            result.status = 'signature bad'
+            result.stderr += 'pgpy: BAD signature from "' + result.username + '"\n'
+        return result
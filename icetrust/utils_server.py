@@ -0,0 +1,406 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib, json, os, socket, socketserver, stat, threading, time
+
+import filehash
+
+from icetrust.utils import BACKEND_GNUPG, DEFAULT_HASH_ALGORITHM, DEFAULT_KEY_CACHE_TTL, GpgContext, HashCache, \
+    IcetrustUtils, MsgCallback
+
+# Default number of requests handled concurrently by the server
+DEFAULT_SERVER_WORKERS = 16
+
+# Default maximum number of GPG contexts kept by the server, the least recently used ones are evicted
+DEFAULT_GPG_CONTEXT_CACHE_SIZE = 64
+
+# Commands accepted by the server
+SERVER_COMMANDS = ['canary', 'checksum', 'checksumfile', 'pgp', 'pgpchecksumfile', 'ping']
+
+# Request arguments containing paths, these are made absolute by the client since the server has its own
+# working directory
+PATH_ARGUMENTS = ['checksumfile', 'filename', 'gpg_home', 'keyfile', 'save_file', 'signaturefile', 'trust_keyring']
+
+
+class IcetrustServer(object):
+    """
+    Verification server that keeps warm state between requests: gpg contexts with imported keys, file hashes,
+    HTTP sessions and the compiled config schema. Requests are JSON objects sent one per line over a Unix
+    socket, each one is answered with a JSON object on a single line that has the same "id".
+    """
+    def __init__(self, socket_path, max_workers=DEFAULT_SERVER_WORKERS, key_cache=None,
+                 key_cache_ttl=DEFAULT_KEY_CACHE_TTL, verification_cache=None, hash_cache=None,
+                 max_gpg_contexts=DEFAULT_GPG_CONTEXT_CACHE_SIZE):
+        """
+        :param socket_path: path of the Unix socket to listen on
+        :param max_workers: maximum number of requests handled concurrently
+        :param key_cache: KeyCache used for keys from key servers, optional
+        :param key_cache_ttl: time in seconds after which keys from key servers are imported again
+        :param verification_cache: VerificationCache used for signatures, optional
+        :param hash_cache: HashCache used for file hashes, if not passed a new one is used
+        :param max_gpg_contexts: maximum number of gpg contexts to keep, one is used for each set of keys
+        """
+        self.socket_path = str(socket_path)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.key_cache = key_cache
+        self.key_cache_ttl = key_cache_ttl
+        self.verification_cache = verification_cache
+        self.hash_cache = hash_cache if hash_cache is not None else HashCache()
+        self.max_gpg_contexts = max_gpg_contexts
+        self.lock = threading.Lock()
+        self.gpg_contexts = OrderedDict()
+        self.context_locks = dict()
+        self.canary_state = None
+        self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stops the server and removes the socket, gpg contexts are cleaned up once they are no longer used"""
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.gpg_contexts.clear()
+
+    def bind(self):
+        """
+        Creates the socket, only the current user can connect to it
+
+        :raises RuntimeError: if another server is already listening on the socket
+        """
+        # A socket file left behind by a server that didn't shut down cleanly is replaced
+        if os.path.exists(self.socket_path):
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                raise RuntimeError('Socket path exists and is not a socket: ' + self.socket_path)
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as test_socket:
+                    test_socket.connect(self.socket_path)
+                raise RuntimeError('Server is already running on socket: ' + self.socket_path)
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+
+        server = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.handle_connection(self.rfile, self.wfile)
+
+        old_umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.server.daemon_threads = True
+
+    def serve_forever(self):
+        """Handles requests until shutdown() is called"""
+        if self.server is None:
+            self.bind()
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """Stops serve_forever(), must be called from another thread"""
+        if self.server is not None:
+            self.server.shutdown()
+
+    def handle_connection(self, rfile, wfile):
+        """
+        Reads requests from a connection until it is closed, requests are handled concurrently and responses
+        are written as soon as they are ready, so they can be in a different order than the requests
+
+        :param rfile: stream to read requests from
+        :param wfile: stream to write responses to
+        """
+        write_lock = threading.Lock()
+        futures = []
+
+        def handle_and_respond(line):
+            response = json.dumps(self.handle_line(line), separators=(',', ':')).encode('utf-8') + b'\n'
+            with write_lock:
+                try:
+                    wfile.write(response)
+                    wfile.flush()
+                except OSError:
+                    # The client closed the connection before reading the response
+                    pass
+
+        for line in rfile:
+            if not line.strip():
+                continue
+            try:
+                futures.append(self.executor.submit(handle_and_respond, line))
+            except RuntimeError:
+                # The server is shutting down
+                break
+
+        # Keep the connection open until all responses are written
+        for future in futures:
+            future.exception()
+
+    def handle_line(self, line):
+        """
+        Parses and handles a single request line
+
+        :param line: request as JSON
+        :return: response object
+        """
+        try:
+            request = json.loads(line.decode('utf-8') if isinstance(line, bytes) else line)
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object')
+        except ValueError as err:
+            return {'id': None, 'verified': False, 'error': 'Invalid request: ' + str(err)}
+        return self.handle_request(request)
+
+    def handle_request(self, request):
+        """
+        Handles a single request
+
+        :param request: request object with the "command", optional "id" and "verbose" fields, and the
+                        arguments of the command
+        :return: response object with the "id", "verified" and "messages" fields, "results" for canary
+                 requests and "error" if the request couldn't be handled
+        """
+        response = {'id': request.get('id'), 'verified': False, 'messages': []}
+        command = request.get('command')
+        if command not in SERVER_COMMANDS:
+            response['error'] = 'Unknown command: ' + str(command)
+            return response
+
+        msg_callback = MsgCallback() if request.get('verbose') else None
+        try:
+            if command == 'ping':
+                response['verified'] = True
+            elif command == 'canary':
+                response['results'] = self.run_canary(request, msg_callback)
+                response['verified'] = response['results'] is not None and \
+                    all(output_obj['verified'] for output_obj in response['results'])
+            else:
+                response['verified'] = bool(getattr(self, 'run_' + command)(request, msg_callback))
+        except (KeyError, TypeError, ValueError) as err:
+            response['error'] = 'Invalid request: ' + (str(err) or type(err).__name__)
+        except Exception as err:
+            response['error'] = str(err) or type(err).__name__
+        if msg_callback:
+            response['messages'] = msg_callback.messages
+        return response
+
+    def _verify_checksum(self, request, msg_callback, checksum_value=None, checksumfile=None):
+        """Verifies a checksum, using the hash cache for the file being verified unless it is decompressed"""
+        algorithm = request.get('algorithm', DEFAULT_HASH_ALGORITHM)
+        if algorithm not in filehash.SUPPORTED_ALGORITHMS:
+            raise ValueError('Unsupported algorithm value')
+        decompress = request.get('decompress')
+        calculated_hash = None
+        if decompress is None:
+            try:
+                calculated_hash = self.hash_cache.get_hash(request['filename'], algorithm)
+            except OSError:
+                # Let verify_checksum() report the error in the same way as the CLI does
+                pass
+        return IcetrustUtils.verify_checksum(request['filename'], algorithm, msg_callback=msg_callback,
+                                             checksum_value=checksum_value, checksumfile=checksumfile,
+                                             calculated_hash=calculated_hash, decompress=decompress)
+
+    def run_checksum(self, request, msg_callback):
+        """Handles "checksum" requests: filename, checksum_value, algorithm and decompress"""
+        return self._verify_checksum(request, msg_callback, checksum_value=request['checksum_value'])
+
+    def run_checksumfile(self, request, msg_callback):
+        """Handles "checksumfile" requests: filename, checksumfile, algorithm and decompress"""
+        return self._verify_checksum(request, msg_callback, checksumfile=request['checksumfile'])
+
+    def get_gpg_context(self, request, msg_callback):
+        """
+        Returns a gpg context with the keys from the request imported, contexts are kept between requests and
+        each one only contains the keys of a single key source, so requests never see keys of other requests
+
+        :param request: request with the "keyfile" or "keyid" and "keyserver" fields, and optional "gpg_home",
+                        "trust_keyring" and "backend" fields
+        :param msg_callback: message callback object, can be used to collect additional data via .echo()
+        :return: GpgContext, or None if the keys couldn't be imported
+        """
+        keyfile = request.get('keyfile')
+        keyid = request.get('keyid')
+        keyserver = request.get('keyserver')
+        if isinstance(keyserver, list):
+            keyserver = keyserver[0] if len(keyserver) == 1 else keyserver
+        gpg_home = request.get('gpg_home')
+        trust_keyring = request.get('trust_keyring')
+        if (keyid is None) != (keyserver is None) or \
+                (keyfile is None and keyid is None and gpg_home is None and trust_keyring is None):
+            raise ValueError("Either 'keyfile' or 'keyid/keyserver' arguments must be set")
+
+        # Key files are identified by their contents, so changed files are imported again
+        if keyfile is not None:
+            with open(keyfile, 'rb') as keyfile_stream:
+                key_source = ('keyfile', hashlib.sha256(keyfile_stream.read()).hexdigest())
+        elif keyid is not None:
+            key_source = ('keyid', keyid, tuple(keyserver) if isinstance(keyserver, list) else keyserver)
+        else:
+            key_source = None
+        context_key = (request.get('backend', BACKEND_GNUPG), gpg_home, trust_keyring, key_source)
+
+        with self.lock:
+            context_lock = self.context_locks.setdefault(context_key, threading.Lock())
+        with context_lock:
+            with self.lock:
+                entry = self.gpg_contexts.get(context_key)
+                if entry is not None:
+                    # Keys from key servers are imported again once they are old, to pick up revocations
+                    if keyid is not None and time.monotonic() - entry[1] > self.key_cache_ttl:
+                        del self.gpg_contexts[context_key]
+                    else:
+                        self.gpg_contexts.move_to_end(context_key)
+                        return entry[0]
+
+            gpg_context = GpgContext(gpg_home_dir=gpg_home, trust_keyring=trust_keyring, key_cache=self.key_cache,
+                                     backend=request.get('backend', BACKEND_GNUPG),
+                                     verification_cache=self.verification_cache)
+            if key_source is not None and not gpg_context.import_keys(msg_callback=msg_callback, keyfile=keyfile,
+                                                                      keyid=keyid, keyserver=keyserver):
+                gpg_context.close()
+                with self.lock:
+                    if context_key not in self.gpg_contexts:
+                        self.context_locks.pop(context_key, None)
+                return None
+
+            # Evicted contexts are cleaned up once requests using them are done, their locks are dropped so only
+            # the locks of cached contexts are kept
+            with self.lock:
+                self.gpg_contexts[context_key] = (gpg_context, time.monotonic())
+                while len(self.gpg_contexts) > self.max_gpg_contexts:
+                    evicted_key, _ = self.gpg_contexts.popitem(last=False)
+                    self.context_locks.pop(evicted_key, None)
+            return gpg_context
+
+    def run_pgp(self, request, msg_callback):
+        """Handles "pgp" requests: filename, signaturefile and keys"""
+        gpg_context = self.get_gpg_context(request, msg_callback)
+        if gpg_context is None:
+            return False
+        return gpg_context.verify(request['filename'], request['signaturefile'], msg_callback=msg_callback)
+
+    def run_pgpchecksumfile(self, request, msg_callback):
+        """Handles "pgpchecksumfile" requests: filename, checksumfile, signaturefile, algorithm and keys"""
+        gpg_context = self.get_gpg_context(request, msg_callback)
+        if gpg_context is None:
+            return False
+        if not gpg_context.verify(request['checksumfile'], request['signaturefile'], msg_callback=msg_callback):
+            return False
+        return self._verify_checksum(request, msg_callback, checksumfile=request['checksumfile'])
+
+    def run_canary(self, request, msg_callback):
+        """
+        Handles "canary" requests: a parsed config and an optional save_file, downloads share the HTTP sessions
+        and per-host limits of the server
+
+        :return: list of output objects, or None if the config is invalid or can't be processed
+        """
+        from icetrust.utils_canary import DownloadPolicy, FetchPlan, HostLimiter, IcetrustCanaryUtils
+
+        with self.lock:
+            if self.canary_state is None:
+                self.canary_state = (HostLimiter(), DownloadPolicy())
+            host_limiter, download_policy = self.canary_state
+
+        config_data = IcetrustCanaryUtils.validate_config(request['config'], msg_callback=msg_callback)
+        if config_data is None:
+            return None
+        with FetchPlan([config_data], host_limiter=host_limiter, download_policy=download_policy,
+                       key_cache=self.key_cache, verification_cache=self.verification_cache) as fetch_plan:
+            return IcetrustCanaryUtils.canary_run(config_data, msg_callback=msg_callback,
+                                                  save_file=request.get('save_file'), fetch_plan=fetch_plan)
+
+
+class IcetrustClient(object):
+    """Client for IcetrustServer, sends requests over a single connection to the server"""
+    def __init__(self, socket_path, timeout=None):
+        """
+        :param socket_path: path of the Unix socket the server listens on
+        :param timeout: timeout in seconds for connecting and for each response, waits forever if not passed
+        """
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.socket = None
+        self.rfile = None
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the connection to the server"""
+        if self.socket is not None:
+            self.rfile.close()
+            self.socket.close()
+            self.socket = None
+            self.rfile = None
+
+    def request(self, command, **arguments):
+        """
+        Sends a request to the server and waits for the response, paths in the arguments are made absolute
+
+        :param command: command to run, one of SERVER_COMMANDS
+        :param arguments: arguments of the command
+        :return: response object
+        :raises OSError: if the server can't be reached or closes the connection
+        """
+        request = {argument: os.path.abspath(value) if argument in PATH_ARGUMENTS and value is not None else value
+                   for argument, value in arguments.items()}
+        request['command'] = command
+        with self.lock:
+            self.next_id += 1
+            request['id'] = self.next_id
+            if self.socket is None:
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.socket.settimeout(self.timeout)
+                try:
+                    self.socket.connect(self.socket_path)
+                except OSError:
+                    self.socket.close()
+                    self.socket = None
+                    raise
+                self.rfile = self.socket.makefile('rb')
+            self.socket.sendall(json.dumps(request, separators=(',', ':')).encode('utf-8') + b'\n')
+
+            # Requests are sent one at a time, so the next response is the one for this request
+            line = self.rfile.readline()
+            if not line:
+                self.close()
+                raise ConnectionError('Connection closed by the server')
+        return json.loads(line.decode('utf-8'))
@@ -0,0 +1,311 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import hashlib, threading, time
+
+import filehash
+
+from icetrust.utils import BACKEND_GNUPG, DEFAULT_HASH_ALGORITHM, GpgContext, HashCache, IcetrustUtils, \
+    STREAM_CHUNK_SIZE, ZLIB_HASHERS
+
+# Failure reasons not reported by gpg, signature failures use the gpg status (for example "signature bad",
+# "no public key" or "signing key was revoked")
+FAILURE_FILE_UNREADABLE = 'file cannot be read'
+FAILURE_CHECKSUM_MISMATCH = 'checksum mismatch'
+FAILURE_CHECKSUM_NOT_FOUND = 'checksum not found in checksum file'
+FAILURE_SIGNATURE_ERROR = 'signature error'
+
+
+class VerificationResult(object):
+    """
+    Result of a single verification. Only plain values are stored, messages are never built, and
+    errors are kept as exception objects so that formatting them is left to the caller.
+    """
+    __slots__ = ('verified', 'failure', 'error', 'filename', 'algorithm', 'digest', 'fingerprint', 'key_id',
+                 'cached', 'hash_time', 'verify_time', 'total_time')
+
+    def __init__(self, filename):
+        self.verified = False
+        self.failure = None
+        self.error = None
+        self.filename = filename
+        self.algorithm = None
+        self.digest = None
+        self.fingerprint = None
+        self.key_id = None
+        self.cached = False
+        self.hash_time = None
+        self.verify_time = None
+        self.total_time = None
+
+    def __bool__(self):
+        return self.verified
+
+    def __repr__(self):
+        return 'VerificationResult(' + ', '.join(name + '=' + repr(getattr(self, name))
+                                                 for name in self.__slots__) + ')'
+
+
+class Verifier(object):
+    """
+    Library API for embedding verification in other programs. Methods never exit the interpreter or output
+    anything, they return a VerificationResult with the digest, signer and timings or the reason of the
+    failure. Invalid arguments raise ValueError.
+
+    A verifier is meant to be created once and shared: it is thread-safe and owns pooled resources, a GPG
+    context with its keyring, an HTTP session for key servers, a cache of file hashes and a read buffer per
+    thread. Verifications only take a lock to create these on first use or to update the hash cache.
+    """
+    def __init__(self, gpg_context=None, algorithm=DEFAULT_HASH_ALGORITHM, gpg_home_dir=None, trust_keyring=None,
+                 backend=BACKEND_GNUPG, key_cache=None, verification_cache=None, hash_cache=None):
+        """
+        :param gpg_context: GpgContext to use for PGP verification, if not passed one is created when first needed
+        :param algorithm: default hash algorithm
+        :param gpg_home_dir: directory to use for GPG home of the created context
+        :param trust_keyring: keyring file with trusted keys of the created context
+        :param backend: OpenPGP backend of the created context, one of PGP_BACKENDS
+        :param key_cache: KeyCache used by the created context for keys from key servers
+        :param verification_cache: VerificationCache used by the created context
+        :param hash_cache: HashCache used for file hashes, if not passed a new one is used
+        """
+        if algorithm not in filehash.SUPPORTED_ALGORITHMS:
+            raise ValueError('Unsupported algorithm value')
+        self.algorithm = algorithm
+        self.gpg_context = gpg_context
+        self.owns_gpg_context = gpg_context is None
+        self.gpg_options = dict(gpg_home_dir=gpg_home_dir, trust_keyring=trust_keyring, backend=backend,
+                                key_cache=key_cache, verification_cache=verification_cache)
+        self.hash_cache = hash_cache if hash_cache is not None else HashCache()
+        self.session = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the GPG context if it was created by the verifier and the HTTP session, must not be called while
+        verifications are running"""
+        with self.lock:
+            if self.owns_gpg_context and self.gpg_context is not None:
+                self.gpg_context.close()
+                self.gpg_context = None
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def _get_gpg_context(self):
+        """Returns the GPG context, creating it if needed"""
+        gpg_context = self.gpg_context
+        if gpg_context is None:
+            with self.lock:
+                if self.gpg_context is None:
+                    self.gpg_context = GpgContext(**self.gpg_options)
+                gpg_context = self.gpg_context
+        return gpg_context
+
+    def _get_session(self):
+        """Returns the HTTP session, creating it if needed"""
+        session = self.session
+        if session is None:
+            # requests is only imported when keys are fetched, to keep startup fast
+            import requests
+
+            with self.lock:
+                if self.session is None:
+                    self.session = requests.Session()
+                session = self.session
+        return session
+
+    def _hash_path(self, path, algorithm):
+        """Hashes a file, reading it into the buffer of the current thread"""
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            buffer = self.local.buffer = bytearray(STREAM_CHUNK_SIZE)
+        view = memoryview(buffer)
+        hasher = ZLIB_HASHERS[algorithm]() if algorithm in ZLIB_HASHERS else hashlib.new(algorithm)
+        with open(path, 'rb', buffering=0) as file:
+            while True:
+                size = file.readinto(buffer)
+                if not size:
+                    break
+                hasher.update(view[:size])
+        return hasher.hexdigest().lower()
+
+    def _get_algorithm(self, algorithm):
+        """Returns the algorithm to use, raises ValueError if it isn't supported"""
+        if algorithm is None:
+            return self.algorithm
+        if algorithm not in filehash.SUPPORTED_ALGORITHMS:
+            raise ValueError('Unsupported algorithm value')
+        return algorithm
+
+    def _hash_file(self, result, filename, algorithm):
+        """Hashes a file into the result, returns False and sets the failure if it can't be read"""
+        start_time = time.perf_counter()
+        result.algorithm = algorithm
+        try:
+            result.digest = self.hash_cache.get_hash(filename, algorithm, hash_file=self._hash_path)
+        except OSError as err:
+            result.failure = FAILURE_FILE_UNREADABLE
+            result.error = err
+            return False
+        finally:
+            result.hash_time = time.perf_counter() - start_time
+        return True
+
+    def _verify_signature(self, result, filename, signaturefile):
+        """Verifies a signature into the result, returns True if it is valid"""
+        start_time = time.perf_counter()
+        gpg_context = self._get_gpg_context()
+        try:
+            # Verify the signature, unless the same file, signature and keys were already verified
+            verification_cache = gpg_context.verification_cache
+            try:
+                verification_result, cached_fingerprint = IcetrustUtils.pgp_verify_cached(
+                    gpg_context.gpg, filename, signaturefile, verification_cache=verification_cache,
+                    keyring_state=gpg_context.get_keyring_state() if verification_cache is not None else None)
+            except OSError as err:
+                result.failure = FAILURE_FILE_UNREADABLE
+                result.error = err
+                return False
+            if cached_fingerprint is not None:
+                result.fingerprint = cached_fingerprint
+                result.cached = True
+                return True
+            result.key_id = verification_result.key_id
+            result.fingerprint = verification_result.pubkey_fingerprint or verification_result.fingerprint
+
+            # Signatures by revoked keys have a valid status but aren't valid
+            if verification_result.status == 'signature valid' and verification_result.valid:
+                return True
+            if verification_result.status == 'signature valid':
+                result.failure = 'signing key was revoked'
+            else:
+                result.failure = verification_result.status or FAILURE_SIGNATURE_ERROR
+            return False
+        finally:
+            result.verify_time = time.perf_counter() - start_time
+
+    @staticmethod
+    def _match_checksumfile(result, checksumfile):
+        """Looks for the digest of the result in a checksum file, returns True if found"""
+        try:
+            with open(checksumfile, 'rb') as file:
+                checksums_content = file.read()
+        except OSError as err:
+            result.failure = FAILURE_FILE_UNREADABLE
+            result.error = err
+            return False
+        if result.digest.encode('ascii') in checksums_content:
+            return True
+        result.failure = FAILURE_CHECKSUM_NOT_FOUND
+        return False
+
+    def import_keys(self, keyfile=None, keyid=None, keyserver=None):
+        """
+        Imports keys into the GPG context, key sources that were already imported are skipped
+
+        :param keyfile: file containing PGP keys to be imported
+        :param keyid: ID of the key to be imported from a key server
+        :param keyserver: domain name of the key server to be used, or a list of key servers to query concurrently
+        :return: True if import was successful, False otherwise
+        """
+        if not keyfile and (keyid is None or keyserver is None):
+            raise ValueError('Either keyfile or keyid and keyserver arguments must be set')
+        gpg_context = self._get_gpg_context()
+        if keyid is not None and gpg_context.session is None and self.owns_gpg_context:
+            gpg_context.session = self._get_session()
+        return bool(gpg_context.import_keys(keyfile=keyfile, keyid=keyid, keyserver=keyserver))
+
+    def checksum(self, filename, checksum_value, algorithm=None):
+        """
+        Verifies a file against a checksum value
+
+        :param filename: file to be verified
+        :param checksum_value: expected checksum
+        :param algorithm: hash algorithm, if not passed the default algorithm of the verifier is used
+        :return: VerificationResult
+        """
+        start_time = time.perf_counter()
+        result = VerificationResult(filename)
+        if self._hash_file(result, filename, self._get_algorithm(algorithm)):
+            if result.digest == checksum_value.lower().strip():
+                result.verified = True
+            else:
+                result.failure = FAILURE_CHECKSUM_MISMATCH
+        result.total_time = time.perf_counter() - start_time
+        return result
+
+    def checksumfile(self, filename, checksumfile, algorithm=None):
+        """
+        Verifies a file against a checksum file, following the format from shasum
+
+        :param filename: file to be verified
+        :param checksumfile: file containing checksums
+        :param algorithm: hash algorithm, if not passed the default algorithm of the verifier is used
+        :return: VerificationResult
+        """
+        start_time = time.perf_counter()
+        result = VerificationResult(filename)
+        if self._hash_file(result, filename, self._get_algorithm(algorithm)):
+            result.verified = self._match_checksumfile(result, checksumfile)
+        result.total_time = time.perf_counter() - start_time
+        return result
+
+    def pgp(self, filename, signaturefile):
+        """
+        Verifies a file against its PGP signature using the keys in the GPG context
+
+        :param filename: file to be verified
+        :param signaturefile: file containing the PGP signature
+        :return: VerificationResult
+        """
+        start_time = time.perf_counter()
+        result = VerificationResult(filename)
+        result.verified = self._verify_signature(result, filename, signaturefile)
+        result.total_time = time.perf_counter() - start_time
+        return result
+
+    def pgpchecksumfile(self, filename, checksumfile, signaturefile, algorithm=None):
+        """
+        Verifies a file against a checksum file, after verifying the checksum file against its PGP signature.
+        The file isn't hashed if the signature isn't valid.
+
+        :param filename: file to be verified
+        :param checksumfile: file containing checksums
+        :param signaturefile: file containing the PGP signature of the checksum file
+        :param algorithm: hash algorithm, if not passed the default algorithm of the verifier is used
+        :return: VerificationResult
+        """
+        start_time = time.perf_counter()
+        result = VerificationResult(filename)
+        algorithm = self._get_algorithm(algorithm)
+        if self._verify_signature(result, checksumfile, signaturefile) and \
+                self._hash_file(result, filename, algorithm):
+            result.verified = self._match_checksumfile(result, checksumfile)
+        result.total_time = time.perf_counter() - start_time
+        return result
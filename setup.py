@@ -17,6 +17,9 @@ setup(
     packages=find_packages(exclude=["scripts.*", "scripts", "tests.*", "tests"]),
     include_package_data=True,
     install_requires=open('requirements.txt').read().splitlines(),
+    extras_require={
+        'pgpy': ['pgpy>=0.5.4'],
+    },
     entry_points={
         'console_scripts': [
             'icetrust = icetrust.cli:cli'
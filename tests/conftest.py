@@ -0,0 +1,137 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os, shutil, tempfile, threading, time
+
+import pytest
+
+from icetrust.utils import IcetrustUtils, MsgCallback
+from test_utils import start_server, TEST_DIR
+
+
+class MockHttpHandler(BaseHTTPRequestHandler):
+    """Returns canned responses configured on the server"""
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            count = self.server.requests.count(self.path)
+
+        # Each response is a tuple of status code, body and delay in seconds, the last one is repeated
+        responses = self.server.responses.get(self.path, [(404, b'', 0)])
+        status, body, delay = responses[min(count, len(responses)) - 1]
+        time.sleep(delay)
+        try:
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockHttpServer(ThreadingHTTPServer):
+    """Local HTTP server used instead of remote servers"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), MockHttpHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.responses = dict()
+
+    def url(self, path):
+        return 'http://127.0.0.1:' + str(self.server_address[1]) + path
+
+
+def run_http_server():
+    # Run a local HTTP server in the background
+    server = MockHttpServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def http_server():
+    yield from run_http_server()
+
+
+@pytest.fixture
+def http_server2():
+    # Second server, for tests that need several hosts
+    yield from run_http_server()
+
+
+@pytest.fixture
+def copy_keyring(tmp_path):
+    # Copying keyring to speed things up
+    shutil.copy(os.path.join(TEST_DIR, 'pubring.kbx'), tmp_path)
+
+
+@pytest.fixture
+def mock_msg_callback():
+    # Return mock message callback object
+    return MsgCallback()
+
+
+@pytest.fixture()
+def manifest_dir(tmp_path):
+    shutil.copy(os.path.join(TEST_DIR, 'file1.txt'), str(tmp_path))
+    os.makedirs(str(tmp_path / 'sub'))
+    shutil.copy(os.path.join(TEST_DIR, 'file2.txt'), str(tmp_path / 'sub'))
+    return tmp_path
+
+
+@pytest.fixture()
+def signing_home():
+    # gpg-agent sockets have a short path length limit, so pytest's temporary directories can't be used
+    gpg_home_dir = tempfile.mkdtemp()
+    gpg = IcetrustUtils.pgp_init(gpg_home_dir=gpg_home_dir)
+    key = gpg.gen_key(gpg.gen_key_input(key_type='EDDSA', key_curve='ed25519', key_usage='sign',
+                                        name_email='manifest@example.com', no_protection=True))
+    assert key.fingerprint
+    yield gpg_home_dir, key.fingerprint
+    shutil.rmtree(gpg_home_dir, ignore_errors=True)
+
+
+@pytest.fixture()
+def socket_path():
+    # Unix socket paths have a short length limit, so pytest's temporary directories can't be used
+    socket_dir = tempfile.mkdtemp()
+    yield os.path.join(socket_dir, 'icetrust.sock')
+    shutil.rmtree(socket_dir)
+
+
+@pytest.fixture()
+def server(socket_path):
+    server, thread = start_server(socket_path)
+    yield server
+    server.shutdown()
+    thread.join()
+    server.close()
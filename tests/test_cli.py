@@ -21,13 +21,16 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import os
+from pathlib import Path
+import os, shutil, subprocess, sys, tarfile, time
 
 from click.testing import CliRunner
+import pytest
 
 from icetrust.cli import cli
 from icetrust.utils import IcetrustUtils
-from test_utils import TEST_DIR, FILE1_HASH, FILE2_HASH
+from test_utils import TEST_DIR, FILE1_HASH, FILE2_HASH, write_compressed
+from test_utils_archive import make_manifest, make_tar, make_wheel, MEMBERS
 
 
 # Tests for "--version" option
@@ -39,6 +42,55 @@ class TestCliVersion(object):
         assert result.output == 'icetrust, version ' + IcetrustUtils.get_version() + '\n'
 
 
+# Tests for startup time of commands that don't need heavy dependencies
+class TestCliStartup(object):
+    # Modules that are slow to import and only needed by some commands
+    HEAVY_MODULES = ['concurrent.futures', 'gnupg', 'icetrust.utils_canary', 'icetrust.utils_server', 'jsonschema',
+                     'pkg_resources', 'requests', 'socketserver', 'tzlocal']
+
+    # Maximum time in seconds for running a command, on top of the time to start Python itself
+    STARTUP_BUDGET = 0.3
+
+    CHECKSUM_ARGS = ['checksum', os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH]
+
+    @staticmethod
+    def get_run_time(args, runs=5):
+        best_time = None
+        for _ in range(runs):
+            start_time = time.monotonic()
+            subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, check=True)
+            run_time = time.monotonic() - start_time
+            best_time = run_time if best_time is None else min(best_time, run_time)
+        return best_time
+
+    @staticmethod
+    def get_imported_modules(args):
+        script = 'import sys\n' + \
+                 'from icetrust.cli import cli\n' + \
+                 'try:\n' + \
+                 '    cli(sys.argv[1:])\n' + \
+                 'finally:\n' + \
+                 '    sys.stderr.write(" ".join(sorted(sys.modules)))\n'
+        result = subprocess.run([sys.executable, '-c', script] + args, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        return result.stderr.split()
+
+    @pytest.mark.parametrize('args', [['--version'], CHECKSUM_ARGS])
+    def test_heavy_modules_not_imported(self, args):
+        imported_modules = self.get_imported_modules(args)
+        assert [module for module in self.HEAVY_MODULES if module in imported_modules] == []
+
+    def test_heavy_modules_imported_for_canary(self):
+        imported_modules = self.get_imported_modules(['canary', '--help'])
+        assert 'icetrust.utils_canary' in imported_modules
+
+    @pytest.mark.slow
+    @pytest.mark.parametrize('args', [['--version'], CHECKSUM_ARGS])
+    def test_startup_budget(self, args):
+        python_time = self.get_run_time(['-c', 'pass'])
+        assert self.get_run_time(['-m', 'icetrust.cli'] + args) < python_time + self.STARTUP_BUDGET
+
+
 # Tests for "compare_files" option
 class TestCliCompareFiles(object):
     def test_valid(self):
@@ -251,6 +303,144 @@ class TestCliVerifyPgp(object):
         assert "ERROR: Either '--keyfile' or '--keyid/--keyserver' parameters must be set!\n" in result.output
 
 
+    @pytest.mark.slow
+    def test_valid_keyfile(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_valid_trust_keyring(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx')])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_valid_multiple_keyservers(self, http_server, http_server2):
+        with open(os.path.join(TEST_DIR, 'pgp_keys.txt'), 'rb') as keyfile:
+            http_server2.responses['/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'] = \
+                [(200, keyfile.read(), 0)]
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'), '--keyid', 'FBFCC82A015E7330',
+                                     '--keyserver', http_server.url(''), '--keyserver', http_server2.url('')])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_valid_verification_cache(self, tmp_path):
+        runner = CliRunner()
+        args = ['pgp', os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'),
+                '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx'), '--verification-cache-dir', str(tmp_path)]
+        result = runner.invoke(cli, args)
+        assert result.exit_code == 0
+        result = runner.invoke(cli, args + ['--verbose'])
+        assert result.exit_code == 0
+        assert result.output == 'Using cached verification result, signed by: ' \
+                                'D1A66E1A23B182C9980F788CFBFCC82A015E7330\nFile verified\n'
+
+    def test_invalid_trust_keyring_wrong_file(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file2.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx')])
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: File cannot be verified!\n'
+
+    @pytest.mark.slow
+    def test_valid_gpg_home(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt'),
+                                     '--gpg-home', str(tmp_path)])
+        assert result.exit_code == 0
+
+        # Keys imported in the previous run are still in the GPG home
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--gpg-home', str(tmp_path)])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+
+    def test_valid_backend_pgpy(self):
+        pytest.importorskip('pgpy')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.ed25519.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt'),
+                                     '--backend', 'pgpy'])
+        assert result.exit_code == 0
+        # pgpy writes warnings about checks it doesn't implement itself to stderr
+        assert result.stdout == 'File verified\n'
+
+    def test_invalid_backend_pgpy_trust_keyring(self):
+        pytest.importorskip('pgpy')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'file2.txt'),
+                                     '--backend', 'pgpy'])
+        assert result.exit_code == 2
+        assert result.output.startswith('ERROR: Unable to load keyring: ')
+
+
+# Tests for "pgpbatch" option
+class TestCliVerifyPgpBatch(object):
+    def test_invalid_bad_arguments_missing_files(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpbatch', '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')])
+        assert result.exit_code == 2
+        assert "ERROR: Either '--pair' or '--dir' parameters must be set!\n" in result.output
+
+    def test_invalid_bad_arguments_missing_keys(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpbatch', '--pair', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig')])
+        assert result.exit_code == 2
+        assert "ERROR: Either '--keyfile' or '--keyid/--keyserver' parameters must be set!\n" in result.output
+
+    def test_invalid_empty_dir(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpbatch', '--dir', str(tmp_path),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx')])
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: No files with signatures found!\n'
+
+    def test_valid_pairs(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpbatch',
+                                     '--pair', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--pair', os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx')])
+        assert result.exit_code == 0
+        assert set(result.output.splitlines()) == {
+            os.path.join(TEST_DIR, 'file1.txt') + ': File verified',
+            os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS') + ': File verified',
+        }
+
+    @pytest.mark.slow
+    def test_invalid_dir(self, tmp_path):
+        shutil.copy(os.path.join(TEST_DIR, 'file1.txt'), tmp_path)
+        shutil.copy(os.path.join(TEST_DIR, 'file1.txt.sig'), tmp_path)
+        shutil.copy(os.path.join(TEST_DIR, 'file2.txt'), tmp_path)
+        shutil.copy(os.path.join(TEST_DIR, 'file1.txt.sig'), os.path.join(tmp_path, 'file2.txt.asc'))
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpbatch', '--dir', str(tmp_path), '--jobs', '2',
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')])
+        assert result.exit_code == -1
+        assert set(result.output.splitlines()) == {
+            os.path.join(tmp_path, 'file1.txt') + ': File verified',
+            os.path.join(tmp_path, 'file2.txt') + ': ERROR: File cannot be verified!',
+        }
+
+
 # Tests for "pgpchecksumfile" option
 class TestCliVerifyPgpChecksumFile(object):
     def test_invalid_bad_arguments_missing_filename(self):
@@ -295,3 +485,364 @@ class TestCliVerifyPgpChecksumFile(object):
                                      os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig')])
         assert result.exit_code == 2
         assert "ERROR: Either '--keyfile' or '--keyid/--keyserver' parameters must be set!\n" in result.output
+
+    @pytest.mark.slow
+    def test_valid_keyfile(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpchecksumfile', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_valid_trust_keyring(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpchecksumfile', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx')])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_invalid_wrong_signature(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpchecksumfile', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--trust-keyring', os.path.join(TEST_DIR, 'pubring.kbx')])
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: File cannot be verified!\n'
+
+
+# Tests for "serve" option and sending commands to the verification server
+class TestCliServer(object):
+    def test_checksum(self, server, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '--verbose', os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 0
+        assert result.output == 'Algorithm: sha256\n' + \
+               'File hash: ' + FILE1_HASH + '\n' + \
+               'File verified\n'
+
+    def test_checksum_invalid(self, server, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', os.path.join(TEST_DIR, 'file1.txt'), FILE2_HASH],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: File cannot be verified!\n'
+
+    def test_checksumfile(self, server, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksumfile', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS')],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_pgp(self, server, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_pgpchecksumfile(self, server, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgpchecksumfile', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_pgp_verification_cache_dir(self, server, socket_path, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', os.path.join(TEST_DIR, 'file1.txt'),
+                                     os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt'),
+                                     '--verification-cache-dir', str(tmp_path / 'cache')],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 2
+        assert result.output == "ERROR: '--verification-cache-dir' can't be used with the verification server!\n"
+        assert not (tmp_path / 'cache').exists()
+
+    @pytest.mark.parametrize('args', [['--retries', '5'], ['--hedge'], ['--max-host-rate', '1'],
+                                      ['--key-cache-ttl', '60']])
+    def test_canary_download_options(self, server, socket_path, args):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', os.path.join(TEST_DIR, 'canary_input', 'checksum.json')] + args,
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 2
+        assert result.output == "ERROR: '" + args[0] + "' can't be used with the verification server!\n"
+
+    def test_server_not_running(self, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH],
+                               env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 2
+        assert result.output.startswith('ERROR: Cannot connect to the verification server: ')
+
+    def test_serve_already_running(self, server, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['serve', '--socket', socket_path])
+        assert result.exit_code == 2
+        assert result.output.startswith('ERROR: ')
+
+    def test_serve_missing_socket(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['serve'], env={'ICETRUST_SOCKET': None})
+        assert result.exit_code == 2
+        assert "Missing option '--socket'" in result.output
+
+
+# Tests for reading FILENAME from stdin
+class TestCliStdin(object):
+    @staticmethod
+    def run_tee(args, input_file):
+        with open(input_file, 'rb') as stdin:
+            return subprocess.run([sys.executable, '-m', 'icetrust.cli'] + args + ['--tee'], stdin=stdin,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def test_checksum(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '--verbose', '-', FILE1_HASH],
+                               input=Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes())
+        assert result.exit_code == 0
+        assert result.output == 'Algorithm: sha256\n' + \
+               'File hash: ' + FILE1_HASH + '\n' + \
+               'File verified\n'
+
+    def test_checksum_invalid(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '-', FILE1_HASH],
+                               input=Path(os.path.join(TEST_DIR, 'file2.txt')).read_bytes())
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: File cannot be verified!\n'
+
+    def test_checksumfile(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksumfile', '-', os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS')],
+                               input=Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes())
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_pgp(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', '-', os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')],
+                               input=Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes())
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_pgp_invalid(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['pgp', '-', os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                     '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt')],
+                               input=Path(os.path.join(TEST_DIR, 'file2.txt')).read_bytes())
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: File cannot be verified!\n'
+
+    def test_server_not_used(self, socket_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '-', FILE1_HASH], env={'ICETRUST_SOCKET': socket_path},
+                               input=Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes())
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_tee_without_stdin(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '--tee', os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH])
+        assert result.exit_code == 2
+        assert result.output == "ERROR: '--tee' can only be used when FILENAME is '-'!\n"
+
+    def test_tee_checksum(self):
+        result = self.run_tee(['checksum', '--verbose', '-', FILE1_HASH], os.path.join(TEST_DIR, 'file1.txt'))
+        assert result.returncode == 0
+        assert result.stdout == Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes()
+        assert result.stderr.decode('utf-8').splitlines() == ['Algorithm: sha256', 'File hash: ' + FILE1_HASH,
+                                                             'File verified']
+
+    def test_tee_checksum_invalid(self):
+        result = self.run_tee(['checksum', '-', FILE2_HASH], os.path.join(TEST_DIR, 'file1.txt'))
+        assert result.returncode == 255
+        assert result.stdout == Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes()
+        assert result.stderr == b'ERROR: File cannot be verified!\n'
+
+    def test_tee_pgp(self):
+        result = self.run_tee(['pgp', '-', os.path.join(TEST_DIR, 'file1.txt.sig'),
+                               '--keyfile', os.path.join(TEST_DIR, 'pgp_keys.txt'), '--verbose'],
+                              os.path.join(TEST_DIR, 'file1.txt'))
+        assert result.returncode == 0
+        assert result.stdout == Path(os.path.join(TEST_DIR, 'file1.txt')).read_bytes()
+        assert result.stderr.decode('utf-8').endswith('File verified\n')
+
+
+# Tests for "--decompress" option of "checksum" and "checksumfile" commands
+class TestCliDecompress(object):
+    @pytest.mark.parametrize('decompress', ['gz', 'bz2', 'xz'])
+    def test_checksum(self, tmp_path, decompress):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '--verbose', write_compressed(tmp_path, 'file1.txt', decompress),
+                                     FILE1_HASH, '--decompress', decompress])
+        assert result.exit_code == 0
+        assert result.output == 'Algorithm: sha256\n' + \
+               'File hash: ' + FILE1_HASH + '\n' + \
+               'File verified\n'
+
+    def test_checksumfile(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksumfile', write_compressed(tmp_path, 'file1.txt', 'xz'),
+                                     os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'), '--decompress', 'xz'])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_checksum_invalid_data(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', '--verbose', os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH,
+                                     '--decompress', 'gz'])
+        assert result.exit_code == -1
+        assert result.output.startswith('File cannot be decompressed: ')
+        assert result.output.endswith('ERROR: File cannot be verified!\n')
+
+    def test_checksum_stdin_tee(self, tmp_path):
+        path = write_compressed(tmp_path, 'file1.txt', 'bz2')
+        result = TestCliStdin.run_tee(['checksum', '-', FILE1_HASH, '--decompress', 'bz2'], path)
+        assert result.returncode == 0
+        assert result.stdout == Path(path).read_bytes()
+        assert result.stderr == b'File verified\n'
+
+    def test_checksum_server(self, server, socket_path, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['checksum', write_compressed(tmp_path, 'file1.txt', 'gz'), FILE1_HASH,
+                                     '--decompress', 'gz'], env={'ICETRUST_SOCKET': socket_path})
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+
+# Tests for "manifest" command
+class TestCliManifest(object):
+    def test_manifest(self, manifest_dir):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir)])
+        assert result.exit_code == 0
+        assert result.output == 'Manifest written: ' + str(manifest_dir / 'SHA256SUMS') + '\n'
+        assert (manifest_dir / 'SHA256SUMS').read_text() == \
+            FILE1_HASH + '  file1.txt\n' + FILE2_HASH + '  sub/file2.txt\n'
+
+        # Manifests are usable by the verification commands and aren't included in the next manifest
+        result = runner.invoke(cli, ['checksumfile', str(manifest_dir / 'sub' / 'file2.txt'),
+                                     str(manifest_dir / 'SHA256SUMS')])
+        assert result.exit_code == 0
+        result = runner.invoke(cli, ['manifest', str(manifest_dir)])
+        assert result.exit_code == 0
+        assert 'SHA256SUMS' not in (manifest_dir / 'SHA256SUMS').read_text()
+
+    def test_manifest_bsd_algorithms(self, manifest_dir, tmp_path_factory):
+        output_dir = tmp_path_factory.mktemp('output')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--format', 'bsd', '--algorithm', 'sha1',
+                                     '--algorithm', 'sha256', '--output-dir', str(output_dir), '--jobs', '2'])
+        assert result.exit_code == 0
+        assert result.output == 'Manifest written: ' + str(output_dir / 'SHA1SUMS') + '\n' + \
+            'Manifest written: ' + str(output_dir / 'SHA256SUMS') + '\n'
+        assert (output_dir / 'SHA256SUMS').read_text().splitlines()[0] == \
+            'SHA256 (../' + manifest_dir.name + '/file1.txt) = ' + FILE1_HASH
+
+    @pytest.mark.skipif(shutil.which('sha256sum') is None, reason='sha256sum is not available')
+    def test_manifest_output_dir(self, manifest_dir, tmp_path_factory):
+        # Paths are relative to the output directory, so the manifests can be checked from there
+        output_dir = tmp_path_factory.mktemp('output')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--output-dir', str(output_dir)])
+        assert result.exit_code == 0
+        assert subprocess.run(['sha256sum', '-c', 'SHA256SUMS'], cwd=str(output_dir),
+                              stdout=subprocess.DEVNULL).returncode == 0
+
+    def test_manifest_state_file(self, manifest_dir, tmp_path_factory):
+        state_file = str(tmp_path_factory.mktemp('state') / 'state.json')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--state-file', state_file, '--verbose'])
+        assert result.exit_code == 0
+        assert result.output.startswith('Files: 2, hashed: 2, unchanged: 0\n')
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--state-file', state_file, '--verbose'])
+        assert result.exit_code == 0
+        assert result.output.startswith('Files: 2, hashed: 0, unchanged: 2\n')
+
+    def test_manifest_sign(self, manifest_dir, signing_home):
+        gpg_home_dir, fingerprint = signing_home
+        keyfile = str(manifest_dir.parent / 'manifest_keys.txt')
+        with open(keyfile, 'w') as file:
+            file.write(IcetrustUtils.pgp_init(gpg_home_dir=gpg_home_dir).export_keys(fingerprint))
+
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--sign', '--gpg-home', gpg_home_dir,
+                                     '--local-user', fingerprint])
+        assert result.exit_code == 0
+        assert result.output == 'Manifest written: ' + str(manifest_dir / 'SHA256SUMS') + '\n' + \
+            'Signature written: ' + str(manifest_dir / 'SHA256SUMS.asc') + '\n'
+        result = runner.invoke(cli, ['pgpchecksumfile', str(manifest_dir / 'file1.txt'),
+                                     str(manifest_dir / 'SHA256SUMS'), str(manifest_dir / 'SHA256SUMS.asc'),
+                                     '--keyfile', keyfile])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_manifest_sign_unknown_key(self, manifest_dir, signing_home):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--sign', '--gpg-home', signing_home[0],
+                                     '--local-user', 'DEADBEEF'])
+        assert result.exit_code == -1
+        assert result.output.endswith('ERROR: Manifest cannot be signed: ' + str(manifest_dir / 'SHA256SUMS') + '\n')
+
+    def test_manifest_sign_no_gpg_home(self, manifest_dir):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--sign'])
+        assert result.exit_code == 2
+        assert result.output == "ERROR: '--sign' requires '--gpg-home'!\n"
+
+
+# Tests for "archive" command
+class TestCliArchive(object):
+    def test_wheel(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['archive', make_wheel(tmp_path / 'test.whl')])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_wheel_tampered(self, tmp_path):
+        wheel = make_wheel(tmp_path / 'test.whl', extra_members={'icetrust_test/evil.py': b'import os\n'})
+        runner = CliRunner()
+        result = runner.invoke(cli, ['archive', '--verbose', wheel])
+        assert result.exit_code == -1
+        assert 'Member failed: icetrust_test/evil.py (not listed in manifest)\n' in result.output
+        assert result.output.endswith('ERROR: File cannot be verified!\n')
+
+    def test_tar_manifest(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['archive', make_tar(tmp_path / 'test.tar.gz', MEMBERS), '--manifest',
+                                     make_manifest(tmp_path / 'SHA256SUMS', MEMBERS)])
+        assert result.exit_code == 0
+        assert result.output == 'File verified\n'
+
+    def test_tar_without_manifest(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['archive', make_tar(tmp_path / 'test.tar.gz', MEMBERS)])
+        assert result.exit_code == 2
+        assert result.output == 'ERROR: A member manifest is required for tar archives\n'
+
+    def test_manifest_command_output(self, manifest_dir, tmp_path_factory):
+        # Manifests written by the "manifest" command can be used to verify a tar of the same directory
+        output_dir = tmp_path_factory.mktemp('output')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['manifest', str(manifest_dir), '--format', 'bsd'])
+        assert result.exit_code == 0
+        shutil.move(str(manifest_dir / 'SHA256SUMS'), str(output_dir / 'SHA256SUMS'))
+        archive = str(output_dir / 'test.tar')
+        with tarfile.open(archive, 'w') as tar:
+            tar.add(str(manifest_dir), arcname='.')
+        result = runner.invoke(cli, ['archive', archive, '--manifest', str(output_dir / 'SHA256SUMS')])
+        assert result.exit_code == 0
@@ -21,7 +21,7 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import os
+import json, os
 
 from click.testing import CliRunner
 import pytest
@@ -77,3 +77,119 @@ class TestCanary(object):
                'Downloading file: https://github.com/nightwatchcybersecurity/truegaze/releases/download/0.1.7/truegaze-0.1.7-py3-none-any.whl\n' + \
                'File verified\n'
 
+
+    @pytest.mark.network
+    def test_checksumfile_multiple_valid(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', os.path.join(TEST_DIR, 'canary_input', 'checksumfile_multiple.json')])
+        assert result.exit_code == 0
+        assert result.output.count('File verified\n') == 2
+
+    @pytest.mark.network
+    def test_checksum_valid_ndjson(self, tmp_path):
+        output_file = os.path.join(tmp_path, 'output.ndjson')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--output-ndjson', output_file,
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksum.json'),
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksumfile.json')])
+        assert result.exit_code == 0
+        lines = open(output_file, 'r').read().splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])['verification_mode'] == 'checksum'
+        assert json.loads(lines[1])['verification_mode'] == 'checksumfile'
+
+    @pytest.mark.network
+    def test_checksum_valid_ndjson_stdout(self, tmp_path):
+        # Only NDJSON records are written to stdout, everything else goes to stderr
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--verbose', '--output-ndjson', '-',
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksum.json')])
+        assert result.exit_code == 0
+        lines = result.stdout.splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['verification_mode'] == 'checksum'
+        assert 'Using verification mode: CHECKSUM\n' in result.stderr
+        assert result.stderr.endswith('File verified\n')
+
+    def test_invalid_config(self, tmp_path):
+        output_file = os.path.join(tmp_path, 'output.ndjson')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--output-ndjson', output_file,
+                                     os.path.join(TEST_DIR, 'canary_output', 'compare.json')])
+        assert result.exit_code == -1
+        assert result.output == 'ERROR: File cannot be verified!\n'
+        assert open(output_file, 'r').read() == ''
+
+    def test_invalid_config_ndjson_stdout(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--verbose', '--output-ndjson', '-',
+                                     os.path.join(TEST_DIR, 'canary_output', 'compare.json')])
+        assert result.exit_code == -1
+        assert result.stdout == ''
+        assert result.stderr.endswith('ERROR: File cannot be verified!\n')
+
+    def test_download_error(self, tmp_path):
+        # Each config that fails is reported with an error record, the other configs are still checked
+        config_files = []
+        for name in ['foobar1', 'foobar2']:
+            config_files.append(os.path.join(tmp_path, name + '.json'))
+            with open(config_files[-1], 'w') as config_file:
+                json.dump({'name': name, 'url': 'https://www.example.com',
+                           'filename_url': 'https://127.0.0.1:1/' + name + '.txt',
+                           'checksum': {'checksum_value': 'foobar'}}, config_file)
+        output_file = os.path.join(tmp_path, 'output.ndjson')
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--retries', '0', '--output-ndjson', output_file] + config_files)
+        assert result.exit_code == -1
+        assert result.output.count('ERROR: File cannot be verified!\n') == 2
+        records = sorted((json.loads(line) for line in open(output_file, 'r')), key=lambda record: record['name'])
+        assert [record['name'] for record in records] == ['foobar1', 'foobar2']
+        assert all(record['verified'] is False for record in records)
+        assert records[0]['filename_url'] == 'https://127.0.0.1:1/foobar1.txt'
+        assert records[0]['output'].startswith('ERROR: ')
+
+    def test_validate_only(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--validate-only',
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksum.json'),
+                                     os.path.join(TEST_DIR, 'canary_input', 'pgp_keyid_multiple.json')])
+        assert result.exit_code == 0
+        assert result.output == os.path.join(TEST_DIR, 'canary_input', 'checksum.json') + \
+            ': Config file is valid\n' + \
+            os.path.join(TEST_DIR, 'canary_input', 'pgp_keyid_multiple.json') + ': Config file is valid\n'
+
+    def test_validate_only_invalid(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--validate-only', '--verbose',
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksum.json'),
+                                     os.path.join(TEST_DIR, 'canary_output', 'compare.json')])
+        assert result.exit_code == -1
+        assert result.output == 'Config file is not properly formatted!\n' + \
+            "'compare_files' is a required property\n" + \
+            os.path.join(TEST_DIR, 'canary_input', 'checksum.json') + ': Config file is valid\n' + \
+            os.path.join(TEST_DIR, 'canary_output', 'compare.json') + ': ERROR: Config file is not valid!\n'
+
+    def test_invalid_multiple_configs_output_json(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--output-json', os.path.join(tmp_path, 'output.json'),
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksum.json'),
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksumfile.json')])
+        assert result.exit_code == 2
+        assert "ERROR: '--output-json' and '--save-file' can only be used with a single config file!" \
+               in result.output
+
+    def test_invalid_multiple_files_output_json(self, tmp_path):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--output-json', os.path.join(tmp_path, 'output.json'),
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksumfile_multiple.json')])
+        assert result.exit_code == 2
+        assert result.output == "ERROR: '--output-json' can only be used with a single file, use '--output-ndjson' " \
+                                "for configs with 'filename_urls'!\n"
+        assert not os.path.exists(os.path.join(tmp_path, 'output.json'))
+
+    def test_invalid_jobs(self):
+        runner = CliRunner()
+        result = runner.invoke(cli, ['canary', '--jobs', '0',
+                                     os.path.join(TEST_DIR, 'canary_input', 'checksum.json')])
+        assert result.exit_code == 2
+        assert "Error: Invalid value for '--jobs'" in result.output
@@ -21,29 +21,48 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import os, re, shutil
-import tempfile
+from io import BytesIO
+from pathlib import Path
+import bz2, gzip, hashlib, lzma, os, re, shutil
+import tempfile, threading, time
 
-import gnupg, pytest
+import filehash, gnupg, pytest
 
-from icetrust.utils import DEFAULT_HASH_ALGORITHM, IcetrustUtils, MsgCallback
+from icetrust.utils import DECOMPRESS_FORMATS, DEFAULT_HASH_ALGORITHM, GpgContext, HashCache, IcetrustUtils, KeyCache, MsgCallback,\
+    TeeStream, VerificationCache
+from icetrust.utils_server import IcetrustServer
 
 # Directory with test data
 TEST_DIR = 'test_data'
 FILE1_HASH = '07fe4d4a25718241af145a93f890eb5469052e251d199d173bd3bd50c3bb4da2'
 FILE2_HASH = 'c6de01eef7b93f5112af99a8754c50fdade4aaa6c85d4ab3fbf9b24d41e0d875'
 
+# Compression functions for each decompress value
+COMPRESSORS = {'gz': gzip.compress, 'bz2': bz2.compress, 'xz': lzma.compress}
 
-@pytest.fixture
-def copy_keyring(tmp_path):
-    # Copying keyring to speed things up
-    shutil.copy(os.path.join(TEST_DIR, 'pubring.kbx'), tmp_path)
 
+def write_compressed(directory, filename, decompress):
+    """Writes a compressed copy of a test file and returns its path"""
+    path = os.path.join(str(directory), filename + '.' + decompress)
+    Path(path).write_bytes(COMPRESSORS[decompress](Path(TEST_DIR, filename).read_bytes()))
+    return path
 
-@pytest.fixture
-def mock_msg_callback():
-    # Return mock message callback object
-    return MsgCallback()
+
+def start_server(socket_path):
+    """Starts a verification server on the socket in a background thread, returns the server and the thread"""
+    server = IcetrustServer(socket_path)
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    return server, thread
+
+
+def export_test_keys(*filenames):
+    """Exports the keys of several test key files as one armored block, like a key server response"""
+    gpg = IcetrustUtils.pgp_init()
+    for filename in filenames:
+        gpg.import_keys(Path(TEST_DIR, filename).read_bytes())
+    return gpg.export_keys(list(IcetrustUtils.pgp_get_fingerprints(gpg))).encode('ascii')
 
 
 # Tests for misc utils methods
@@ -129,6 +148,244 @@ class TestUtilsCompareFiles(object):
         assert cmd_output[1] == 'File2 checksum: ' + FILE1_HASH
 
 
+# Tests for utils.KeyCache
+class TestKeyCache(object):
+    def test_missing(self, tmp_path):
+        assert KeyCache(tmp_path).get('FBFCC82A015E7330') is None
+
+    def test_put_get(self, tmp_path):
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        key_cache.put('FBFCC82A015E7330', 'keydata', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert key_cache.get('FBFCC82A015E7330') == 'keydata'
+        assert KeyCache(os.path.join(tmp_path, 'cache')).get('fbfcc82a015e7330') == 'keydata'
+        assert KeyCache(os.path.join(tmp_path, 'cache')).get('0xFBFCC82A015E7330') == 'keydata'
+
+    def test_put_replaces(self, tmp_path):
+        key_cache = KeyCache(tmp_path)
+        key_cache.put('FBFCC82A015E7330', 'keydata1', [])
+        key_cache.put('FBFCC82A015E7330', 'keydata2', [])
+        assert key_cache.get('FBFCC82A015E7330') == 'keydata2'
+        assert len(os.listdir(tmp_path)) == 1
+
+    def test_ttl_expired(self, tmp_path):
+        KeyCache(tmp_path).put('FBFCC82A015E7330', 'keydata', [])
+        assert KeyCache(tmp_path, ttl=0).get('FBFCC82A015E7330') is None
+
+    def test_key_expired(self, tmp_path):
+        key_cache = KeyCache(tmp_path)
+        key_cache.put('FBFCC82A015E7330', 'keydata', [], expires=time.time() - 1)
+        assert key_cache.get('FBFCC82A015E7330') is None
+
+    def test_key_not_expired(self, tmp_path):
+        key_cache = KeyCache(tmp_path)
+        key_cache.put('FBFCC82A015E7330', 'keydata', [], expires=time.time() + 3600)
+        assert key_cache.get('FBFCC82A015E7330') == 'keydata'
+
+    def test_corrupted(self, tmp_path):
+        key_cache = KeyCache(tmp_path)
+        key_cache.put('FBFCC82A015E7330', 'keydata', [])
+        Path(os.path.join(tmp_path, os.listdir(tmp_path)[0])).write_text('foobar')
+        assert key_cache.get('FBFCC82A015E7330') is None
+
+
+# Tests for utils.VerificationCache
+class TestVerificationCache(object):
+    KEYRING_STATE = ('keyring1', {'D1A66E1A23B182C9980F788CFBFCC82A015E7330': None})
+
+    def test_missing(self, tmp_path):
+        assert VerificationCache(tmp_path).get('foobar', self.KEYRING_STATE) is None
+
+    def test_get_key(self):
+        cache_key = VerificationCache.get_key(os.path.join(TEST_DIR, 'file1.txt'),
+                                              os.path.join(TEST_DIR, 'file1.txt.sig'), self.KEYRING_STATE)
+        assert cache_key == VerificationCache.get_key(os.path.join(TEST_DIR, 'file1.txt'),
+                                                      os.path.join(TEST_DIR, 'file1.txt.sig'), self.KEYRING_STATE)
+        assert cache_key != VerificationCache.get_key(os.path.join(TEST_DIR, 'file2.txt'),
+                                                      os.path.join(TEST_DIR, 'file1.txt.sig'), self.KEYRING_STATE)
+        assert cache_key != VerificationCache.get_key(os.path.join(TEST_DIR, 'file1.txt'),
+                                                      os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                                      ('keyring2', self.KEYRING_STATE[1]))
+
+    def test_get_key_missing_file(self):
+        assert VerificationCache.get_key(os.path.join(TEST_DIR, 'foobar'), os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                         self.KEYRING_STATE) is None
+
+    def test_put_get(self, tmp_path):
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert verification_cache.get('key1', self.KEYRING_STATE) == 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+        assert VerificationCache(os.path.join(tmp_path, 'cache')).get('key1', self.KEYRING_STATE) == \
+            'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+
+    def test_key_not_in_keyring(self, tmp_path):
+        verification_cache = VerificationCache(tmp_path)
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330',
+                                        '1DDCE15F09217CEE2F3B37607C2FAA4DF93C37B2'])
+        assert verification_cache.get('key1', self.KEYRING_STATE) is None
+
+    def test_key_expired(self, tmp_path):
+        verification_cache = VerificationCache(tmp_path)
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        keyring_state = ('keyring1', {'D1A66E1A23B182C9980F788CFBFCC82A015E7330': int(time.time()) - 1})
+        assert verification_cache.get('key1', keyring_state) is None
+        assert os.listdir(tmp_path) == []
+
+    def test_key_not_expired(self, tmp_path):
+        verification_cache = VerificationCache(tmp_path)
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        keyring_state = ('keyring1', {'D1A66E1A23B182C9980F788CFBFCC82A015E7330': int(time.time()) + 3600})
+        assert verification_cache.get('key1', keyring_state) == 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+
+    def test_corrupted(self, tmp_path):
+        verification_cache = VerificationCache(tmp_path)
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        Path(os.path.join(tmp_path, 'key1.json')).write_text('foobar')
+        assert verification_cache.get('key1', self.KEYRING_STATE) is None
+
+    def test_evict_least_recently_used(self, tmp_path):
+        verification_cache = VerificationCache(tmp_path, max_entries=2)
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        verification_cache.put('key2', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        os.utime(os.path.join(tmp_path, 'key1.json'), (time.time() - 20, time.time() - 20))
+        os.utime(os.path.join(tmp_path, 'key2.json'), (time.time() - 10, time.time() - 10))
+        assert verification_cache.get('key1', self.KEYRING_STATE) is not None
+        verification_cache.put('key3', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert sorted(os.listdir(tmp_path)) == ['key1.json', 'key3.json']
+
+    def test_evict_batch(self, tmp_path, monkeypatch):
+        verification_cache = VerificationCache(tmp_path, max_entries=20)
+        listdir_calls = []
+        listdir = os.listdir
+        monkeypatch.setattr(os, 'listdir', lambda path: listdir_calls.append(path) or listdir(path))
+        for index in range(20):
+            verification_cache.put('key' + str(index), ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+            os.utime(os.path.join(tmp_path, 'key' + str(index) + '.json'), (time.time() - 100 + index,) * 2)
+        assert len(listdir_calls) == 1
+
+        # Going over the limit evicts the three least recently used entries, the next puts don't evict again
+        verification_cache.put('key20', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert sorted(listdir(tmp_path)) == sorted('key' + str(index) + '.json' for index in range(3, 21))
+        verification_cache.put('key0', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        verification_cache.put('key1', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert len(listdir(tmp_path)) == 20
+        assert len(listdir_calls) == 2
+
+    def test_evict_existing_entries(self, tmp_path):
+        verification_cache = VerificationCache(tmp_path, max_entries=3)
+        for index in range(3):
+            verification_cache.put('key' + str(index), ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+
+        # Entries written by another instance are counted
+        VerificationCache(tmp_path, max_entries=3).put('key3', ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert len(os.listdir(tmp_path)) == 3
+
+
+# Tests for HashCache class
+class TestHashCache(object):
+    def test_get_hash(self):
+        hash_cache = HashCache()
+        assert hash_cache.get_hash(os.path.join(TEST_DIR, 'file1.txt'), 'sha256') == FILE1_HASH
+        assert hash_cache.get_hash(os.path.join(TEST_DIR, 'file1.txt'), 'sha256') == FILE1_HASH
+        assert len(hash_cache.entries) == 1
+
+    def test_get_hash_changed_file(self, tmp_path):
+        filename = os.path.join(tmp_path, 'file.txt')
+        shutil.copy(os.path.join(TEST_DIR, 'file1.txt'), filename)
+        hash_cache = HashCache()
+        assert hash_cache.get_hash(filename, 'sha256') == FILE1_HASH
+
+        # Same name, different contents and modification time
+        shutil.copy(os.path.join(TEST_DIR, 'file2.txt'), filename)
+        os.utime(filename, ns=(0, 0))
+        assert hash_cache.get_hash(filename, 'sha256') == FILE2_HASH
+
+    def test_get_hash_rewritten_file(self, tmp_path):
+        filename = os.path.join(tmp_path, 'file.txt')
+        Path(filename).write_bytes(b'foobar')
+        hash_cache = HashCache()
+        assert hash_cache.get_hash(filename, 'sha256') == hashlib.sha256(b'foobar').hexdigest()
+
+        # Same size and modification time, only the change time shows that the file was rewritten
+        file_stat = os.stat(filename)
+        time.sleep(0.01)
+        Path(filename).write_bytes(b'barfoo')
+        os.utime(filename, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+        assert hash_cache.get_hash(filename, 'sha256') == hashlib.sha256(b'barfoo').hexdigest()
+
+    def test_get_hash_evicted(self):
+        hash_cache = HashCache(max_entries=1)
+        hash_cache.get_hash(os.path.join(TEST_DIR, 'file1.txt'), 'sha256')
+        hash_cache.get_hash(os.path.join(TEST_DIR, 'file2.txt'), 'sha256')
+        assert list(key[0] for key in hash_cache.entries) == [os.path.realpath(os.path.join(TEST_DIR, 'file2.txt'))]
+
+    def test_get_hash_function(self):
+        hash_cache = HashCache()
+        calls = []
+
+        def hash_file(path, algorithm):
+            calls.append((path, algorithm))
+            return 'foobar'
+
+        assert hash_cache.get_hash(os.path.join(TEST_DIR, 'file1.txt'), 'sha256', hash_file=hash_file) == 'foobar'
+        assert hash_cache.get_hash(os.path.join(TEST_DIR, 'file1.txt'), 'sha256', hash_file=hash_file) == 'foobar'
+        assert calls == [(os.path.realpath(os.path.join(TEST_DIR, 'file1.txt')), 'sha256')]
+
+    def test_get_hash_missing_file(self):
+        with pytest.raises(OSError):
+            HashCache().get_hash(os.path.join(TEST_DIR, 'foobar'), 'sha256')
+
+
+# Tests for utils.pgp_get_fingerprints() and utils.pgp_has_key()
+class TestUtilsPgpKeyIndex(object):
+    def test_get_fingerprints(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+
+    def test_get_fingerprints_empty(self, tmp_path):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == set()
+
+    def test_has_key(self):
+        key_index = {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+        assert IcetrustUtils.pgp_has_key(key_index, 'D1A66E1A23B182C9980F788CFBFCC82A015E7330') is True
+        assert IcetrustUtils.pgp_has_key(key_index, 'FBFCC82A015E7330') is True
+        assert IcetrustUtils.pgp_has_key(key_index, '0xfbfcc82a015e7330') is True
+        assert IcetrustUtils.pgp_has_key(key_index, '015E7330') is True
+        assert IcetrustUtils.pgp_has_key(key_index, '7330') is False
+        assert IcetrustUtils.pgp_has_key(key_index, 'C8EF5FF3BF864E50') is False
+        assert IcetrustUtils.pgp_has_key(key_index, 'bob@openpgp.example') is False
+
+
+# Tests for utils.pgp_get_keyring_state()
+class TestUtilsPgpKeyringState(object):
+    def test_keyring_state(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        keyring_digest, expiry_times = IcetrustUtils.pgp_get_keyring_state(gpg)
+        assert expiry_times == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330': None,
+                                '1DDCE15F09217CEE2F3B37607C2FAA4DF93C37B2': None}
+        assert IcetrustUtils.pgp_get_keyring_state(gpg)[0] == keyring_digest
+
+    def test_keyring_state_changes_on_import(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        keyring_digest = IcetrustUtils.pgp_get_keyring_state(gpg)[0]
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt')) is True
+        assert IcetrustUtils.pgp_get_keyring_state(gpg)[0] != keyring_digest
+
+    def test_keyring_state_revoked(self, tmp_path):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys_revoked.txt')) is True
+        assert 'AE69AEDA312688CB0138552EFBC602A24E7CEC41' not in IcetrustUtils.pgp_get_keyring_state(gpg)[1]
+
+
+# Tests for utils.pgp_check_keys()
+class TestUtilsPgpCheckKeys(object):
+    def test_valid(self, tmp_path, copy_keyring, mock_msg_callback):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_check_keys(gpg, ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'],
+                                            msg_callback=mock_msg_callback) == (True, None)
+        assert len(mock_msg_callback.messages) == 0
+
+
 # Tests for utils.pgp_import_keys()
 class TestUtilsPgpImportKeys(object):
     @pytest.mark.slow
@@ -192,8 +449,229 @@ class TestUtilsPgpImportKeys(object):
         with pytest.raises(ValueError):
             IcetrustUtils.pgp_import_keys(gpg, keyserver='foobar')
 
+    def test_valid_fromfile_already_present(self, tmp_path, copy_keyring, mock_msg_callback):
+        # Key files are always passed to gpg, keys already present are reported as unchanged
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'),
+                                             msg_callback=mock_msg_callback) is True
+        assert mock_msg_callback.messages[0] == '--- Results of key import ---\n'
+        assert '[GNUPG:] IMPORT_OK 0 D1A66E1A23B182C9980F788CFBFCC82A015E7330' in mock_msg_callback.messages[1]
+
+    def test_valid_fromfile_revoked_merged(self, tmp_path, signing_home):
+        # A revocation added to a key file is merged into a keyring that already has the key
+        gpg_home_dir, fingerprint = signing_home
+        signing_gpg = IcetrustUtils.pgp_init(gpg_home_dir=gpg_home_dir)
+        keyfile = os.path.join(tmp_path, 'keys.txt')
+        Path(keyfile).write_text(signing_gpg.export_keys(fingerprint))
+        gpg = IcetrustUtils.pgp_init(os.path.join(tmp_path))
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=keyfile) is True
+        assert gpg.list_keys()[0]['trust'] != 'r'
+
+        revocation = Path(gpg_home_dir, 'openpgp-revocs.d', fingerprint + '.rev').read_text()
+        signing_gpg.import_keys(revocation.replace(':-----BEGIN', '-----BEGIN'))
+        Path(keyfile).write_text(signing_gpg.export_keys(fingerprint))
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=keyfile) is True
+        assert gpg.list_keys()[0]['trust'] == 'r'
+
+    def test_valid_fromfile_some_missing(self, tmp_path, copy_keyring):
+        keyfile = os.path.join(tmp_path, 'keys.txt')
+        Path(keyfile).write_text(Path(os.path.join(TEST_DIR, 'pgp_keys.txt')).read_text() + '\n' +
+                                 Path(os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt')).read_text())
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        key_index = IcetrustUtils.pgp_get_fingerprints(gpg, subkeys=True)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=keyfile, key_index=key_index) is True
+        assert key_index == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330', '1DDCE15F09217CEE2F3B37607C2FAA4DF93C37B2',
+                             '1E1943F158798768C6D36007B73EC04F30C74795'}
+        assert IcetrustUtils.pgp_get_fingerprints(gpg, subkeys=True) == key_index
+
+    def test_valid_fromfile_multiple_keys(self, tmp_path):
+        keyfile = os.path.join(tmp_path, 'keys.txt')
+        Path(keyfile).write_text('\n'.join(Path(os.path.join(TEST_DIR, filename)).read_text() for filename in
+                                         ['pgp_keys.txt', 'pgp_keys_ed25519.txt', 'pgp_keys_revoked.txt']))
+        gpg_home = os.path.join(tmp_path, 'gpg')
+        os.mkdir(gpg_home)
+        gpg = IcetrustUtils.pgp_init(gpg_home)
+        import_result = IcetrustUtils.pgp_import_keys_file(gpg, keyfile)
+        assert import_result.imported == 3
+        assert len(IcetrustUtils.pgp_get_fingerprints(gpg)) == 3
+
+    @pytest.mark.parametrize('keyid', ['FBFCC82A015E7330', '7C2FAA4DF93C37B2'])
+    def test_valid_fromkeyid_already_present_cached(self, tmp_path, copy_keyring, mock_msg_callback, keyid):
+        # The key server is unreachable, so the keys can only come from the keyring, subkey IDs are found too
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        key_cache.put(keyid, Path(os.path.join(TEST_DIR, 'pgp_keys.txt')).read_text(),
+                      ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid=keyid, keyserver='127.0.0.1:1', key_cache=key_cache,
+                                             msg_callback=mock_msg_callback) is True
+        assert mock_msg_callback.messages == ['Keys already in keyring: ' + keyid]
+
+    def test_invalid_fromkeyid_already_present_not_cached(self, tmp_path, copy_keyring):
+        # Keys in the keyring are refreshed from the key server when there is no key cache
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', keyserver='127.0.0.1:1') is False
 
-# Tests for utils.pgp_import_keys()
+    def test_invalid_fromkeyid_already_present_cache_expired(self, tmp_path, copy_keyring):
+        # Keys in the keyring are refreshed if the key cache needs to be refreshed
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'), ttl=0)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', keyserver='127.0.0.1:1',
+                                             key_cache=key_cache) is False
+
+    def test_valid_fromkeyid_cached(self, tmp_path, mock_msg_callback):
+        # The key server is unreachable, so the keys can only come from the cache
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        key_cache.put('FBFCC82A015E7330', Path(os.path.join(TEST_DIR, 'pgp_keys.txt')).read_text(),
+                      ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        gpg_home = os.path.join(tmp_path, 'gpg')
+        os.mkdir(gpg_home)
+        gpg = IcetrustUtils.pgp_init(gpg_home)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', keyserver='127.0.0.1:1',
+                                             msg_callback=mock_msg_callback, key_cache=key_cache) is True
+        assert mock_msg_callback.messages[0] == 'Using cached keys: FBFCC82A015E7330'
+        assert '[GNUPG:] IMPORTED FBFCC82A015E7330' in mock_msg_callback.messages[2]
+
+    def test_invalid_fromkeyid_not_cached(self, tmp_path):
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        gpg_home = os.path.join(tmp_path, 'gpg')
+        os.mkdir(gpg_home)
+        gpg = IcetrustUtils.pgp_init(gpg_home)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', keyserver='127.0.0.1:1',
+                                             key_cache=key_cache) is False
+        assert key_cache.get('FBFCC82A015E7330') is None
+
+    @pytest.mark.network
+    def test_valid_fromkeyid_cache_refresh(self, tmp_path):
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        for index in range(2):
+            gpg_home = os.path.join(tmp_path, 'gpg' + str(index))
+            os.mkdir(gpg_home)
+            gpg = IcetrustUtils.pgp_init(gpg_home)
+            assert IcetrustUtils.pgp_import_keys(gpg, keyid='C8EF5FF3BF864E50', keyserver='keyserver.ubuntu.com',
+                                                 key_cache=key_cache) is True
+        assert key_cache.get('C8EF5FF3BF864E50') is not None
+
+
+# Tests for utils.pgp_get_keyserver_url(), utils.pgp_fetch_keys() and utils.pgp_race_keyservers()
+class TestUtilsPgpKeyservers(object):
+    LOOKUP_PATH = '/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'
+
+    def test_get_keyserver_url(self):
+        assert IcetrustUtils.pgp_get_keyserver_url('keyserver.ubuntu.com') == \
+            'https://keyserver.ubuntu.com/pks/lookup'
+        assert IcetrustUtils.pgp_get_keyserver_url('hkps://keys.example.com') == 'https://keys.example.com/pks/lookup'
+        assert IcetrustUtils.pgp_get_keyserver_url('hkp://keys.example.com') == \
+            'http://keys.example.com:11371/pks/lookup'
+        assert IcetrustUtils.pgp_get_keyserver_url('hkp://keys.example.com:80') == \
+            'http://keys.example.com:80/pks/lookup'
+        with pytest.raises(ValueError):
+            IcetrustUtils.pgp_get_keyserver_url('ftp://keys.example.com')
+
+    def test_fetch_keys(self, http_server):
+        http_server.responses[self.LOOKUP_PATH] = [(200, b'keydata', 0)]
+        assert IcetrustUtils.pgp_fetch_keys(http_server.url(''), 'FBFCC82A015E7330') == b'keydata'
+
+    def test_fetch_keys_cancelled(self, http_server):
+        http_server.responses[self.LOOKUP_PATH] = [(200, b'keydata', 0)]
+        cancel_event = threading.Event()
+        cancel_event.set()
+        assert IcetrustUtils.pgp_fetch_keys(http_server.url(''), 'FBFCC82A015E7330',
+                                            cancel_event=cancel_event) is None
+
+    def test_race_keyservers_fastest_wins(self, tmp_path, http_server, http_server2):
+        keydata = Path(os.path.join(TEST_DIR, 'pgp_keys.txt')).read_bytes()
+        http_server.responses[self.LOOKUP_PATH] = [(200, keydata, 3)]
+        http_server2.responses[self.LOOKUP_PATH] = [(200, keydata, 0)]
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        start_time = time.monotonic()
+        winner_keydata, stats = IcetrustUtils.pgp_race_keyservers(gpg, [http_server.url(''), http_server2.url('')],
+                                                                  'FBFCC82A015E7330')
+        assert time.monotonic() - start_time < 2
+        assert winner_keydata == IcetrustUtils.pgp_filter_keys(gpg, keydata, 'FBFCC82A015E7330')
+        assert [(server_stats['keyserver'], server_stats['result']) for server_stats in stats] == \
+            [(http_server.url(''), 'cancelled'), (http_server2.url(''), 'ok')]
+        assert stats[0]['latency'] is None
+        assert stats[1]['latency'] > 0
+
+    def test_race_keyservers_wrong_key(self, tmp_path, http_server, http_server2):
+        http_server.responses[self.LOOKUP_PATH] = \
+            [(200, Path(os.path.join(TEST_DIR, 'pgp_keys.txt')).read_bytes(), 0.5)]
+        http_server2.responses[self.LOOKUP_PATH] = \
+            [(200, Path(os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt')).read_bytes(), 0)]
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        winner_keydata, stats = IcetrustUtils.pgp_race_keyservers(gpg, [http_server.url(''), http_server2.url('')],
+                                                                  'FBFCC82A015E7330')
+        assert b'BEGIN PGP PUBLIC KEY BLOCK' in winner_keydata
+        assert [server_stats['result'] for server_stats in stats] == ['ok', 'invalid']
+
+    def test_filter_keys(self, tmp_path):
+        keydata = export_test_keys('pgp_keys.txt', 'pgp_keys_ed25519.txt')
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        filtered_gpg = IcetrustUtils.pgp_init()
+        filtered_gpg.import_keys(IcetrustUtils.pgp_filter_keys(gpg, keydata, 'B73EC04F30C74795'))
+        assert IcetrustUtils.pgp_get_fingerprints(filtered_gpg) == {'1E1943F158798768C6D36007B73EC04F30C74795'}
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == set()
+
+        # Subkey IDs find their primary key
+        assert IcetrustUtils.pgp_filter_keys(gpg, keydata, '7C2FAA4DF93C37B2') is not None
+        assert IcetrustUtils.pgp_filter_keys(gpg, keydata, 'DEADBEEFDEADBEEF') is None
+        assert IcetrustUtils.pgp_filter_keys(gpg, b'foobar', 'FBFCC82A015E7330') is None
+
+    def test_race_keyservers_all_failed(self, tmp_path, http_server, http_server2):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        winner_keydata, stats = IcetrustUtils.pgp_race_keyservers(gpg, [http_server.url(''), http_server2.url(''),
+                                                                        'ftp://keys.example.com'],
+                                                                  'FBFCC82A015E7330')
+        assert winner_keydata is None
+        assert [server_stats['result'] for server_stats in stats] == ['error', 'error', 'error']
+
+    def test_import_keys_single_keyserver_other_keys(self, tmp_path, http_server):
+        # Other keys returned along with the requested key are not imported
+        http_server.responses[self.LOOKUP_PATH] = [(200, export_test_keys('pgp_keys.txt', 'pgp_keys_ed25519.txt'), 0)]
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', keyserver=http_server.url('')) is True
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+
+    def test_import_keys_single_keyserver_key_missing(self, tmp_path, http_server, mock_msg_callback):
+        http_server.responses[self.LOOKUP_PATH] = [(200, Path(TEST_DIR, 'pgp_keys_ed25519.txt').read_bytes(), 0)]
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', keyserver=http_server.url(''),
+                                             msg_callback=mock_msg_callback) is False
+        assert mock_msg_callback.messages == \
+            ['Key server receive failed: key FBFCC82A015E7330 not found in response']
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == set()
+
+    def test_import_keys_multiple_keyservers(self, tmp_path, http_server, http_server2, mock_msg_callback):
+        http_server.responses[self.LOOKUP_PATH] = \
+            [(200, Path(os.path.join(TEST_DIR, 'pgp_keys.txt')).read_bytes(), 0)]
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        cmd_output = []
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330',
+                                             keyserver=[http_server.url(''), http_server2.url('')],
+                                             msg_callback=mock_msg_callback, cmd_output=cmd_output) is True
+        assert mock_msg_callback.messages[0].startswith('Key server latencies: ' + http_server.url('') + ' ok ')
+        assert cmd_output[0] == mock_msg_callback.messages[0]
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+
+    def test_import_keys_multiple_keyservers_other_keys(self, tmp_path, http_server, http_server2):
+        # Other keys returned along with the requested key are neither imported nor cached
+        http_server.responses[self.LOOKUP_PATH] = [(200, export_test_keys('pgp_keys.txt', 'pgp_keys_ed25519.txt'), 0)]
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330', key_cache=key_cache,
+                                             keyserver=[http_server.url(''), http_server2.url('')]) is True
+        assert IcetrustUtils.pgp_get_fingerprints(gpg) == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+        cached_gpg = IcetrustUtils.pgp_init()
+        cached_gpg.import_keys(key_cache.get('FBFCC82A015E7330'))
+        assert IcetrustUtils.pgp_get_fingerprints(cached_gpg) == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+
+    def test_import_keys_multiple_keyservers_failed(self, tmp_path, http_server, http_server2):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyid='FBFCC82A015E7330',
+                                             keyserver=[http_server.url(''), http_server2.url('')]) is False
+
+
+# Tests for utils.pgp_verify()
 class TestUtilsPgpVerify(object):
     def test_invalid_file_doesnt_exist(self, tmp_path, copy_keyring):
         gpg = IcetrustUtils.pgp_init(tmp_path)
@@ -234,6 +712,56 @@ class TestUtilsPgpVerify(object):
         assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
                                         os.path.join(TEST_DIR, 'file1.txt.sig')) is True
 
+    def test_invalid_revoked_key(self, tmp_path):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys_revoked.txt')) is True
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.revoked.sig')) is False
+
+    @pytest.mark.parametrize('name', ['subkey_revoked', 'subkey_expired', 'subkey_unusable'])
+    def test_invalid_subkey(self, tmp_path, name):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys_' + name + '.txt')) is True
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.' + name + '.sig')) is False
+
+    def test_valid_file_cached(self, tmp_path, copy_keyring, mock_msg_callback):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                        verification_cache=verification_cache) is True
+
+        # The second verification doesn't run gpg
+        gpg.verify_file = None
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig'), msg_callback=mock_msg_callback,
+                                        verification_cache=verification_cache) is True
+        assert mock_msg_callback.messages == \
+            ['Using cached verification result, signed by: D1A66E1A23B182C9980F788CFBFCC82A015E7330']
+
+    def test_invalid_file_not_cached(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file2.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                        verification_cache=verification_cache) is False
+        assert os.listdir(os.path.join(tmp_path, 'cache')) == []
+
+    def test_valid_file_cache_keyring_changed(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                        verification_cache=verification_cache) is True
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt')) is True
+        mock_msg_callback = MsgCallback()
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig'), msg_callback=mock_msg_callback,
+                                        verification_cache=verification_cache) is True
+        assert mock_msg_callback.messages[0] == '\n--- Results of verification ---'
+        assert len(os.listdir(os.path.join(tmp_path, 'cache'))) == 2
+
     def test_valid_file_verbose(self, tmp_path, copy_keyring, mock_msg_callback):
         gpg = IcetrustUtils.pgp_init(tmp_path)
         assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
@@ -249,6 +777,174 @@ class TestUtilsPgpVerify(object):
                                         os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig')) is True
 
 
+# Tests for utils.pgp_verify_cached()
+class TestUtilsPgpVerifyCached(object):
+    def test_invalid_signaturefile_doesnt_exist(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        with pytest.raises(FileNotFoundError):
+            IcetrustUtils.pgp_verify_cached(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                            os.path.join(TEST_DIR, 'foobar.sig'))
+
+    def test_valid_file_no_cache(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        verification_result, cached_fingerprint = IcetrustUtils.pgp_verify_cached(
+            gpg, os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert verification_result.valid is True
+        assert cached_fingerprint is None
+
+    def test_valid_file_cached(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        verification_result, cached_fingerprint = IcetrustUtils.pgp_verify_cached(
+            gpg, os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'),
+            verification_cache=verification_cache)
+        assert verification_result.valid is True
+        assert cached_fingerprint is None
+
+        # The second verification doesn't run gpg
+        gpg.verify_file = None
+        verification_result, cached_fingerprint = IcetrustUtils.pgp_verify_cached(
+            gpg, os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'),
+            verification_cache=verification_cache)
+        assert verification_result is None
+        assert cached_fingerprint == 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+
+    def test_invalid_file_not_cached(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        verification_result, cached_fingerprint = IcetrustUtils.pgp_verify_cached(
+            gpg, os.path.join(TEST_DIR, 'file2.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'),
+            verification_cache=verification_cache)
+        assert verification_result.valid is False
+        assert cached_fingerprint is None
+        assert os.listdir(os.path.join(tmp_path, 'cache')) == []
+
+
+# Tests for utils.pgp_verify_stream()
+class TestUtilsPgpVerifyStream(object):
+    def test_valid_bytes(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_verify_stream(gpg, Path(TEST_DIR, 'file1.txt').read_bytes(),
+                                               Path(TEST_DIR, 'file1.txt.sig').read_bytes()) is True
+
+    def test_valid_stream(self, tmp_path, copy_keyring, mock_msg_callback):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        with open(os.path.join(TEST_DIR, 'file1.txt'), 'rb') as data, \
+                open(os.path.join(TEST_DIR, 'file1.txt.sig'), 'rb') as signature:
+            assert IcetrustUtils.pgp_verify_stream(gpg, data, signature, msg_callback=mock_msg_callback) is True
+        assert mock_msg_callback.messages[0] == '\n--- Results of verification ---'
+        assert '[GNUPG:] GOODSIG' in mock_msg_callback.messages[1]
+
+    def test_valid_pipe(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        read_fd, write_fd = os.pipe()
+
+        def write_data():
+            with os.fdopen(write_fd, 'wb') as pipe:
+                pipe.write(Path(TEST_DIR, 'file1.txt').read_bytes())
+
+        writer = threading.Thread(target=write_data)
+        writer.start()
+        with os.fdopen(read_fd, 'rb') as pipe:
+            assert IcetrustUtils.pgp_verify_stream(gpg, pipe, Path(TEST_DIR, 'file1.txt.sig').read_bytes()) is True
+        writer.join()
+
+    def test_valid_no_temp_files_or_leaked_descriptors(self, tmp_path, copy_keyring, monkeypatch):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        monkeypatch.setattr(tempfile, 'mkstemp', None)
+        open_fds = os.listdir('/proc/self/fd') if os.path.isdir('/proc/self/fd') else None
+        for _ in range(5):
+            assert IcetrustUtils.pgp_verify_stream(gpg, Path(TEST_DIR, 'file1.txt').read_bytes(),
+                                                   Path(TEST_DIR, 'file1.txt.sig').read_bytes()) is True
+        if open_fds is not None:
+            assert len(os.listdir('/proc/self/fd')) == len(open_fds)
+
+    def test_invalid_wrong_data(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        cmd_output = []
+        assert IcetrustUtils.pgp_verify_stream(gpg, Path(TEST_DIR, 'file2.txt').read_bytes(),
+                                               Path(TEST_DIR, 'file1.txt.sig').read_bytes(),
+                                               cmd_output=cmd_output) is False
+        assert '[GNUPG:] BADSIG' in cmd_output[0]
+
+    def test_invalid_large_data(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_verify_stream(gpg, b'x' * (16 * 1024 * 1024),
+                                               Path(TEST_DIR, 'file1.txt.sig').read_bytes()) is False
+
+    def test_invalid_no_key_large_data(self, tmp_path):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        cmd_output = []
+        assert IcetrustUtils.pgp_verify_stream(gpg, b'x' * (16 * 1024 * 1024),
+                                               Path(TEST_DIR, 'file1.txt.sig').read_bytes(),
+                                               cmd_output=cmd_output) is False
+        assert '[GNUPG:] NO_PUBKEY' in cmd_output[0]
+
+    def test_invalid_invalid_signature(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_verify_stream(gpg, Path(TEST_DIR, 'file1.txt').read_bytes(),
+                                               Path(TEST_DIR, 'file2.txt').read_bytes()) is False
+
+    def test_invalid_revoked_key(self, tmp_path):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys_revoked.txt')) is True
+        assert IcetrustUtils.pgp_verify_stream(gpg, Path(TEST_DIR, 'file1.txt').read_bytes(),
+                                               Path(TEST_DIR, 'file1.txt.revoked.sig').read_bytes()) is False
+
+
+# Tests for utils.pgp_find_signatures()
+class TestUtilsPgpFindSignatures(object):
+    def test_empty(self, tmp_path):
+        assert IcetrustUtils.pgp_find_signatures(tmp_path) == []
+
+    def test_valid(self, tmp_path):
+        for filename in ['a.zip', 'a.zip.sig', 'b.tar.gz', 'b.tar.gz.asc', 'c.txt', 'd.dat', 'd.dat.sig',
+                         'd.dat.asc', 'orphan.sig']:
+            Path(os.path.join(tmp_path, filename)).write_text(filename)
+        os.mkdir(os.path.join(tmp_path, 'e'))
+        Path(os.path.join(tmp_path, 'e.sig')).write_text('e.sig')
+        assert IcetrustUtils.pgp_find_signatures(tmp_path) == [
+            (os.path.join(tmp_path, 'a.zip'), os.path.join(tmp_path, 'a.zip.sig')),
+            (os.path.join(tmp_path, 'b.tar.gz'), os.path.join(tmp_path, 'b.tar.gz.asc')),
+            (os.path.join(tmp_path, 'd.dat'), os.path.join(tmp_path, 'd.dat.sig')),
+        ]
+
+
+# Tests for utils.pgp_verify_batch()
+class TestUtilsPgpVerifyBatch(object):
+    def test_empty(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        assert list(IcetrustUtils.pgp_verify_batch(gpg, [])) == []
+
+    def test_valid_mixed(self, tmp_path, copy_keyring):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        pairs = [(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig')),
+                 (os.path.join(TEST_DIR, 'file2.txt'), os.path.join(TEST_DIR, 'file1.txt.sig')),
+                 (os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'), os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig')),
+                 (os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'foobar.sig'))] * 4
+        results = list(IcetrustUtils.pgp_verify_batch(gpg, pairs, max_workers=3))
+        assert len(results) == len(pairs)
+        for filename, signaturefile, result, output in results:
+            expected = signaturefile != os.path.join(TEST_DIR, 'foobar.sig') and \
+                filename != os.path.join(TEST_DIR, 'file2.txt')
+            assert result is expected
+            assert (len(output) > 0) is (not expected and signaturefile != os.path.join(TEST_DIR, 'foobar.sig'))
+
+    def test_valid_verbose(self, tmp_path, copy_keyring, mock_msg_callback):
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        pairs = [(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))] * 3
+        results = list(IcetrustUtils.pgp_verify_batch(gpg, pairs, msg_callback=mock_msg_callback))
+        assert [result for _, _, result, _ in results] == [True] * 3
+        assert mock_msg_callback.messages[0::2] == ['\n--- Results of verification ---'] * 3
+
+    def test_valid_context(self):
+        with GpgContext(trust_keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as gpg_context:
+            results = list(gpg_context.verify_batch([(os.path.join(TEST_DIR, 'file1.txt'),
+                                                      os.path.join(TEST_DIR, 'file1.txt.sig'))]))
+            assert results == [(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                True, [])]
+
+
 # Tests for utils.pgp_init()
 class TestUtilsPgpInit(object):
     def test_invalid_bad_dir(self):
@@ -263,6 +959,90 @@ class TestUtilsPgpInit(object):
         os.mkdir(new_dir)
         assert type(IcetrustUtils.pgp_init(gpg_home_dir=new_dir)) is gnupg.GPG
 
+    def test_valid_temp_dir_kept(self):
+        gpg = IcetrustUtils.pgp_init()
+        assert os.path.isdir(gpg.gnupghome)
+        gpg.temp_dir_obj.cleanup()
+        assert not os.path.isdir(gpg.gnupghome)
+
+    def test_valid_trust_keyring(self, tmp_path):
+        gpg = IcetrustUtils.pgp_init(gpg_home_dir=tmp_path, trust_keyring=os.path.join(TEST_DIR, 'pubring.kbx'))
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig')) is True
+        assert len(gpg.list_keys(keys=['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])) == 1
+
+    def test_invalid_trust_keyring(self, tmp_path):
+        with pytest.raises(ValueError):
+            IcetrustUtils.pgp_init(gpg_home_dir=tmp_path, trust_keyring=os.path.join(TEST_DIR, 'foobar.kbx'))
+
+
+# Tests for utils.GpgContext
+class TestGpgContext(object):
+    def test_close(self):
+        with GpgContext() as gpg_context:
+            gpg_home = gpg_context.gpg.gnupghome
+            assert os.path.isdir(gpg_home)
+        assert not os.path.isdir(gpg_home)
+
+    def test_close_persistent_home(self, tmp_path):
+        with GpgContext(gpg_home_dir=tmp_path):
+            pass
+        assert os.path.isdir(tmp_path)
+
+    def test_verify_trust_keyring(self):
+        with GpgContext(trust_keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as gpg_context:
+            assert gpg_context.verify(os.path.join(TEST_DIR, 'file1.txt'),
+                                      os.path.join(TEST_DIR, 'file1.txt.sig')) is True
+            assert gpg_context.verify(os.path.join(TEST_DIR, 'file2.txt'),
+                                      os.path.join(TEST_DIR, 'file1.txt.sig')) is False
+
+    def test_verify_verification_cache(self, tmp_path, mock_msg_callback):
+        verification_cache = VerificationCache(tmp_path)
+        with GpgContext(trust_keyring=os.path.join(TEST_DIR, 'pubring.kbx'),
+                        verification_cache=verification_cache) as gpg_context:
+            assert gpg_context.verify(os.path.join(TEST_DIR, 'file1.txt'),
+                                      os.path.join(TEST_DIR, 'file1.txt.sig')) is True
+            keyring_state = gpg_context.keyring_state
+            assert list(gpg_context.verify_batch([(os.path.join(TEST_DIR, 'file1.txt'),
+                                                   os.path.join(TEST_DIR, 'file1.txt.sig'))],
+                                                 msg_callback=mock_msg_callback))[0][2] is True
+            assert mock_msg_callback.messages == \
+                ['Using cached verification result, signed by: D1A66E1A23B182C9980F788CFBFCC82A015E7330']
+
+            # Importing keys changes the keyring
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt')) is True
+            assert gpg_context.keyring_state is None
+            assert gpg_context.get_keyring_state() != keyring_state
+
+    @pytest.mark.slow
+    def test_import_keys_reuse(self, mock_msg_callback):
+        with GpgContext() as gpg_context:
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'),
+                                           msg_callback=mock_msg_callback) is True
+            assert mock_msg_callback.messages == \
+                ['Reusing imported keys: ' + os.path.abspath(os.path.join(TEST_DIR, 'pgp_keys.txt'))]
+            assert gpg_context.verify(os.path.join(TEST_DIR, 'file1.txt'),
+                                      os.path.join(TEST_DIR, 'file1.txt.sig')) is True
+
+    def test_import_keys_failed_not_reused(self, mock_msg_callback):
+        with GpgContext() as gpg_context:
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'file1.txt.sig')) is False
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                           msg_callback=mock_msg_callback) is False
+            assert len(mock_msg_callback.messages) == 2
+
+    @pytest.mark.slow
+    def test_persistent_home(self, tmp_path):
+        with GpgContext(gpg_home_dir=tmp_path) as gpg_context:
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+
+        # Keys are kept between contexts, importing them again is reported as unchanged
+        with GpgContext(gpg_home_dir=tmp_path) as gpg_context:
+            assert gpg_context.verify(os.path.join(TEST_DIR, 'file1.txt'),
+                                      os.path.join(TEST_DIR, 'file1.txt.sig')) is True
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+
 
 # Tests for utils.verify_checksum()
 class TestUtilsVerifyChecksum(object):
@@ -376,3 +1156,111 @@ class TestUtilsVerifyChecksum(object):
     def test_invalid_missing_arguments1(self):
         with pytest.raises(ValueError):
             IcetrustUtils.verify_checksum(os.path.join(TEST_DIR, 'file1.txt'), DEFAULT_HASH_ALGORITHM)
+
+
+# Tests for utils.verify_checksum_stream()
+class TestUtilsVerifyChecksumStream(object):
+    def test_valid_checksum_bytes(self):
+        assert IcetrustUtils.verify_checksum_stream(Path(TEST_DIR, 'file1.txt').read_bytes(), DEFAULT_HASH_ALGORITHM,
+                                                    checksum_value=FILE1_HASH) is True
+
+    def test_valid_checksumfile_stream(self, mock_msg_callback):
+        with open(os.path.join(TEST_DIR, 'file1.txt'), 'rb') as data:
+            assert IcetrustUtils.verify_checksum_stream(data, DEFAULT_HASH_ALGORITHM,
+                                                        checksumfile=os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                                        msg_callback=mock_msg_callback) is True
+        assert mock_msg_callback.messages == ['Algorithm: sha256', 'File hash: ' + FILE1_HASH]
+
+    def test_valid_checksumfile_zlib_algorithm(self, tmp_path):
+        checksumfile = os.path.join(tmp_path, 'CRC32SUMS')
+        Path(checksumfile).write_text(filehash.FileHash('crc32').hash_file(os.path.join(TEST_DIR, 'file1.txt')) +
+                                      '  file1.txt\n')
+        assert IcetrustUtils.verify_checksum_stream(Path(TEST_DIR, 'file1.txt').read_bytes(), 'crc32',
+                                                    checksumfile=checksumfile) is True
+
+    def test_invalid_checksum_with_cmd_output(self):
+        cmd_output = []
+        assert IcetrustUtils.verify_checksum_stream(Path(TEST_DIR, 'file2.txt').read_bytes(), DEFAULT_HASH_ALGORITHM,
+                                                    checksum_value=FILE1_HASH, cmd_output=cmd_output) is False
+        assert cmd_output[1] == 'File checksum: ' + FILE2_HASH
+
+    def test_invalid_algorithm(self):
+        with pytest.raises(ValueError):
+            IcetrustUtils.verify_checksum_stream(b'', 'foobar', checksum_value=FILE1_HASH)
+
+
+# Tests for utils.verify_checksum() and utils.verify_checksum_stream() with decompression
+class TestUtilsVerifyChecksumDecompress(object):
+    @pytest.mark.parametrize('decompress', DECOMPRESS_FORMATS)
+    def test_valid_checksum(self, tmp_path, decompress):
+        path = write_compressed(tmp_path, 'file1.txt', decompress)
+        assert IcetrustUtils.verify_checksum(path, DEFAULT_HASH_ALGORITHM, checksum_value=FILE1_HASH,
+                                             decompress=decompress) is True
+        assert IcetrustUtils.verify_checksum(path, DEFAULT_HASH_ALGORITHM, checksum_value=FILE1_HASH) is False
+
+    @pytest.mark.parametrize('decompress', DECOMPRESS_FORMATS)
+    def test_valid_checksumfile_stream(self, tmp_path, decompress):
+        with open(write_compressed(tmp_path, 'file1.txt', decompress), 'rb') as data:
+            assert IcetrustUtils.verify_checksum_stream(data, DEFAULT_HASH_ALGORITHM, decompress=decompress,
+                                                        checksumfile=os.path.join(TEST_DIR,
+                                                                                  'file1.txt.SHA256SUMS')) is True
+
+    def test_valid_checksum_bytes(self):
+        data = gzip.compress(Path(TEST_DIR, 'file1.txt').read_bytes())
+        assert IcetrustUtils.verify_checksum_stream(data, DEFAULT_HASH_ALGORITHM, checksum_value=FILE1_HASH,
+                                                    decompress='gz') is True
+
+    def test_multiple_streams(self, tmp_path):
+        # Concatenated gzip members decompress to the concatenated content, like zcat
+        path = os.path.join(str(tmp_path), 'file.gz')
+        Path(path).write_bytes(gzip.compress(b'foo') + gzip.compress(b'bar'))
+        assert IcetrustUtils.verify_checksum(path, DEFAULT_HASH_ALGORITHM, decompress='gz',
+                                             checksum_value=hashlib.sha256(b'foobar').hexdigest()) is True
+
+    @pytest.mark.parametrize('decompress', DECOMPRESS_FORMATS)
+    def test_invalid_data(self, mock_msg_callback, decompress):
+        assert IcetrustUtils.verify_checksum(os.path.join(TEST_DIR, 'file1.txt'), DEFAULT_HASH_ALGORITHM,
+                                             checksum_value=FILE1_HASH, decompress=decompress,
+                                             msg_callback=mock_msg_callback) is False
+        assert mock_msg_callback.messages[0].startswith('File cannot be decompressed: ')
+
+    def test_truncated_data(self, tmp_path, mock_msg_callback):
+        path = write_compressed(tmp_path, 'file1.txt', 'xz')
+        Path(path).write_bytes(Path(path).read_bytes()[:-10])
+        assert IcetrustUtils.verify_checksum(path, DEFAULT_HASH_ALGORITHM, checksum_value=FILE1_HASH,
+                                             decompress='xz', msg_callback=mock_msg_callback) is False
+        assert mock_msg_callback.messages[0].startswith('File cannot be decompressed: ')
+
+    def test_missing_file(self, mock_msg_callback):
+        assert IcetrustUtils.verify_checksum(os.path.join(TEST_DIR, 'foobar'), DEFAULT_HASH_ALGORITHM,
+                                             checksum_value=FILE1_HASH, decompress='gz',
+                                             msg_callback=mock_msg_callback) is False
+        assert 'No such file or directory' in mock_msg_callback.messages[0]
+
+    def test_invalid_decompress(self):
+        with pytest.raises(ValueError):
+            IcetrustUtils.verify_checksum(os.path.join(TEST_DIR, 'file1.txt'), DEFAULT_HASH_ALGORITHM,
+                                          checksum_value=FILE1_HASH, decompress='zip')
+        with pytest.raises(ValueError):
+            IcetrustUtils.verify_checksum_stream(b'', DEFAULT_HASH_ALGORITHM, checksum_value=FILE1_HASH,
+                                                 decompress='zip')
+
+
+# Tests for TeeStream class
+class TestTeeStream(object):
+    def test_read(self):
+        output = BytesIO()
+        stream = TeeStream(BytesIO(b'foobar' * 100000), output)
+        assert IcetrustUtils.verify_checksum_stream(stream, 'sha256',
+                                                    checksum_value=hashlib.sha256(b'foobar' * 100000).hexdigest())
+        assert output.getvalue() == b'foobar' * 100000
+
+    def test_read_broken_pipe(self):
+        class BrokenOutput(object):
+            def write(self, data):
+                raise BrokenPipeError()
+
+        stream = TeeStream(BytesIO(b'foobar' * 100000), BrokenOutput())
+        assert IcetrustUtils.verify_checksum_stream(stream, 'sha256',
+                                                    checksum_value=hashlib.sha256(b'foobar' * 100000).hexdigest())
+        assert stream.output is None
@@ -0,0 +1,246 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import base64, hashlib, io, os, tarfile, warnings, zipfile
+
+import pytest
+
+from icetrust.utils import MsgCallback
+from icetrust.utils_archive import ARCHIVE_TYPE_TAR, ARCHIVE_TYPE_ZIP, IcetrustArchiveUtils
+from test_utils import TEST_DIR
+
+# Members of the test archives
+MEMBERS = {'icetrust_test/__init__.py': b'print("hello")\n', 'icetrust_test/data.bin': bytes(range(256)) * 1000}
+
+
+def make_record(members, record_name='icetrust_test-1.0.dist-info/RECORD'):
+    lines = []
+    for name, data in members.items():
+        digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode('ascii')
+        lines.append(name + ',sha256=' + digest + ',' + str(len(data)))
+    lines.append(record_name + ',,')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def make_wheel(path, members=None, record=None, extra_members=None):
+    members = MEMBERS if members is None else members
+    with zipfile.ZipFile(str(path), 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in list(members.items()) + list((extra_members or dict()).items()):
+            # Duplicate names are written on purpose by some tests
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                archive.writestr(name, data)
+        archive.writestr('icetrust_test-1.0.dist-info/RECORD', record if record is not None else
+                         make_record(members))
+    return str(path)
+
+
+def make_manifest(path, members):
+    with open(str(path), 'w') as file:
+        for name, data in members.items():
+            file.write(hashlib.sha256(data).hexdigest() + '  ' + name + '\n')
+    return str(path)
+
+
+def make_tar(path, members, mode='w:gz'):
+    with tarfile.open(str(path), mode) as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo('./' + name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+# Tests for IcetrustArchiveUtils.parse_record() and IcetrustArchiveUtils.parse_member_manifest()
+class TestParseManifests(object):
+    def test_parse_record(self):
+        entries = IcetrustArchiveUtils.parse_record(make_record(MEMBERS).decode('utf-8'))
+        entry = entries['icetrust_test/__init__.py']
+        assert entry.algorithm == 'sha256'
+        assert entry.digest == hashlib.sha256(MEMBERS['icetrust_test/__init__.py']).hexdigest()
+        assert entry.size == len(MEMBERS['icetrust_test/__init__.py'])
+        assert entries['icetrust_test-1.0.dist-info/RECORD'].digest is None
+
+    def test_parse_record_weak_hash(self):
+        with pytest.raises(ValueError):
+            IcetrustArchiveUtils.parse_record('foo.py,md5=1B2M2Y8AsgTpgAmY7PhCfg,0\n')
+
+    def test_parse_record_invalid(self):
+        with pytest.raises(ValueError):
+            IcetrustArchiveUtils.parse_record('foo.py,sha256\n')
+
+    def test_parse_member_manifest(self):
+        with open(os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS')) as file:
+            content = file.read()
+        entries = IcetrustArchiveUtils.parse_member_manifest(content)
+        assert list(entries.keys()) == ['file1.txt']
+        assert entries['file1.txt'].algorithm == 'sha256'
+
+    def test_parse_member_manifest_bsd_escaped(self):
+        entries = IcetrustArchiveUtils.parse_member_manifest('SHA1 (./a.txt) = ' + 'A' * 40 + '\n' +
+                                                             '\\' + 'b' * 64 + '  a\\\\b\\nc\n')
+        assert entries['a.txt'].algorithm == 'sha1'
+        assert entries['a.txt'].digest == 'a' * 40
+        assert entries['a\\b\nc'].algorithm == 'sha256'
+
+    def test_parse_member_manifest_invalid(self):
+        with pytest.raises(ValueError):
+            IcetrustArchiveUtils.parse_member_manifest('foobar\n')
+
+
+# Tests for IcetrustArchiveUtils.verify_archive()
+class TestVerifyArchive(object):
+    def test_archive_type(self, tmp_path):
+        assert IcetrustArchiveUtils.get_archive_type(make_wheel(tmp_path / 'test.whl')) == ARCHIVE_TYPE_ZIP
+        assert IcetrustArchiveUtils.get_archive_type(make_tar(tmp_path / 'test.tar.xz', MEMBERS, 'w:xz')) == \
+            ARCHIVE_TYPE_TAR
+        assert IcetrustArchiveUtils.get_archive_type(os.path.join(TEST_DIR, 'file1.txt')) is None
+
+    def test_wheel(self, tmp_path):
+        msg_callback = MsgCallback()
+        assert IcetrustArchiveUtils.verify_archive(make_wheel(tmp_path / 'test.whl'), msg_callback=msg_callback)
+        assert msg_callback.messages == ['Using wheel RECORD file: icetrust_test-1.0.dist-info/RECORD',
+                                         'Member verified: icetrust_test/__init__.py',
+                                         'Member verified: icetrust_test/data.bin',
+                                         'Members verified: 2']
+
+    def test_wheel_tampered(self, tmp_path):
+        tampered = dict(MEMBERS)
+        tampered['icetrust_test/__init__.py'] = b'print("HELLO")\n'
+        msg_callback = MsgCallback()
+        assert not IcetrustArchiveUtils.verify_archive(make_wheel(tmp_path / 'test.whl', members=tampered,
+                                                                  record=make_record(MEMBERS)),
+                                                       msg_callback=msg_callback)
+        assert 'Member failed: icetrust_test/__init__.py (checksum mismatch)' in msg_callback.messages
+
+    def test_wheel_size_mismatch(self, tmp_path):
+        tampered = dict(MEMBERS)
+        tampered['icetrust_test/data.bin'] = b'foobar'
+        cmd_output = []
+        assert not IcetrustArchiveUtils.verify_archive(make_wheel(tmp_path / 'test.whl', members=tampered,
+                                                                  record=make_record(MEMBERS)),
+                                                       cmd_output=cmd_output)
+        assert cmd_output == ['Member failed: icetrust_test/data.bin (size mismatch)']
+
+    def test_wheel_unlisted_member(self, tmp_path):
+        cmd_output = []
+        wheel = make_wheel(tmp_path / 'test.whl', extra_members={'icetrust_test/evil.py': b'import os\n'})
+        assert not IcetrustArchiveUtils.verify_archive(wheel, cmd_output=cmd_output)
+        assert cmd_output == ['Member failed: icetrust_test/evil.py (not listed in manifest)']
+
+    def test_wheel_duplicate_member(self, tmp_path):
+        cmd_output = []
+        wheel = make_wheel(tmp_path / 'test.whl', extra_members={'icetrust_test/__init__.py': b'import os\n'})
+        assert not IcetrustArchiveUtils.verify_archive(wheel, cmd_output=cmd_output)
+        assert cmd_output == ['Member failed: icetrust_test/__init__.py (duplicate member)']
+
+    def test_wheel_missing_member(self, tmp_path):
+        members = {'icetrust_test/__init__.py': MEMBERS['icetrust_test/__init__.py']}
+        cmd_output = []
+        assert not IcetrustArchiveUtils.verify_archive(make_wheel(tmp_path / 'test.whl', members=members,
+                                                                  record=make_record(MEMBERS)),
+                                                       cmd_output=cmd_output)
+        assert cmd_output == ['Member failed: icetrust_test/data.bin (missing from archive)']
+
+    def test_wheel_signature_not_listed(self, tmp_path):
+        wheel = make_wheel(tmp_path / 'test.whl', extra_members={'icetrust_test-1.0.dist-info/RECORD.jws': b'{}'})
+        assert IcetrustArchiveUtils.verify_archive(wheel)
+
+    def test_zip_without_record(self, tmp_path):
+        with zipfile.ZipFile(str(tmp_path / 'test.zip'), 'w') as archive:
+            archive.writestr('file1.txt', b'foobar')
+        with pytest.raises(ValueError):
+            IcetrustArchiveUtils.verify_archive(str(tmp_path / 'test.zip'))
+
+    def test_zip_manifest(self, tmp_path):
+        with zipfile.ZipFile(str(tmp_path / 'test.zip'), 'w') as archive:
+            for name, data in MEMBERS.items():
+                archive.writestr(name, data)
+        assert IcetrustArchiveUtils.verify_archive(str(tmp_path / 'test.zip'),
+                                                   manifestfile=make_manifest(tmp_path / 'SHA256SUMS', MEMBERS))
+
+    @pytest.mark.parametrize('mode', ['w', 'w:gz', 'w:bz2', 'w:xz'])
+    def test_tar(self, tmp_path, mode):
+        archive = make_tar(tmp_path / 'test.tar', MEMBERS, mode)
+        assert IcetrustArchiveUtils.verify_archive(archive,
+                                                   manifestfile=make_manifest(tmp_path / 'SHA256SUMS', MEMBERS))
+
+    def test_tar_tampered(self, tmp_path):
+        tampered = dict(MEMBERS)
+        tampered['icetrust_test/data.bin'] = b'x' * len(MEMBERS['icetrust_test/data.bin'])
+        cmd_output = []
+        assert not IcetrustArchiveUtils.verify_archive(make_tar(tmp_path / 'test.tgz', tampered),
+                                                       manifestfile=make_manifest(tmp_path / 'SHA256SUMS', MEMBERS),
+                                                       cmd_output=cmd_output)
+        assert cmd_output == ['Member failed: icetrust_test/data.bin (checksum mismatch)']
+
+    def test_tar_links(self, tmp_path):
+        with tarfile.open(str(tmp_path / 'test.tar'), 'w') as archive:
+            for name, data in MEMBERS.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+            info = tarfile.TarInfo('link')
+            info.type = tarfile.SYMTYPE
+            info.linkname = 'icetrust_test/data.bin'
+            archive.addfile(info)
+            info = tarfile.TarInfo('fifo')
+            info.type = tarfile.FIFOTYPE
+            archive.addfile(info)
+        cmd_output = []
+        assert not IcetrustArchiveUtils.verify_archive(str(tmp_path / 'test.tar'), cmd_output=cmd_output,
+                                                       manifestfile=make_manifest(tmp_path / 'SHA256SUMS', MEMBERS))
+        assert cmd_output == ['Member failed: link (not a regular file)', 'Member failed: fifo (not a regular file)']
+
+    def test_tar_link_replacing_member(self, tmp_path):
+        # A link with the name of a verified member would replace it when the archive is extracted
+        with tarfile.open(str(tmp_path / 'test.tar'), 'w') as archive:
+            for name, data in MEMBERS.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+            for link_type in [tarfile.SYMTYPE, tarfile.LNKTYPE]:
+                info = tarfile.TarInfo('./icetrust_test/__init__.py')
+                info.type = link_type
+                info.linkname = '/etc/shadow'
+                archive.addfile(info)
+        cmd_output = []
+        assert not IcetrustArchiveUtils.verify_archive(str(tmp_path / 'test.tar'), cmd_output=cmd_output,
+                                                       manifestfile=make_manifest(tmp_path / 'SHA256SUMS', MEMBERS))
+        assert cmd_output == ['Member failed: icetrust_test/__init__.py (duplicate member)'] * 2
+
+    def test_tar_truncated(self, tmp_path):
+        make_tar(tmp_path / 'test.tar', MEMBERS, 'w')
+        (tmp_path / 'test.tar').write_bytes((tmp_path / 'test.tar').read_bytes()[:2048])
+        cmd_output = []
+        assert not IcetrustArchiveUtils.verify_archive(str(tmp_path / 'test.tar'), cmd_output=cmd_output,
+                                                       manifestfile=make_manifest(tmp_path / 'SHA256SUMS', MEMBERS))
+        assert cmd_output[0].startswith('ERROR: Archive cannot be read')
+
+    def test_tar_without_manifest(self, tmp_path):
+        with pytest.raises(ValueError):
+            IcetrustArchiveUtils.verify_archive(make_tar(tmp_path / 'test.tgz', MEMBERS))
+
+    def test_not_archive(self):
+        with pytest.raises(ValueError):
+            IcetrustArchiveUtils.verify_archive(os.path.join(TEST_DIR, 'file1.txt'))
@@ -0,0 +1,310 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio, os, stat, time
+
+import pytest
+
+from icetrust.utils import IcetrustUtils, MsgCallback
+from icetrust.utils_async import AsyncGpg, IcetrustAsyncUtils
+from test_utils import export_test_keys, FILE1_HASH, FILE2_HASH, TEST_DIR
+
+
+def make_fake_gpg(tmp_path, delay):
+    # Fake gpg binary that hangs for a while, like a wedged gpg-agent
+    fake_gpg = os.path.join(tmp_path, 'fake_gpg')
+    with open(fake_gpg, 'w') as script:
+        script.write('#!/bin/sh\nexec sleep ' + str(delay) + '\n')
+    os.chmod(fake_gpg, stat.S_IRWXU)
+    return fake_gpg
+
+
+# Tests for AsyncGpg verification
+class TestAsyncGpgVerify(object):
+    def test_valid(self):
+        async def run():
+            with AsyncGpg(keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as gpg:
+                return await gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                             os.path.join(TEST_DIR, 'file1.txt'))
+        result = asyncio.run(run())
+        assert result.valid is True
+        assert result.status == 'signature valid'
+        assert result.fingerprint == 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+        assert result.pubkey_fingerprint == 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+        assert result.key_id == 'FBFCC82A015E7330'
+        assert result.username == 'Bob Babbage <bob@openpgp.example>'
+
+    def test_invalid_wrong_file(self):
+        async def run():
+            with AsyncGpg(keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as gpg:
+                return await gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                             os.path.join(TEST_DIR, 'file2.txt'))
+        result = asyncio.run(run())
+        assert result.valid is False
+        assert result.status == 'signature bad'
+
+    def test_invalid_no_public_key(self):
+        async def run():
+            with AsyncGpg() as gpg:
+                return await gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                             os.path.join(TEST_DIR, 'file1.txt'))
+        result = asyncio.run(run())
+        assert result.valid is False
+        assert result.status == 'no public key'
+
+    def test_invalid_revoked_key(self):
+        async def run():
+            with AsyncGpg() as gpg:
+                import_result = await gpg.import_keys_file(os.path.join(TEST_DIR, 'pgp_keys_revoked.txt'))
+                assert import_result.fingerprints == ['AE69AEDA312688CB0138552EFBC602A24E7CEC41']
+                return await gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.revoked.sig'),
+                                             os.path.join(TEST_DIR, 'file1.txt'))
+        result = asyncio.run(run())
+        assert result.valid is False
+        assert result.status == 'signing key was revoked'
+
+    def test_invalid_not_a_signature(self):
+        async def run():
+            with AsyncGpg(keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as gpg:
+                return await gpg.verify_file(os.path.join(TEST_DIR, 'file2.txt'),
+                                             os.path.join(TEST_DIR, 'file1.txt'))
+        result = asyncio.run(run())
+        assert result.valid is False
+
+    def test_verify_batch(self):
+        pairs = [(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig')),
+                 (os.path.join(TEST_DIR, 'file2.txt'), os.path.join(TEST_DIR, 'file1.txt.sig')),
+                 (os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'), os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'))]
+
+        async def run():
+            with AsyncGpg(keyring=os.path.join(TEST_DIR, 'pubring.kbx'), max_processes=2) as gpg:
+                return await gpg.verify_batch(pairs)
+        results = asyncio.run(run())
+        assert [(filename, signaturefile) for filename, signaturefile, _ in results] == pairs
+        assert [result.valid for _, _, result in results] == [True, False, True]
+
+
+# Tests for AsyncGpg key imports
+class TestAsyncGpgImport(object):
+    def test_import_keys(self):
+        async def run():
+            with AsyncGpg() as gpg:
+                import_result1 = await gpg.import_keys(
+                    open(os.path.join(TEST_DIR, 'pgp_keys.txt'), 'r').read())
+                import_result2 = await gpg.import_keys_file(os.path.join(TEST_DIR, 'pgp_keys.txt'))
+                return import_result1, import_result2, IcetrustUtils.pgp_init(gpg.gnupghome).list_keys()
+        import_result1, import_result2, keys = asyncio.run(run())
+        assert import_result1.imported == 1
+        assert import_result1.fingerprints == ['D1A66E1A23B182C9980F788CFBFCC82A015E7330']
+        assert import_result2.imported == 0
+        assert import_result2.unchanged == 1
+        assert [key['fingerprint'] for key in keys] == ['D1A66E1A23B182C9980F788CFBFCC82A015E7330']
+
+    def test_import_keys_invalid(self):
+        async def run():
+            with AsyncGpg() as gpg:
+                return await gpg.import_keys(b'foobar')
+        import_result = asyncio.run(run())
+        assert import_result.imported == 0
+        assert not import_result
+
+    def test_recv_keys_other_keys(self, http_server):
+        # Other keys returned along with the requested key are not imported
+        http_server.responses['/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'] = \
+            [(200, export_test_keys('pgp_keys.txt', 'pgp_keys_ed25519.txt'), 0)]
+
+        async def run():
+            with AsyncGpg() as gpg:
+                import_result = await gpg.recv_keys(http_server.url(''), 'FBFCC82A015E7330')
+                return import_result, IcetrustUtils.pgp_get_fingerprints(IcetrustUtils.pgp_init(gpg.gnupghome))
+        import_result, fingerprints = asyncio.run(run())
+        assert import_result.fingerprints == ['D1A66E1A23B182C9980F788CFBFCC82A015E7330']
+        assert fingerprints == {'D1A66E1A23B182C9980F788CFBFCC82A015E7330'}
+
+    def test_recv_keys_invalid(self, http_server):
+        http_server.responses['/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'] = \
+            [(200, Path(TEST_DIR, 'pgp_keys_ed25519.txt').read_bytes(), 0)]
+
+        async def run():
+            with AsyncGpg() as gpg:
+                return await gpg.recv_keys(http_server.url(''), 'FBFCC82A015E7330', '1E1943F158798768')
+        import_result = asyncio.run(run())
+        assert not import_result
+        assert import_result.stderr == \
+            'keyserver receive failed: key FBFCC82A015E7330 not found in response\n' + \
+            'keyserver receive failed: 404 Client Error: Not Found for url: ' + \
+            http_server.url('/pks/lookup?op=get&options=mr&search=0x1E1943F158798768') + '\n'
+
+    def test_invalid_trust_keyring(self):
+        with pytest.raises(ValueError):
+            AsyncGpg(keyring=os.path.join(TEST_DIR, 'foobar.kbx'))
+
+
+# Tests for AsyncGpg timeouts, cancellation and process limits
+class TestAsyncGpgProcesses(object):
+    def test_timeout(self, tmp_path):
+        async def run():
+            with AsyncGpg(gpgbinary=make_fake_gpg(tmp_path, 10), timeout=0.2) as gpg:
+                await gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.sig'), os.path.join(TEST_DIR, 'file1.txt'))
+        start_time = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(run())
+        assert time.monotonic() - start_time < 2
+
+    def test_timeout_batch(self, tmp_path):
+        async def run():
+            with AsyncGpg(gpgbinary=make_fake_gpg(tmp_path, 10)) as gpg:
+                return await gpg.verify_batch([(os.path.join(TEST_DIR, 'file1.txt'),
+                                                os.path.join(TEST_DIR, 'file1.txt.sig'))], timeout=0.2)
+        results = asyncio.run(run())
+        assert results[0][2].valid is False
+        assert results[0][2].status == 'timeout'
+
+    def test_cancel(self, tmp_path):
+        async def run():
+            with AsyncGpg(gpgbinary=make_fake_gpg(tmp_path, 10)) as gpg:
+                task = asyncio.ensure_future(gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                                             os.path.join(TEST_DIR, 'file1.txt')))
+                await asyncio.sleep(0.2)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+        start_time = time.monotonic()
+        asyncio.run(run())
+        assert time.monotonic() - start_time < 2
+
+    def test_max_processes(self, tmp_path):
+        async def run():
+            with AsyncGpg(gpgbinary=make_fake_gpg(tmp_path, 0.3), max_processes=2) as gpg:
+                return await gpg.verify_batch([(os.path.join(TEST_DIR, 'file1.txt'),
+                                                os.path.join(TEST_DIR, 'file1.txt.sig'))] * 4)
+        start_time = time.monotonic()
+        asyncio.run(run())
+        assert time.monotonic() - start_time >= 0.6
+
+
+# Tests for IcetrustAsyncUtils.verify_checksum()
+class TestAsyncUtilsVerifyChecksum(object):
+    def test_valid(self):
+        msg_callback = MsgCallback()
+        assert asyncio.run(IcetrustAsyncUtils.verify_checksum(os.path.join(TEST_DIR, 'file1.txt'), 'sha256',
+                                                              msg_callback=msg_callback,
+                                                              checksum_value=FILE1_HASH)) is True
+        assert msg_callback.messages == ['Algorithm: sha256', 'File hash: ' + FILE1_HASH]
+
+    def test_invalid(self):
+        cmd_output = []
+        assert asyncio.run(IcetrustAsyncUtils.verify_checksum(os.path.join(TEST_DIR, 'file1.txt'), 'sha256',
+                                                              cmd_output=cmd_output,
+                                                              checksum_value=FILE2_HASH)) is False
+        assert cmd_output[-1] == 'Checksum to check against: ' + FILE2_HASH
+
+    def test_checksumfile(self):
+        assert asyncio.run(IcetrustAsyncUtils.verify_checksum(
+            os.path.join(TEST_DIR, 'file1.txt'), 'sha256',
+            checksumfile=os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'))) is True
+
+    def test_missing_file(self):
+        assert asyncio.run(IcetrustAsyncUtils.verify_checksum(os.path.join(TEST_DIR, 'foobar'), 'sha256',
+                                                              checksum_value=FILE1_HASH)) is False
+
+    def test_invalid_algorithm(self):
+        with pytest.raises(ValueError):
+            asyncio.run(IcetrustAsyncUtils.verify_checksum(os.path.join(TEST_DIR, 'file1.txt'), 'foobar',
+                                                           checksum_value=FILE1_HASH))
+
+    def test_many(self):
+        async def run():
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                return await asyncio.gather(*[
+                    IcetrustAsyncUtils.verify_checksum(os.path.join(TEST_DIR, 'file' + str(index % 2 + 1) + '.txt'),
+                                                       'sha256', checksum_value=FILE1_HASH, executor=executor)
+                    for index in range(1000)])
+        assert asyncio.run(run()) == [index % 2 == 0 for index in range(1000)]
+
+
+# Tests for IcetrustAsyncUtils.pgp_verify()
+class TestAsyncUtilsPgpVerify(object):
+    @staticmethod
+    def verify(keyfile, filename, signaturefile, **kwargs):
+        async def run():
+            with AsyncGpg() as gpg:
+                await gpg.import_keys_file(os.path.join(TEST_DIR, keyfile))
+                return await IcetrustAsyncUtils.pgp_verify(gpg, os.path.join(TEST_DIR, filename),
+                                                           os.path.join(TEST_DIR, signaturefile), **kwargs)
+        return asyncio.run(run())
+
+    def test_valid(self):
+        msg_callback = MsgCallback()
+        assert self.verify('pgp_keys.txt', 'file1.txt', 'file1.txt.sig', msg_callback=msg_callback) is True
+        assert msg_callback.messages[0] == '\n--- Results of verification ---'
+        assert 'GOODSIG' in msg_callback.messages[1]
+
+    def test_invalid_wrong_file(self):
+        cmd_output = []
+        assert self.verify('pgp_keys.txt', 'file2.txt', 'file1.txt.sig', cmd_output=cmd_output) is False
+        assert 'BADSIG' in cmd_output[0]
+
+    def test_invalid_revoked_key(self):
+        assert self.verify('pgp_keys_revoked.txt', 'file1.txt', 'file1.txt.revoked.sig') is False
+
+    def test_timeout(self, tmp_path):
+        cmd_output = []
+
+        async def run():
+            with AsyncGpg(gpgbinary=make_fake_gpg(tmp_path, 10)) as gpg:
+                return await IcetrustAsyncUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                                           os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                                           cmd_output=cmd_output, timeout=0.2)
+        assert asyncio.run(run()) is False
+        assert cmd_output == ['gpg timed out\n']
+
+
+# Tests for IcetrustAsyncUtils.canary_run()
+class TestAsyncUtilsCanaryRun(object):
+    def test_valid(self, http_server):
+        with open(os.path.join(TEST_DIR, 'file1.txt'), 'rb') as file:
+            http_server.responses['/file1.txt'] = [(200, file.read(), 0)]
+        config_data = {
+            'name': 'test',
+            'url': 'https://www.example.com',
+            'filename_url': http_server.url('/file1.txt'),
+            'checksum': {
+                'checksum_value': FILE1_HASH,
+            },
+        }
+
+        async def run():
+            # The event loop keeps running while the check downloads
+            ticks = 0
+            task = asyncio.ensure_future(IcetrustAsyncUtils.canary_run(config_data))
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(0.001)
+            return await task, ticks
+        output_objs, ticks = asyncio.run(run())
+        assert len(output_objs) == 1
+        assert output_objs[0]['verified'] is True
+        assert ticks > 0
@@ -21,15 +21,19 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import json, os
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import json, os, shutil, threading, time
 
 import jsonschema, pytest
 
+from icetrust.utils import IcetrustUtils, KeyCache, VerificationCache
 from icetrust.utils_canary import\
     VerificationModes, CANARY_INPUT_SCHEMA, CANARY_OUTPUT_SCHEMA, DEFAULT_HASH_ALGORITHM
-from icetrust.utils_canary import IcetrustCanaryUtils
+from icetrust.utils_canary import DownloadError, DownloadPolicy, FetchPlan, FILENAME_KEYS, HostLimiter,\
+    IcetrustCanaryUtils, NdjsonWriter
 
-from test_utils import mock_msg_callback, TEST_DIR
+from test_utils import FILE1_HASH, TEST_DIR
 
 
 # Tests for misc utils methods
@@ -66,6 +70,36 @@ class TestCanaryUtils(object):
         jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
                                        format_checker=jsonschema.draft7_format_checker)
 
+    def test_input_schema_valid_checksumfile_multiple(self):
+        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
+        parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'checksumfile_multiple.json'), 'r'))
+        jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
+                                       format_checker=jsonschema.draft7_format_checker)
+
+    def test_input_schema_invalid_multiple_checksum(self):
+        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
+        parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'checksum.json'), 'r'))
+        parsed_data['filename_urls'] = [parsed_data.pop('filename_url')]
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
+                                           format_checker=jsonschema.draft7_format_checker)
+
+    def test_input_schema_invalid_multiple_and_single(self):
+        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
+        parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'checksumfile.json'), 'r'))
+        parsed_data['filename_urls'] = [parsed_data['filename_url']]
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
+                                           format_checker=jsonschema.draft7_format_checker)
+
+    def test_input_schema_invalid_multiple_previous_version(self):
+        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
+        parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'checksumfile_multiple.json'), 'r'))
+        parsed_data['previous_version'] = 'test_data/file3.txt'
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
+                                           format_checker=jsonschema.draft7_format_checker)
+
     def test_input_schema_valid_pgp_keyfile(self):
         schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
         parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'pgp_keyfile.json'), 'r'))
@@ -78,6 +112,20 @@ class TestCanaryUtils(object):
         jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
                                        format_checker=jsonschema.draft7_format_checker)
 
+    def test_input_schema_valid_pgp_keyid_multiple(self):
+        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
+        parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'pgp_keyid_multiple.json'), 'r'))
+        jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
+                                       format_checker=jsonschema.draft7_format_checker)
+
+    def test_input_schema_invalid_pgp_keyid_no_keyservers(self):
+        schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
+        parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'pgp_keyid_multiple.json'), 'r'))
+        parsed_data['pgp']['keyserver'] = []
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            jsonschema.validators.validate(instance=parsed_data, schema=schema_data,
+                                           format_checker=jsonschema.draft7_format_checker)
+
     def test_input_schema_valid_pgpchecksumfile_keyid(self):
         schema_data = json.load(open(CANARY_INPUT_SCHEMA, 'r'))
         parsed_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'pgpchecksumfile_keyid.json'), 'r'))
@@ -113,6 +161,94 @@ class TestCanaryUtils(object):
                                            format_checker=jsonschema.draft7_format_checker)
 
 
+# Tests for DownloadPolicy class
+class TestDownloadPolicy(object):
+    def test_valid(self, tmp_path, http_server):
+        http_server.responses['/file'] = [(200, b'foobar', 0)]
+        download_stats = DownloadPolicy().download(http_server.url('/file'), os.path.join(tmp_path, 'file.dat'))
+        assert open(os.path.join(tmp_path, 'file.dat'), 'rb').read() == b'foobar'
+        assert download_stats['url'] == http_server.url('/file')
+        assert download_stats['attempts'] == 1
+        assert download_stats['requests'] == 1
+        assert download_stats['hedged'] is False
+        assert download_stats['latency'] >= 0
+
+    def test_valid_retry(self, tmp_path, http_server, mock_msg_callback):
+        http_server.responses['/file'] = [(500, b'', 0), (429, b'', 0), (200, b'foobar', 0)]
+        download_stats = DownloadPolicy(backoff=0).download(http_server.url('/file'),
+                                                            os.path.join(tmp_path, 'file.dat'),
+                                                            msg_callback=mock_msg_callback)
+        assert open(os.path.join(tmp_path, 'file.dat'), 'rb').read() == b'foobar'
+        assert download_stats['attempts'] == 3
+        assert download_stats['requests'] == 3
+        assert mock_msg_callback.messages[0].startswith('Download failed, retrying in 0s: 500 Server Error')
+
+    def test_valid_hedged(self, tmp_path, http_server):
+        http_server.responses['/file'] = [(200, b'foobar1', 2), (200, b'foobar2', 0)]
+        download_policy = DownloadPolicy(hedge=True)
+        download_policy.latencies = [0.05] * 10
+        download_stats = download_policy.download(http_server.url('/file'), os.path.join(tmp_path, 'file.dat'),
+                                                  hedge=True)
+        assert open(os.path.join(tmp_path, 'file.dat'), 'rb').read() == b'foobar2'
+        assert download_stats['attempts'] == 1
+        assert download_stats['requests'] == 2
+        assert download_stats['hedged'] is True
+        assert download_stats['latency'] < 2
+
+    def test_valid_hedged_large_file(self, tmp_path, http_server):
+        http_server.responses['/file'] = [(200, b'foobar1', 0.2), (200, b'foobar2', 0)]
+        download_policy = DownloadPolicy(hedge=True)
+        download_policy.latencies = [0.05] * 10
+        download_stats = download_policy.download(http_server.url('/file'), os.path.join(tmp_path, 'file.dat'))
+        assert open(os.path.join(tmp_path, 'file.dat'), 'rb').read() == b'foobar1'
+        assert download_stats['hedged'] is False
+
+    def test_invalid_not_found(self, tmp_path, http_server):
+        with pytest.raises(RuntimeError):
+            DownloadPolicy(backoff=0).download(http_server.url('/file'), os.path.join(tmp_path, 'file.dat'))
+        assert len(http_server.requests) == 1
+
+    def test_invalid_retries_exhausted(self, tmp_path, http_server):
+        http_server.responses['/file'] = [(503, b'', 0)]
+        with pytest.raises(DownloadError) as error:
+            DownloadPolicy(retries=2, backoff=0).download(http_server.url('/file'),
+                                                          os.path.join(tmp_path, 'file.dat'))
+        assert len(http_server.requests) == 3
+        assert error.value.download_stats['url'] == http_server.url('/file')
+        assert error.value.download_stats['attempts'] == 3
+        assert error.value.download_stats['requests'] == 3
+        assert '503' in error.value.download_stats['error']
+
+    def test_invalid_timeout(self, tmp_path, http_server):
+        http_server.responses['/file'] = [(200, b'foobar', 1)]
+        start = time.monotonic()
+        with pytest.raises(RuntimeError):
+            DownloadPolicy(read_timeout=0.1, retries=1, backoff=0).download(http_server.url('/file'),
+                                                                            os.path.join(tmp_path, 'file.dat'))
+        assert time.monotonic() - start < 1
+        assert len(http_server.requests) == 2
+
+    def test_get_hedge_delay(self):
+        download_policy = DownloadPolicy()
+        assert download_policy.get_hedge_delay() == 1.0
+        download_policy.latencies = list(range(1, 101))
+        assert download_policy.get_hedge_delay() == 96
+
+
+# Tests for download_file method
+class TestDownloadFile(object):
+    def test_valid(self, tmp_path, http_server):
+        http_server.responses['/file'] = [(200, b'foobar', 0)]
+        download_stats = IcetrustCanaryUtils.download_file(http_server.url('/file'), tmp_path, 'file.dat')
+        assert open(os.path.join(tmp_path, 'file.dat'), 'rb').read() == b'foobar'
+        assert download_stats['attempts'] == 1
+
+    def test_invalid(self, tmp_path, http_server):
+        with pytest.raises(RuntimeError):
+            IcetrustCanaryUtils.download_file(http_server.url('/file'), tmp_path, 'file.dat',
+                                              download_policy=DownloadPolicy(retries=0))
+
+
 # Tests for extract_verification_data method
 class TestExtractVerificationData(object):
     def test_valid(self):
@@ -195,6 +331,304 @@ class TestGenerateJson(object):
         assert (json_parsed['output']) == ', '.join(cmd_output)
 
 
+# Tests for generate_output method
+class TestGenerateOutput(object):
+    def test_valid(self):
+        config_data = dict()
+        config_data['name'] = 'foobar1'
+        config_data['url'] = 'https://www.example.com'
+        config_data['filename_url'] = 'https://www.example.com/file.sh'
+        output_obj = IcetrustCanaryUtils.generate_output(config_data, VerificationModes.CHECKSUM, True, None,
+                                                         [], os.path.join(TEST_DIR, 'file1.txt'))
+
+        schema_data = json.load(open(CANARY_OUTPUT_SCHEMA, 'r'))
+        jsonschema.validators.validate(instance=output_obj, schema=schema_data,
+                                       format_checker=jsonschema.draft7_format_checker)
+        assert output_obj['verification_mode'] == VerificationModes.CHECKSUM.value[0]
+        assert output_obj['verified'] is True
+        assert 'previous_version_matched' not in output_obj
+
+    def test_valid_download_stats(self):
+        config_data = dict()
+        config_data['name'] = 'foobar1'
+        config_data['url'] = 'https://www.example.com'
+        config_data['filename_url'] = 'https://www.example.com/file.sh'
+        download_stats = [{'url': config_data['filename_url'], 'attempts': 2, 'requests': 2, 'hedged': False,
+                           'latency': 0.5}]
+        output_obj = IcetrustCanaryUtils.generate_output(config_data, VerificationModes.CHECKSUM, True, None,
+                                                         [], os.path.join(TEST_DIR, 'file1.txt'),
+                                                         download_stats=download_stats)
+
+        schema_data = json.load(open(CANARY_OUTPUT_SCHEMA, 'r'))
+        jsonschema.validators.validate(instance=output_obj, schema=schema_data,
+                                       format_checker=jsonschema.draft7_format_checker)
+        assert output_obj['downloads'] == download_stats
+
+
+# Tests for NdjsonWriter class
+class TestNdjsonWriter(object):
+    def test_valid(self, tmp_path):
+        output_file = os.path.join(tmp_path, 'output.ndjson')
+        with NdjsonWriter(output_file) as writer:
+            writer.write({'name': 'foobar1', 'verified': True})
+            writer.write({'name': 'foobar2', 'verified': False})
+
+        lines = open(output_file, 'r').read().splitlines()
+        assert lines == ['{"name":"foobar1","verified":true}', '{"name":"foobar2","verified":false}']
+
+    def test_valid_append(self, tmp_path):
+        output_file = os.path.join(tmp_path, 'output.ndjson')
+        for name in ['foobar1', 'foobar2']:
+            with NdjsonWriter(output_file) as writer:
+                writer.write({'name': name})
+
+        assert len(open(output_file, 'r').read().splitlines()) == 2
+
+    def test_valid_batch_flush(self, tmp_path):
+        output_file = os.path.join(tmp_path, 'output.ndjson')
+        writer = NdjsonWriter(output_file, batch_size=2)
+        writer.write({'name': 'foobar1'})
+        assert writer.pending == 1
+        writer.write({'name': 'foobar2'})
+        assert writer.pending == 0
+        assert len(open(output_file, 'r').read().splitlines()) == 2
+        writer.close()
+
+    def test_valid_stdout(self, capsys):
+        with NdjsonWriter('-') as writer:
+            writer.write({'name': 'foobar1'})
+        assert capsys.readouterr().out == '{"name":"foobar1"}\n'
+
+
+# Tests for FetchPlan class
+class TestFetchPlan(object):
+    def test_url_refs(self):
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'pgpchecksumfile_keyfile.json')), 'r'))
+        with FetchPlan([config, config]) as fetch_plan:
+            assert len(fetch_plan.url_refs) == 4
+            assert fetch_plan.url_refs[config['filename_url']] == 2
+
+    def test_fetch_reuse(self, tmp_path, mock_msg_callback):
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksum.json')), 'r'))
+        with FetchPlan([config, config]) as fetch_plan:
+            # Pretend the file was already downloaded
+            cached_path = os.path.join(fetch_plan.temp_dir_obj.name, 'cached.dat')
+            shutil.copyfile(os.path.join(TEST_DIR, 'file1.txt'), cached_path)
+            fetch_plan.downloads[config['filename_url']] = cached_path
+
+            fetch_plan.fetch(config['filename_url'], tmp_path, 'copy1.dat', msg_callback=mock_msg_callback)
+            assert os.path.exists(cached_path)
+            fetch_plan.fetch(config['filename_url'], tmp_path, 'copy2.dat', msg_callback=mock_msg_callback)
+            assert not os.path.exists(cached_path)
+
+        assert open(os.path.join(tmp_path, 'copy1.dat'), 'rb').read() ==\
+               open(os.path.join(TEST_DIR, 'file1.txt'), 'rb').read()
+        assert open(os.path.join(tmp_path, 'copy2.dat'), 'rb').read() ==\
+               open(os.path.join(TEST_DIR, 'file1.txt'), 'rb').read()
+        assert mock_msg_callback.messages == ['Reusing download: ' + config['filename_url']] * 2
+
+    @pytest.mark.slow
+    def test_import_key_material_reuse(self, tmp_path, mock_msg_callback):
+        shutil.copyfile(os.path.join(TEST_DIR, 'pgp_keys.txt'), os.path.join(tmp_path, FILENAME_KEYS))
+        verification_data = {'keyfile_url': 'https://www.example.com/keys.txt'}
+        with FetchPlan([]) as fetch_plan:
+            cmd_output1 = []
+            gpg1, import_result1 = fetch_plan.import_key_material(tmp_path, verification_data,
+                                                                  cmd_output=cmd_output1)
+            cmd_output2 = []
+            gpg2, import_result2 = fetch_plan.import_key_material(tmp_path, verification_data,
+                                                                  cmd_output=cmd_output2,
+                                                                  msg_callback=mock_msg_callback)
+            assert gpg1 is gpg2
+            assert import_result1 is True and import_result2 is True
+            assert cmd_output1 == cmd_output2
+            assert mock_msg_callback.messages == ['Reusing imported keys: https://www.example.com/keys.txt']
+
+    def test_import_key_material_key_cache(self, tmp_path, mock_msg_callback):
+        # The key server is unreachable, so the keys can only come from the cache
+        key_cache = KeyCache(os.path.join(tmp_path, 'cache'))
+        with open(os.path.join(TEST_DIR, 'pgp_keys.txt'), 'r') as keyfile:
+            key_cache.put('FBFCC82A015E7330', keyfile.read(), ['D1A66E1A23B182C9980F788CFBFCC82A015E7330'])
+        verification_data = {'keyid': 'FBFCC82A015E7330', 'keyserver': '127.0.0.1:1'}
+        with FetchPlan([], key_cache=key_cache) as fetch_plan:
+            gpg, import_result = fetch_plan.import_key_material(tmp_path, verification_data,
+                                                                msg_callback=mock_msg_callback)
+            assert import_result is True
+            assert mock_msg_callback.messages[0] == 'Using cached keys: FBFCC82A015E7330'
+
+    def test_pgp_verify_verification_cache(self, tmp_path, copy_keyring, mock_msg_callback):
+        verification_cache = VerificationCache(os.path.join(tmp_path, 'cache'))
+        gpg = IcetrustUtils.pgp_init(tmp_path)
+        with FetchPlan([], verification_cache=verification_cache) as fetch_plan:
+            assert fetch_plan.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                         os.path.join(TEST_DIR, 'file1.txt.sig')) is True
+            assert fetch_plan.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                         os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                         msg_callback=mock_msg_callback) is True
+            assert mock_msg_callback.messages == \
+                ['Using cached verification result, signed by: D1A66E1A23B182C9980F788CFBFCC82A015E7330']
+
+
+# Tests for canary_run method
+class TestCanaryRun(object):
+    @staticmethod
+    def _read(filename):
+        with open(os.path.join(TEST_DIR, filename), 'rb') as file:
+            return file.read()
+
+    def _get_pgpchecksumfile_config(self, http_server, file_delay=0, key_delay=0):
+        http_server.responses['/file1.txt'] = [(200, self._read('file1.txt'), file_delay)]
+        http_server.responses['/SHA256SUMS'] = [(200, self._read('file1.txt.SHA256SUMS'), 0)]
+        http_server.responses['/SHA256SUMS.sig'] = [(200, self._read('file1.txt.SHA256SUMS.sig'), 0)]
+        http_server.responses['/keys.txt'] = [(200, self._read('pgp_keys.txt'), key_delay)]
+        return {
+            'name': 'test',
+            'url': 'https://www.example.com',
+            'filename_url': http_server.url('/file1.txt'),
+            'pgpchecksumfile': {
+                'checksumfile_url': http_server.url('/SHA256SUMS'),
+                'signaturefile_url': http_server.url('/SHA256SUMS.sig'),
+                'keyfile_url': http_server.url('/keys.txt'),
+            },
+        }
+
+    def test_valid_pgpchecksumfile(self, http_server):
+        config_data = self._get_pgpchecksumfile_config(http_server)
+        output_objs = IcetrustCanaryUtils.canary_run(config_data)
+        assert len(output_objs) == 1
+        assert output_objs[0]['verified'] is True
+        assert output_objs[0]['checksum_value'] == FILE1_HASH
+        assert [download['url'] for download in output_objs[0]['downloads']][-1] == http_server.url('/file1.txt')
+
+    def test_messages_to_stderr(self, http_server, capsys):
+        output_objs = IcetrustCanaryUtils.canary_run(self._get_pgpchecksumfile_config(http_server), err=True)
+        assert output_objs[0]['verified'] is True
+        captured = capsys.readouterr()
+        assert captured.out == ''
+        assert captured.err == 'Using verification mode: PGPCHECKSUMFILE\nDownloading file: ' + \
+            http_server.url('/file1.txt') + '\n'
+
+    def test_invalid_pgpchecksumfile_wrong_file(self, http_server):
+        config_data = self._get_pgpchecksumfile_config(http_server)
+        http_server.responses['/file1.txt'] = [(200, self._read('file2.txt'), 0)]
+        output_objs = IcetrustCanaryUtils.canary_run(config_data)
+        assert output_objs[0]['verified'] is False
+        assert 'No match found in checksum file' in output_objs[0]['output']
+
+    def test_invalid_download_failed(self, http_server):
+        config_data = self._get_pgpchecksumfile_config(http_server)
+        http_server.responses['/file1.txt'] = [(503, b'', 0)]
+        with FetchPlan([config_data], download_policy=DownloadPolicy(retries=1, backoff=0)) as fetch_plan:
+            output_objs = IcetrustCanaryUtils.canary_run(config_data, fetch_plan=fetch_plan)
+        assert output_objs[0]['verified'] is False
+        assert output_objs[0]['output'].startswith('ERROR: Error while fetching file')
+        assert output_objs[0]['downloads'][-1]['url'] == http_server.url('/file1.txt')
+        assert output_objs[0]['downloads'][-1]['attempts'] == 2
+        assert '503' in output_objs[0]['downloads'][-1]['error']
+        # The test server URLs are http, so only the download statistics are validated
+        schema_data = json.load(open(CANARY_OUTPUT_SCHEMA, 'r'))
+        jsonschema.validators.validate(instance=output_objs[0]['downloads'],
+                                       schema=schema_data['properties']['downloads'])
+
+    def test_valid_pgpchecksumfile_overlapped(self, http_server):
+        # The file is downloaded while the keys are downloaded and imported
+        config_data = self._get_pgpchecksumfile_config(http_server, file_delay=0.5, key_delay=0.5)
+        start_time = time.monotonic()
+        with FetchPlan([config_data], host_limiter=HostLimiter(max_rate=0)) as fetch_plan:
+            output_objs = IcetrustCanaryUtils.canary_run(config_data, fetch_plan=fetch_plan)
+        assert output_objs[0]['verified'] is True
+        assert time.monotonic() - start_time < 0.95
+
+
+# Tests for HostLimiter class
+class TestHostLimiter(object):
+    def test_valid_concurrency(self):
+        host_limiter = HostLimiter(max_concurrent=2, max_rate=0)
+        lock = threading.Lock()
+        counts = {'current': 0, 'max': 0}
+
+        def fake_download(url):
+            with host_limiter.limit(url):
+                with lock:
+                    counts['current'] += 1
+                    counts['max'] = max(counts['max'], counts['current'])
+                time.sleep(0.01)
+                with lock:
+                    counts['current'] -= 1
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(fake_download, ['https://www.example.com/file' + str(i) for i in range(16)]))
+        assert counts['max'] == 2
+
+    def test_valid_rate(self):
+        host_limiter = HostLimiter(max_concurrent=4, max_rate=50)
+        start = time.monotonic()
+        for i in range(6):
+            with host_limiter.limit('https://www.example.com/file' + str(i)):
+                pass
+        assert time.monotonic() - start >= 0.09
+
+    def test_valid_rate_separate_hosts(self):
+        host_limiter = HostLimiter(max_concurrent=4, max_rate=1)
+        start = time.monotonic()
+        for i in range(4):
+            with host_limiter.limit('https://www' + str(i) + '.example.com/file'):
+                pass
+        assert time.monotonic() - start < 0.5
+
+
+# Tests for get_download_urls method
+class TestGetDownloadUrls(object):
+    def test_valid(self):
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksum.json')), 'r'))
+        assert IcetrustCanaryUtils.get_download_urls(config) == [config['filename_url']]
+
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'pgpchecksumfile_keyfile.json')), 'r'))
+        assert IcetrustCanaryUtils.get_download_urls(config) == [
+            config['filename_url'],
+            config['pgpchecksumfile']['checksumfile_url'],
+            config['pgpchecksumfile']['signaturefile_url'],
+            config['pgpchecksumfile']['keyfile_url'],
+        ]
+
+    def test_valid_multiple(self):
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksumfile_multiple.json')), 'r'))
+        assert IcetrustCanaryUtils.get_download_urls(config) ==\
+               config['filename_urls'] + [config['checksumfile']['checksumfile_url']]
+
+    def test_invalid(self):
+        assert IcetrustCanaryUtils.get_download_urls(dict()) == []
+
+
+# Tests for get_filename_urls method
+class TestGetFilenameUrls(object):
+    def test_valid_single(self):
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksumfile.json')), 'r'))
+        assert IcetrustCanaryUtils.get_filename_urls(config) == [config['filename_url']]
+
+    def test_valid_multiple(self):
+        config = IcetrustCanaryUtils.validate_config_file(
+            open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksumfile_multiple.json')), 'r'))
+        assert IcetrustCanaryUtils.get_filename_urls(config) == config['filename_urls']
+
+
+# Tests for get_key_source method
+class TestGetKeySource(object):
+    def test_valid_keyfile(self):
+        assert IcetrustCanaryUtils.get_key_source({'keyfile_url': 'https://www.example.com/keys.txt'}) ==\
+               'https://www.example.com/keys.txt'
+
+    def test_valid_keyid(self):
+        assert IcetrustCanaryUtils.get_key_source({'keyid': 'foobar', 'keyserver': 'keyserver.example.com'}) ==\
+               ('foobar', 'keyserver.example.com')
+
+
 # Tests for get_verification_mode method
 class TestGetVerificationMode(object):
     def test_valid(self):
@@ -257,6 +691,22 @@ class TestGetAlgorithm(object):
         assert mock_msg_callback.messages[0] == "Using algorithm: sha256"
 
 
+# Tests for sort_by_priority method
+class TestSortByPriority(object):
+    def test_valid(self):
+        configs = [{'name': 'foobar1'}, {'name': 'foobar2', 'priority': 10}, {'name': 'foobar3', 'priority': -1},
+                   {'name': 'foobar4'}]
+        assert [config['name'] for config in IcetrustCanaryUtils.sort_by_priority(configs)] ==\
+               ['foobar2', 'foobar1', 'foobar4', 'foobar3']
+
+    def test_valid_deadline(self):
+        configs = [{'name': 'foobar1'}, {'name': 'foobar2', 'deadline': 60}, {'name': 'foobar3', 'deadline': 0.5},
+                   {'name': 'foobar4', 'priority': 1, 'deadline': 120},
+                   {'name': 'foobar5', 'priority': -1, 'deadline': 0}]
+        assert [config['name'] for config in IcetrustCanaryUtils.sort_by_priority(configs)] ==\
+               ['foobar4', 'foobar3', 'foobar2', 'foobar1', 'foobar5']
+
+
 # Tests for validate_config_file method
 class TestValidateConfigFile(object):
     def test_valid(self):
@@ -292,3 +742,46 @@ class TestValidateConfigFile(object):
         assert len(mock_msg_callback.messages) == 2
         assert mock_msg_callback.messages[0] == "Config file is not properly formatted!"
         assert mock_msg_callback.messages[1] == "'compare_files' is a required property"
+
+    def test_invalid_json(self, mock_msg_callback):
+        assert IcetrustCanaryUtils.validate_config_file(StringIO('{"name": '), msg_callback=mock_msg_callback) is None
+        assert mock_msg_callback.messages[0] == "Config file is not valid JSON!"
+
+    def test_valid_scheduling(self):
+        config_data = json.load(open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksum.json')), 'r'))
+        config_data.update({'priority': 5, 'deadline': 30})
+        assert IcetrustCanaryUtils.validate_config_file(StringIO(json.dumps(config_data))) is not None
+
+    def test_invalid_deadline(self):
+        config_data = json.load(open(os.path.join(TEST_DIR, os.path.join('canary_input', 'checksum.json')), 'r'))
+        config_data['deadline'] = -1
+        assert IcetrustCanaryUtils.validate_config_file(StringIO(json.dumps(config_data))) is None
+
+
+# Tests for validate_config and validate_config_files methods
+class TestValidateConfigs(object):
+    def test_validate_config(self):
+        config_data = json.load(open(os.path.join(TEST_DIR, 'canary_input', 'checksum.json'), 'r'))
+        assert IcetrustCanaryUtils.validate_config(config_data) is config_data
+        assert IcetrustCanaryUtils.validate_config(dict()) is None
+
+    def test_validate_config_files(self, mock_msg_callback):
+        configs = IcetrustCanaryUtils.validate_config_files([
+            open(os.path.join(TEST_DIR, 'canary_input', 'checksum.json'), 'r'),
+            open(os.path.join(TEST_DIR, 'canary_output', 'compare.json'), 'r'),
+            open(os.path.join(TEST_DIR, 'canary_input', 'pgp_keyid_multiple.json'), 'r')],
+            msg_callback=mock_msg_callback)
+        assert [config_data is not None for config_data in configs] == [True, False, True]
+        assert configs[0]['name'] == json.load(open(os.path.join(TEST_DIR, 'canary_input', 'checksum.json')))['name']
+        assert mock_msg_callback.messages == ["Config file is not properly formatted!",
+                                              "'compare_files' is a required property"]
+
+    def test_validate_config_files_many(self):
+        config_text = open(os.path.join(TEST_DIR, 'canary_input', 'pgpchecksumfile_keyid.json'), 'r').read()
+        IcetrustCanaryUtils.validate_config_files([StringIO(config_text)])
+
+        # The schema is only loaded and compiled once, so validating many configs is fast
+        start_time = time.monotonic()
+        configs = IcetrustCanaryUtils.validate_config_files([StringIO(config_text) for _ in range(1000)])
+        assert time.monotonic() - start_time < 1.0
+        assert None not in configs
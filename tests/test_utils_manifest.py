@@ -0,0 +1,186 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import hashlib, os, shutil
+
+import pytest
+
+from icetrust.utils import IcetrustUtils
+from icetrust.utils_manifest import IcetrustManifestUtils, MANIFEST_FORMAT_BSD
+from test_utils import FILE1_HASH, FILE2_HASH, TEST_DIR
+
+
+# Tests for IcetrustManifestUtils.find_files()
+class TestFindFiles(object):
+    def test_find_files(self, manifest_dir):
+        assert IcetrustManifestUtils.find_files(str(manifest_dir)) == ['file1.txt', 'sub/file2.txt']
+
+    def test_exclude(self, manifest_dir):
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir),
+                                                    exclude=[str(manifest_dir / 'sub' / 'file2.txt')])
+        assert relpaths == ['file1.txt']
+
+    def test_symlinks_skipped(self, manifest_dir):
+        os.symlink(str(manifest_dir / 'file1.txt'), str(manifest_dir / 'link.txt'))
+        assert IcetrustManifestUtils.find_files(str(manifest_dir)) == ['file1.txt', 'sub/file2.txt']
+
+
+# Tests for IcetrustManifestUtils.format_line()
+class TestFormatLine(object):
+    def test_gnu(self):
+        assert IcetrustManifestUtils.format_line('file1.txt', FILE1_HASH, 'sha256') == \
+            FILE1_HASH + '  file1.txt'
+
+    def test_bsd(self):
+        assert IcetrustManifestUtils.format_line('file1.txt', FILE1_HASH, 'sha256', MANIFEST_FORMAT_BSD) == \
+            'SHA256 (file1.txt) = ' + FILE1_HASH
+
+    def test_escaped(self):
+        assert IcetrustManifestUtils.format_line('a\\b\nc', FILE1_HASH, 'sha256') == \
+            '\\' + FILE1_HASH + '  a\\\\b\\nc'
+        assert IcetrustManifestUtils.format_line('a\\b', FILE1_HASH, 'sha1', MANIFEST_FORMAT_BSD) == \
+            '\\SHA1 (a\\\\b) = ' + FILE1_HASH
+
+
+# Tests for IcetrustManifestUtils.hash_files()
+class TestHashFiles(object):
+    def test_hash_files(self, manifest_dir):
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir))
+        hashes, state, hashed_count = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths,
+                                                                       ['sha256', 'sha1'], max_workers=1)
+        assert hashed_count == 2
+        assert hashes['file1.txt']['sha256'] == FILE1_HASH
+        assert hashes['sub/file2.txt']['sha256'] == FILE2_HASH
+        with open(os.path.join(TEST_DIR, 'file1.txt'), 'rb') as file:
+            assert hashes['file1.txt']['sha1'] == hashlib.sha1(file.read()).hexdigest()
+        assert state['files']['file1.txt']['size'] == os.path.getsize(os.path.join(TEST_DIR, 'file1.txt'))
+
+    def test_process_pool(self, tmp_path):
+        for index in range(50):
+            (tmp_path / ('file' + str(index))).write_bytes(os.urandom(index * 1000))
+        relpaths = IcetrustManifestUtils.find_files(str(tmp_path))
+        hashes, _, hashed_count = IcetrustManifestUtils.hash_files(str(tmp_path), relpaths, ['sha512'],
+                                                                   max_workers=4)
+        assert hashed_count == 50
+        for relpath in relpaths:
+            assert hashes[relpath]['sha512'] == hashlib.sha512((tmp_path / relpath).read_bytes()).hexdigest()
+
+    def test_unchanged_files_skipped(self, manifest_dir):
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir))
+        _, state, _ = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256'], max_workers=1)
+        hashes, state, hashed_count = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256'],
+                                                                       max_workers=1, state=state)
+        assert hashed_count == 0
+        assert hashes['file1.txt']['sha256'] == FILE1_HASH
+
+        # Changed files and new algorithms need hashing
+        (manifest_dir / 'file1.txt').write_bytes(b'changed')
+        hashes, state, hashed_count = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256'],
+                                                                       max_workers=1, state=state)
+        assert hashed_count == 1
+        assert hashes['file1.txt']['sha256'] == hashlib.sha256(b'changed').hexdigest()
+        _, _, hashed_count = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256', 'sha1'],
+                                                              max_workers=1, state=state)
+        assert hashed_count == 2
+
+    def test_state_of_other_directory(self, manifest_dir, tmp_path_factory):
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir))
+        _, state, _ = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256'], max_workers=1)
+        other_dir = tmp_path_factory.mktemp('other')
+        shutil.copytree(str(manifest_dir), str(other_dir / 'copy'))
+        _, _, hashed_count = IcetrustManifestUtils.hash_files(str(other_dir / 'copy'), relpaths, ['sha256'],
+                                                              max_workers=1, state=state)
+        assert hashed_count == 2
+
+    def test_missing_file(self, manifest_dir):
+        with pytest.raises(OSError):
+            IcetrustManifestUtils.hash_files(str(manifest_dir), ['foobar'], ['sha256'], max_workers=1)
+
+
+# Tests for IcetrustManifestUtils.load_state() and IcetrustManifestUtils.save_state()
+class TestState(object):
+    def test_save_and_load(self, manifest_dir, tmp_path_factory):
+        state_file = str(tmp_path_factory.mktemp('state') / 'state.json')
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir))
+        _, state, _ = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256'], max_workers=1)
+        IcetrustManifestUtils.save_state(state_file, state)
+        assert IcetrustManifestUtils.load_state(state_file) == state
+
+    def test_invalid(self, tmp_path):
+        assert IcetrustManifestUtils.load_state(str(tmp_path / 'foobar')) is None
+        (tmp_path / 'state.json').write_text('{')
+        assert IcetrustManifestUtils.load_state(str(tmp_path / 'state.json')) is None
+        (tmp_path / 'state.json').write_text('{"version": 0, "files": {}}')
+        assert IcetrustManifestUtils.load_state(str(tmp_path / 'state.json')) is None
+
+
+# Tests for IcetrustManifestUtils.write_manifests()
+class TestWriteManifests(object):
+    def test_write_manifests(self, manifest_dir, tmp_path_factory):
+        output_dir = tmp_path_factory.mktemp('output')
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir))
+        hashes, _, _ = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256', 'sha1'],
+                                                        max_workers=1)
+        manifest_files = IcetrustManifestUtils.write_manifests(str(output_dir), hashes, ['sha256', 'sha1'])
+        assert manifest_files == [str(output_dir / 'SHA256SUMS'), str(output_dir / 'SHA1SUMS')]
+        assert (output_dir / 'SHA256SUMS').read_text() == \
+            FILE1_HASH + '  file1.txt\n' + FILE2_HASH + '  sub/file2.txt\n'
+        assert sorted(os.listdir(str(output_dir))) == ['SHA1SUMS', 'SHA256SUMS']
+
+    def test_write_manifests_directory(self, manifest_dir, tmp_path_factory):
+        output_dir = tmp_path_factory.mktemp('output')
+        relpaths = IcetrustManifestUtils.find_files(str(manifest_dir))
+        hashes, _, _ = IcetrustManifestUtils.hash_files(str(manifest_dir), relpaths, ['sha256'], max_workers=1)
+        IcetrustManifestUtils.write_manifests(str(output_dir), hashes, ['sha256'], directory=str(manifest_dir))
+        assert (output_dir / 'SHA256SUMS').read_text() == \
+            FILE1_HASH + '  ../' + manifest_dir.name + '/file1.txt\n' + \
+            FILE2_HASH + '  ../' + manifest_dir.name + '/sub/file2.txt\n'
+
+        # Paths stay as they are when the manifests are written to the same directory
+        IcetrustManifestUtils.write_manifests(str(manifest_dir), hashes, ['sha256'], directory=str(manifest_dir))
+        assert (manifest_dir / 'SHA256SUMS').read_text() == \
+            FILE1_HASH + '  file1.txt\n' + FILE2_HASH + '  sub/file2.txt\n'
+
+
+# Tests for IcetrustUtils.pgp_sign()
+class TestPgpSign(object):
+    def test_sign(self, signing_home, manifest_dir):
+        gpg_home_dir, fingerprint = signing_home
+        gpg = IcetrustUtils.pgp_init(gpg_home_dir=gpg_home_dir)
+        signaturefile = str(manifest_dir / 'file1.txt.asc')
+        assert IcetrustUtils.pgp_sign(gpg, str(manifest_dir / 'file1.txt'), signaturefile, keyid=fingerprint)
+        assert IcetrustUtils.pgp_verify(gpg, str(manifest_dir / 'file1.txt'), signaturefile)
+
+        # Existing signatures are replaced
+        assert IcetrustUtils.pgp_sign(gpg, str(manifest_dir / 'sub' / 'file2.txt'), signaturefile)
+        assert IcetrustUtils.pgp_verify(gpg, str(manifest_dir / 'sub' / 'file2.txt'), signaturefile)
+
+    def test_sign_unknown_key(self, signing_home, manifest_dir):
+        gpg = IcetrustUtils.pgp_init(gpg_home_dir=signing_home[0])
+        signaturefile = str(manifest_dir / 'file1.txt.asc')
+        assert not IcetrustUtils.pgp_sign(gpg, str(manifest_dir / 'file1.txt'), signaturefile, keyid='DEADBEEF')
+        assert not os.path.exists(signaturefile)
+
+    def test_sign_no_key(self, manifest_dir):
+        gpg = IcetrustUtils.pgp_init()
+        assert not IcetrustUtils.pgp_sign(gpg, str(manifest_dir / 'file1.txt'), str(manifest_dir / 'file1.txt.asc'))
@@ -0,0 +1,343 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from pathlib import Path
+import os
+
+import pytest
+
+from icetrust.utils import BACKEND_PGPY, GpgContext, IcetrustUtils
+from test_utils import export_test_keys, TEST_DIR
+
+pgpy = pytest.importorskip('pgpy')
+from icetrust.utils_pgpy import PgpyGPG
+
+# Fingerprints of the keys used in tests
+RSA_FINGERPRINT = 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+ED25519_FINGERPRINT = '1E1943F158798768C6D36007B73EC04F30C74795'
+REVOKED_FINGERPRINT = 'AE69AEDA312688CB0138552EFBC602A24E7CEC41'
+
+
+def read_test_file(filename):
+    return Path(os.path.join(TEST_DIR, filename)).read_text()
+
+
+def verify(gpg, filename, signaturefile):
+    with open(os.path.join(TEST_DIR, signaturefile), 'rb') as signature:
+        return gpg.verify_file(signature, os.path.join(TEST_DIR, filename), close_file=False)
+
+
+# Tests for PgpyGPG.import_keys()
+class TestPgpyImportKeys(object):
+    def test_valid(self):
+        gpg = PgpyGPG()
+        import_result = gpg.import_keys(read_test_file('pgp_keys.txt'))
+        assert import_result.imported == 1
+        assert import_result.unchanged == 0
+        assert import_result.fingerprints == [RSA_FINGERPRINT]
+        assert 'pgpy: key FBFCC82A015E7330: "Bob Babbage <bob@openpgp.example>" imported' in import_result.stderr
+
+    def test_valid_unchanged(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        import_result = gpg.import_keys(read_test_file('pgp_keys.txt'))
+        assert import_result.imported == 0
+        assert import_result.unchanged == 1
+        assert import_result.fingerprints == [RSA_FINGERPRINT]
+
+    def test_valid_binary(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        binary_keys = bytes(gpg.keys[RSA_FINGERPRINT])
+        assert PgpyGPG().import_keys(binary_keys).fingerprints == [RSA_FINGERPRINT]
+
+    def test_invalid(self):
+        import_result = PgpyGPG().import_keys(read_test_file('file1.txt'))
+        assert import_result.imported == 0
+        assert import_result.fingerprints == []
+        assert 'no valid OpenPGP data found' in import_result.stderr
+
+    def test_invalid_empty(self):
+        assert PgpyGPG().import_keys('').imported == 0
+
+
+# Tests for PgpyGPG.verify_file()
+class TestPgpyVerifyFile(object):
+    def test_valid_rsa(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.sig')
+        assert verification_result.status == 'signature valid'
+        assert bool(verification_result) is True
+        assert verification_result.pubkey_fingerprint == RSA_FINGERPRINT
+        assert verification_result.username == 'Bob Babbage <bob@openpgp.example>'
+
+    def test_valid_ed25519(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_ed25519.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.ed25519.sig')
+        assert verification_result.status == 'signature valid'
+        assert verification_result.fingerprint == ED25519_FINGERPRINT
+
+    def test_valid_checksums(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        assert verify(gpg, 'file1.txt.SHA256SUMS', 'file1.txt.SHA256SUMS.sig').status == 'signature valid'
+
+    def test_valid_path(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        assert gpg.verify_file(os.path.join(TEST_DIR, 'file1.txt.sig'),
+                               os.path.join(TEST_DIR, 'file1.txt')).status == 'signature valid'
+
+    def test_invalid_wrong_file(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        verification_result = verify(gpg, 'file2.txt', 'file1.txt.sig')
+        assert verification_result.status == 'signature bad'
+        assert bool(verification_result) is False
+
+    def test_invalid_no_public_key(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_ed25519.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.sig')
+        assert verification_result.status == 'no public key'
+        assert verification_result.key_id == 'FBFCC82A015E7330'
+
+    def test_invalid_revoked(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_revoked.txt'))
+        assert verify(gpg, 'file1.txt', 'file1.txt.revoked.sig').status == 'signing key was revoked'
+
+    def test_invalid_subkey_revoked(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_subkey_revoked.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.subkey_revoked.sig')
+        assert verification_result.status == 'signing key was revoked'
+        assert bool(verification_result) is False
+
+    def test_invalid_subkey_expired(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_subkey_expired.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.subkey_expired.sig')
+        assert verification_result.status == 'signing key has expired'
+        assert bool(verification_result) is False
+
+    def test_invalid_subkey_not_signing(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_subkey_unusable.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.subkey_unusable.sig')
+        assert verification_result.status == 'signature error'
+        assert 'is not usable for signing' in verification_result.stderr
+
+    def test_invalid_subkey_not_bound(self):
+        key, _ = pgpy.PGPKey.from_blob(read_test_file('pgp_keys_subkey_unusable.txt'))
+        for subkey in key.subkeys.values():
+            subkey._signatures.clear()
+        gpg = PgpyGPG()
+        gpg.import_keys(str(key))
+        verification_result = verify(gpg, 'file1.txt', 'file1.txt.subkey_unusable.sig')
+        assert verification_result.status == 'no public key'
+        assert 'has no valid binding signature' in verification_result.stderr
+
+    def test_invalid_signature(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        verification_result = verify(gpg, 'file1.txt', 'file2.txt')
+        assert verification_result.status is None
+        assert 'no valid OpenPGP data found' in verification_result.stderr
+
+    def test_invalid_file_doesnt_exist(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        assert verify(gpg, 'foobar', 'file1.txt.sig').status == 'signature error'
+
+
+# Tests for PgpyGPG.verify_stream()
+class TestPgpyVerifyStream(object):
+    def test_valid_bytes(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        verification_result = gpg.verify_stream(Path(TEST_DIR, 'file1.txt.sig').read_bytes(),
+                                                Path(TEST_DIR, 'file1.txt').read_bytes())
+        assert verification_result.status == 'signature valid'
+        assert verification_result.pubkey_fingerprint == RSA_FINGERPRINT
+
+    def test_valid_stream(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        with open(os.path.join(TEST_DIR, 'file1.txt'), 'rb') as data:
+            assert gpg.verify_stream(Path(TEST_DIR, 'file1.txt.sig').read_bytes(), data).status == 'signature valid'
+
+    def test_invalid_wrong_data(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        assert gpg.verify_stream(Path(TEST_DIR, 'file1.txt.sig').read_bytes(),
+                                 Path(TEST_DIR, 'file2.txt').read_bytes()).status == 'signature bad'
+
+
+# Tests for other PgpyGPG methods
+class TestPgpyGPG(object):
+    def test_invalid_home(self):
+        with pytest.raises(ValueError):
+            PgpyGPG(gnupghome='foobar')
+
+    def test_persistent_home(self, tmp_path):
+        PgpyGPG(gnupghome=tmp_path).import_keys(read_test_file('pgp_keys.txt'))
+        assert os.listdir(tmp_path) == [RSA_FINGERPRINT + '.asc']
+
+        gpg = PgpyGPG(gnupghome=tmp_path)
+        assert verify(gpg, 'file1.txt', 'file1.txt.sig').status == 'signature valid'
+        assert gpg.import_keys(read_test_file('pgp_keys.txt')).unchanged == 1
+
+    def test_keyring(self):
+        gpg = PgpyGPG(keyring=os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt'))
+        assert verify(gpg, 'file1.txt', 'file1.txt.ed25519.sig').status == 'signature valid'
+
+    def test_invalid_keyring(self):
+        with pytest.raises(ValueError):
+            PgpyGPG(keyring=os.path.join(TEST_DIR, 'file1.txt'))
+
+    def test_list_keys(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        gpg.import_keys(read_test_file('pgp_keys_revoked.txt'))
+        assert len(gpg.list_keys()) == 2
+        assert gpg.list_keys(secret=True) == []
+
+        key = gpg.list_keys(keys=['FBFCC82A015E7330'])[0]
+        assert key['fingerprint'] == RSA_FINGERPRINT
+        assert key['keyid'] == 'FBFCC82A015E7330'
+        assert key['trust'] == '-'
+        assert key['expires'] == ''
+        assert key['uids'] == ['Bob Babbage <bob@openpgp.example>']
+        assert gpg.list_keys(keys=REVOKED_FINGERPRINT)[0]['trust'] == 'r'
+        assert gpg.list_keys(keys=['7C2FAA4DF93C37B2'])[0]['fingerprint'] == RSA_FINGERPRINT
+        assert gpg.list_keys(keys=['foobar']) == []
+
+    def test_list_keys_subkeys(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys_subkey_revoked.txt'))
+        gpg.import_keys(read_test_file('pgp_keys_subkey_expired.txt'))
+        assert gpg.list_keys(keys='20405F4918B38A7C')[0]['subkey_info']['20405F4918B38A7C']['trust'] == 'r'
+        subkey_info = gpg.list_keys(keys='63173267F0F087F4')[0]['subkey_info']['63173267F0F087F4']
+        assert subkey_info['trust'] == 'e'
+        assert subkey_info['expires'] == '1577923200'
+
+    def test_scan_keys(self):
+        gpg = PgpyGPG()
+        assert [key['fingerprint'] for key in gpg.scan_keys(os.path.join(TEST_DIR, 'pgp_keys.txt'))] == \
+            [RSA_FINGERPRINT]
+        assert gpg.scan_keys(os.path.join(TEST_DIR, 'file1.txt')) == []
+        assert gpg.list_keys() == []
+
+    def test_import_keys_file(self):
+        gpg = PgpyGPG()
+        assert gpg.import_keys_file(os.path.join(TEST_DIR, 'pgp_keys.txt')).imported == 1
+
+    def test_pgp_import_keys_already_present(self, mock_msg_callback):
+        gpg = PgpyGPG(keyring=os.path.join(TEST_DIR, 'pgp_keys.txt'))
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'),
+                                             msg_callback=mock_msg_callback) is True
+        assert mock_msg_callback.messages[0] == '--- Results of key import ---\n'
+
+    def test_export_keys(self):
+        gpg = PgpyGPG()
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        exported_keys = gpg.export_keys([RSA_FINGERPRINT])
+        assert '-----BEGIN PGP PUBLIC KEY BLOCK-----' in exported_keys
+        assert PgpyGPG().import_keys(exported_keys).fingerprints == [RSA_FINGERPRINT]
+        assert gpg.export_keys('foobar') == ''
+
+    def test_recv_keys(self, http_server):
+        http_server.responses['/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'] = \
+            [(200, read_test_file('pgp_keys.txt').encode('utf-8'), 0)]
+        gpg = PgpyGPG()
+        import_result = gpg.recv_keys(http_server.url(''), 'FBFCC82A015E7330')
+        assert import_result.imported == 1
+        assert import_result.fingerprints == [RSA_FINGERPRINT]
+
+    def test_recv_keys_other_keys(self, http_server):
+        http_server.responses['/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'] = \
+            [(200, export_test_keys('pgp_keys.txt', 'pgp_keys_ed25519.txt'), 0)]
+        gpg = PgpyGPG()
+        assert gpg.recv_keys(http_server.url(''), 'FBFCC82A015E7330').fingerprints == [RSA_FINGERPRINT]
+        assert [key['fingerprint'] for key in gpg.list_keys()] == [RSA_FINGERPRINT]
+
+    def test_recv_keys_wrong_key(self, http_server):
+        http_server.responses['/pks/lookup?op=get&options=mr&search=0xFBFCC82A015E7330'] = \
+            [(200, read_test_file('pgp_keys_ed25519.txt').encode('utf-8'), 0)]
+        import_result = PgpyGPG().recv_keys(http_server.url(''), 'FBFCC82A015E7330')
+        assert import_result.imported == 0
+        assert 'not found in response' in import_result.stderr
+
+    def test_recv_keys_not_found(self, http_server):
+        import_result = PgpyGPG().recv_keys(http_server.url(''), 'FBFCC82A015E7330')
+        assert import_result.imported == 0
+        assert 'keyserver receive failed' in import_result.stderr
+
+    def test_recv_keys_unsupported_keyserver(self):
+        import_result = PgpyGPG().recv_keys('ftp://keys.example.com', 'FBFCC82A015E7330')
+        assert import_result.imported == 0
+        assert 'Unsupported key server' in import_result.stderr
+
+
+# Tests for using the pgpy backend via IcetrustUtils and GpgContext
+class TestPgpyBackend(object):
+    def test_pgp_init(self):
+        assert type(IcetrustUtils.pgp_init(backend=BACKEND_PGPY)) is PgpyGPG
+
+    def test_pgp_init_invalid_backend(self):
+        with pytest.raises(ValueError):
+            IcetrustUtils.pgp_init(backend='foobar')
+
+    def test_pgp_import_keys_and_verify(self, mock_msg_callback):
+        gpg = IcetrustUtils.pgp_init(backend=BACKEND_PGPY)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file1.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                        msg_callback=mock_msg_callback) is True
+        assert mock_msg_callback.messages[0] == '\n--- Results of verification ---'
+        assert IcetrustUtils.pgp_verify(gpg, os.path.join(TEST_DIR, 'file2.txt'),
+                                        os.path.join(TEST_DIR, 'file1.txt.sig')) is False
+
+    def test_pgp_verify_stream(self):
+        gpg = IcetrustUtils.pgp_init(backend=BACKEND_PGPY)
+        assert IcetrustUtils.pgp_import_keys(gpg, keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+        with open(os.path.join(TEST_DIR, 'file1.txt.sig'), 'rb') as signature:
+            assert IcetrustUtils.pgp_verify_stream(gpg, Path(TEST_DIR, 'file1.txt').read_bytes(), signature) is True
+
+    def test_pgp_check_keys(self):
+        gpg = IcetrustUtils.pgp_init(backend=BACKEND_PGPY)
+        gpg.import_keys(read_test_file('pgp_keys.txt'))
+        gpg.import_keys(read_test_file('pgp_keys_revoked.txt'))
+        assert IcetrustUtils.pgp_check_keys(gpg, [RSA_FINGERPRINT]) == (True, None)
+        assert IcetrustUtils.pgp_check_keys(gpg, [REVOKED_FINGERPRINT]) == (False, None)
+
+    def test_verify_batch(self):
+        with GpgContext(backend=BACKEND_PGPY) as gpg_context:
+            assert gpg_context.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+            results = list(gpg_context.verify_batch([
+                (os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig')),
+                (os.path.join(TEST_DIR, 'file2.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))]))
+            assert sorted(result for _, _, result, _ in results) == [False, True]
@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json, os, shutil, socket, stat, time
+
+import pytest
+
+from icetrust.utils_server import IcetrustClient, IcetrustServer
+from test_utils import FILE1_HASH, start_server, TEST_DIR
+
+
+# Tests for IcetrustServer and IcetrustClient classes
+class TestIcetrustServer(object):
+    def test_socket_permissions(self, server, socket_path):
+        assert stat.S_ISSOCK(os.stat(socket_path).st_mode)
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+    def test_ping(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            assert client.request('ping') == {'id': 1, 'verified': True, 'messages': []}
+
+    def test_invalid_command(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            response = client.request('foobar')
+        assert response['verified'] is False
+        assert response['error'] == 'Unknown command: foobar'
+
+    def test_invalid_arguments(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            response = client.request('checksum', filename=os.path.join(TEST_DIR, 'file1.txt'))
+        assert response['verified'] is False
+        assert response['error'] == "Invalid request: 'checksum_value'"
+
+    def test_invalid_json(self, server, socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+            client_socket.connect(socket_path)
+            client_socket.sendall(b'{"command": \n')
+            response = json.loads(client_socket.makefile('rb').readline())
+        assert response['id'] is None
+        assert response['error'].startswith('Invalid request')
+
+    def test_checksum(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            assert client.request('checksum', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                  checksum_value=FILE1_HASH)['verified'] is True
+            assert client.request('checksum', filename=os.path.join(TEST_DIR, 'file2.txt'),
+                                  checksum_value=FILE1_HASH)['verified'] is False
+            assert client.request('checksumfile', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                  checksumfile=os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'))['verified'] is True
+
+    def test_checksum_rewritten_file(self, server, socket_path, tmp_path):
+        filename = str(tmp_path / 'file1.txt')
+        shutil.copy(os.path.join(TEST_DIR, 'file1.txt'), filename)
+        with IcetrustClient(socket_path) as client:
+            assert client.request('checksum', filename=filename, checksum_value=FILE1_HASH)['verified'] is True
+
+            # Same size and modification time, the cached hash of the old contents must not be used
+            file_stat = os.stat(filename)
+            time.sleep(0.01)
+            with open(filename, 'r+b') as file:
+                file.write(b'X')
+            os.utime(filename, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+            assert client.request('checksum', filename=filename, checksum_value=FILE1_HASH)['verified'] is False
+
+    def test_checksum_verbose(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            response = client.request('checksum', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                      checksum_value=FILE1_HASH, verbose=True)
+        assert response['messages'] == ['Algorithm: sha256', 'File hash: ' + FILE1_HASH]
+
+    def test_checksum_missing_file(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            response = client.request('checksum', filename=os.path.join(TEST_DIR, 'foobar'),
+                                      checksum_value=FILE1_HASH, verbose=True)
+        assert response['verified'] is False
+        assert 'No such file or directory' in response['messages'][0]
+
+    def test_pgp(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            assert client.request('pgp', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                  signaturefile=os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                  keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'))['verified'] is True
+            assert client.request('pgpchecksumfile', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                  checksumfile=os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                  signaturefile=os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'),
+                                  keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'))['verified'] is True
+        assert len(server.gpg_contexts) == 1
+
+    def test_pgp_keys_not_shared(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            assert client.request('pgp', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                  signaturefile=os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                  keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'))['verified'] is True
+
+            # Keys imported for other requests must not be used
+            assert client.request('pgp', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                  signaturefile=os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                  keyfile=os.path.join(TEST_DIR, 'pgp_keys_ed25519.txt'))['verified'] is False
+        assert len(server.gpg_contexts) == 2
+
+    def test_pgp_context_locks_evicted(self, socket_path):
+        with IcetrustServer(socket_path, max_gpg_contexts=1) as server:
+            for keyfile in ['pgp_keys.txt', 'pgp_keys_ed25519.txt', 'file2.txt']:
+                server.handle_request({'command': 'pgp', 'filename': os.path.join(TEST_DIR, 'file1.txt'),
+                                       'signaturefile': os.path.join(TEST_DIR, 'file1.txt.sig'),
+                                       'keyfile': os.path.join(TEST_DIR, keyfile)})
+
+            # Locks are only kept for cached contexts, not for evicted ones or failed imports
+            assert len(server.gpg_contexts) == 1
+            assert list(server.context_locks) == list(server.gpg_contexts)
+
+    def test_pgp_missing_keys(self, server, socket_path):
+        with IcetrustClient(socket_path) as client:
+            response = client.request('pgp', filename=os.path.join(TEST_DIR, 'file1.txt'),
+                                      signaturefile=os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert response['verified'] is False
+        assert 'keyfile' in response['error']
+
+    def test_pipelined_requests(self, server, socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+            client_socket.connect(socket_path)
+            requests = [{'id': request_id, 'command': 'checksum',
+                         'filename': os.path.abspath(os.path.join(TEST_DIR, 'file1.txt' if request_id % 2 else
+                                                                  'file2.txt')),
+                         'checksum_value': FILE1_HASH} for request_id in range(100)]
+            client_socket.sendall(b''.join(json.dumps(request).encode('utf-8') + b'\n' for request in requests))
+            client_socket.shutdown(socket.SHUT_WR)
+            responses = [json.loads(line) for line in client_socket.makefile('rb')]
+        assert sorted(response['id'] for response in responses) == list(range(100))
+        assert all(response['verified'] == bool(response['id'] % 2) for response in responses)
+
+    def test_already_running(self, server, socket_path):
+        with pytest.raises(RuntimeError):
+            IcetrustServer(socket_path).bind()
+
+    def test_stale_socket(self, socket_path):
+        stale_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale_socket.bind(socket_path)
+        stale_socket.close()
+        server, thread = start_server(socket_path)
+        try:
+            with IcetrustClient(socket_path) as client:
+                assert client.request('ping')['verified'] is True
+        finally:
+            server.shutdown()
+            thread.join()
+            server.close()
+        assert not os.path.exists(socket_path)
+
+    def test_client_not_running(self, socket_path):
+        with pytest.raises(OSError):
+            IcetrustClient(socket_path).request('ping')
@@ -0,0 +1,271 @@
+#
+# Copyright (c) 2021 Nightwatch Cybersecurity.
+#
+# This file is part of icetrust
+# (see https://github.com/nightwatchcybersecurity/icetrust).
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from concurrent.futures import ThreadPoolExecutor
+import hashlib, os, random, threading
+
+import pytest
+
+from icetrust.utils import BACKEND_PGPY, GpgContext, VerificationCache
+import icetrust.utils_verifier
+from icetrust.utils_verifier import FAILURE_CHECKSUM_MISMATCH, FAILURE_CHECKSUM_NOT_FOUND, \
+    FAILURE_FILE_UNREADABLE, VerificationResult, Verifier
+from test_utils import FILE1_HASH, FILE2_HASH, TEST_DIR
+
+# Fingerprint of the key in pgp_keys.txt that signed the test files
+SIGNER_FINGERPRINT = 'D1A66E1A23B182C9980F788CFBFCC82A015E7330'
+
+
+@pytest.fixture()
+def verifier():
+    with Verifier() as verifier:
+        assert verifier.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+        yield verifier
+
+
+# Tests for VerificationResult class
+class TestVerificationResult(object):
+    def test_slots(self):
+        result = VerificationResult('foobar')
+        with pytest.raises(AttributeError):
+            result.foobar = True
+        assert not hasattr(result, '__dict__')
+
+    def test_bool(self):
+        result = VerificationResult('foobar')
+        assert not result
+        result.verified = True
+        assert result
+
+    def test_repr(self):
+        assert repr(VerificationResult('foobar')).startswith("VerificationResult(verified=False, failure=None")
+
+
+# Tests for Verifier.checksum() and Verifier.checksumfile()
+class TestVerifierChecksum(object):
+    def test_valid(self):
+        result = Verifier().checksum(os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH.upper() + '\n')
+        assert result.verified is True
+        assert result.failure is None
+        assert result.algorithm == 'sha256'
+        assert result.digest == FILE1_HASH
+        assert result.hash_time >= 0
+        assert result.total_time >= result.hash_time
+        assert result.verify_time is None
+
+    def test_invalid(self):
+        result = Verifier().checksum(os.path.join(TEST_DIR, 'file1.txt'), FILE2_HASH)
+        assert result.verified is False
+        assert result.failure == FAILURE_CHECKSUM_MISMATCH
+        assert result.digest == FILE1_HASH
+
+    def test_algorithm(self):
+        result = Verifier(algorithm='sha1').checksum(os.path.join(TEST_DIR, 'file1.txt'),
+                                                     '4045ed3c779e3b27760e4da357279508a8452dcb')
+        assert result.verified is True
+        assert result.algorithm == 'sha1'
+
+    def test_missing_file(self):
+        result = Verifier().checksum(os.path.join(TEST_DIR, 'foobar'), FILE1_HASH)
+        assert result.verified is False
+        assert result.failure == FAILURE_FILE_UNREADABLE
+        assert isinstance(result.error, FileNotFoundError)
+        assert result.digest is None
+
+    def test_invalid_algorithm(self):
+        with pytest.raises(ValueError):
+            Verifier(algorithm='foobar')
+        with pytest.raises(ValueError):
+            Verifier().checksum(os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH, algorithm='foobar')
+
+    def test_checksumfile(self):
+        result = Verifier().checksumfile(os.path.join(TEST_DIR, 'file1.txt'),
+                                         os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'))
+        assert result.verified is True
+        assert result.digest == FILE1_HASH
+
+    def test_checksumfile_not_found(self):
+        result = Verifier().checksumfile(os.path.join(TEST_DIR, 'file2.txt'),
+                                         os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'))
+        assert result.verified is False
+        assert result.failure == FAILURE_CHECKSUM_NOT_FOUND
+        assert result.digest == FILE2_HASH
+
+    def test_checksumfile_missing(self):
+        result = Verifier().checksumfile(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'foobar'))
+        assert result.verified is False
+        assert result.failure == FAILURE_FILE_UNREADABLE
+
+
+# Tests for Verifier.pgp() and Verifier.pgpchecksumfile()
+class TestVerifierPgp(object):
+    def test_valid(self, verifier):
+        result = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert result.verified is True
+        assert result.failure is None
+        assert result.fingerprint == SIGNER_FINGERPRINT
+        assert result.key_id is not None
+        assert result.verify_time > 0
+        assert result.digest is None
+
+    def test_invalid_wrong_file(self, verifier):
+        result = verifier.pgp(os.path.join(TEST_DIR, 'file2.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert result.verified is False
+        assert result.failure == 'signature bad'
+
+    def test_invalid_no_keys(self):
+        with Verifier() as verifier:
+            result = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert result.verified is False
+        assert result.failure == 'no public key'
+
+    def test_invalid_revoked_key(self):
+        with Verifier() as verifier:
+            verifier.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys_revoked.txt'))
+            result = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'),
+                                  os.path.join(TEST_DIR, 'file1.txt.revoked.sig'))
+        assert result.verified is False
+        assert result.failure == 'signing key was revoked'
+
+    def test_missing_signature(self, verifier):
+        result = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'foobar'))
+        assert result.verified is False
+        assert result.failure == FAILURE_FILE_UNREADABLE
+        assert isinstance(result.error, FileNotFoundError)
+
+    def test_pgpy_backend(self):
+        with Verifier(backend=BACKEND_PGPY) as verifier:
+            verifier.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'))
+            result = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert result.verified is True
+        assert result.fingerprint == SIGNER_FINGERPRINT
+
+    def test_gpg_context(self):
+        with GpgContext(trust_keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as gpg_context:
+            with Verifier(gpg_context=gpg_context) as verifier:
+                assert verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'),
+                                    os.path.join(TEST_DIR, 'file1.txt.sig')).verified is True
+
+            # Contexts passed in are not closed by the verifier
+            assert os.path.isdir(gpg_context.gpg.gnupghome)
+
+    def test_verification_cache(self, tmp_path):
+        with Verifier(verification_cache=VerificationCache(str(tmp_path))) as verifier:
+            verifier.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt'))
+            first = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+            second = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert first.verified is True and first.cached is False
+        assert second.verified is True and second.cached is True
+        assert second.fingerprint == SIGNER_FINGERPRINT
+
+    def test_pgpchecksumfile(self, verifier):
+        result = verifier.pgpchecksumfile(os.path.join(TEST_DIR, 'file1.txt'),
+                                          os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                          os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS.sig'))
+        assert result.verified is True
+        assert result.digest == FILE1_HASH
+        assert result.fingerprint == SIGNER_FINGERPRINT
+        assert result.hash_time >= 0 and result.verify_time > 0
+
+    def test_pgpchecksumfile_wrong_signature(self, verifier):
+        result = verifier.pgpchecksumfile(os.path.join(TEST_DIR, 'file1.txt'),
+                                          os.path.join(TEST_DIR, 'file1.txt.SHA256SUMS'),
+                                          os.path.join(TEST_DIR, 'file1.txt.sig'))
+        assert result.verified is False
+        assert result.failure == 'signature bad'
+
+        # The file isn't hashed if the checksum file can't be trusted
+        assert result.digest is None
+
+    def test_import_keys_invalid_arguments(self, verifier):
+        with pytest.raises(ValueError):
+            verifier.import_keys(keyid='12345')
+
+
+# Tests for sharing a Verifier between threads
+class TestVerifierThreads(object):
+    def test_gpg_context_created_once(self, monkeypatch):
+        contexts = []
+
+        class CountingGpgContext(GpgContext):
+            def __init__(self, **kwargs):
+                contexts.append(self)
+                super(CountingGpgContext, self).__init__(**kwargs)
+
+        monkeypatch.setattr(icetrust.utils_verifier, 'GpgContext', CountingGpgContext)
+        barrier = threading.Barrier(8)
+
+        def verify(_):
+            barrier.wait()
+            return verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+
+        with Verifier(trust_keyring=os.path.join(TEST_DIR, 'pubring.kbx')) as verifier:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                assert all(result.verified for result in executor.map(verify, range(8)))
+        assert len(contexts) == 1
+
+    def test_hash_buffer_per_thread(self):
+        buffers = set()
+
+        def verify(_):
+            result = verifier.checksum(os.path.join(TEST_DIR, 'file1.txt'), FILE1_HASH)
+            buffers.add(id(verifier.local.buffer))
+            return result
+
+        with Verifier() as verifier:
+            # A single-threaded pool reuses the same buffer for every file
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                assert all(result.verified for result in executor.map(verify, range(10)))
+        assert len(buffers) == 1
+
+    @pytest.mark.slow
+    def test_stress(self, tmp_path):
+        # Files of different sizes, including ones larger than the read buffer
+        checksums = dict()
+        for index in range(3000):
+            data = os.urandom((index % 40) * 1000 + (200000 if index % 100 == 0 else index))
+            filename = os.path.join(tmp_path, 'file' + str(index) + '.bin')
+            with open(filename, 'wb') as file:
+                file.write(data)
+            checksums[filename] = hashlib.sha256(data).hexdigest()
+
+        def verify(index):
+            if index >= 6000:
+                result = verifier.pgp(os.path.join(TEST_DIR, 'file1.txt'), os.path.join(TEST_DIR, 'file1.txt.sig'))
+                return result.verified is True and result.fingerprint == SIGNER_FINGERPRINT
+            filename = os.path.join(tmp_path, 'file' + str(index % 3000) + '.bin')
+            if index % 7 == 0:
+                result = verifier.checksum(filename, FILE1_HASH)
+                return result.verified is False and result.digest == checksums[filename]
+            result = verifier.checksum(filename, checksums[filename])
+            return result.verified is True and result.digest == checksums[filename]
+
+        # Each file is verified twice, the second time from the hash cache, with signature verifications mixed in
+        with Verifier() as verifier:
+            assert verifier.import_keys(keyfile=os.path.join(TEST_DIR, 'pgp_keys.txt')) is True
+            with ThreadPoolExecutor(max_workers=32) as executor:
+                tasks = list(range(6100))
+                random.Random(0).shuffle(tasks)
+                results = list(executor.map(verify, tasks))
+            assert len(verifier.hash_cache.entries) == 3000
+        assert all(results)